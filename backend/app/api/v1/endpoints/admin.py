@@ -1,11 +1,12 @@
-import json
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from motor.motor_asyncio import AsyncIOMotorClient
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session, joinedload
 from typing import List, Union, Optional
 import datetime
 import redis.asyncio as redis
-from app.db.session import get_db, get_mongo_db, get_redis_client
+from app.db.session import get_db, get_async_db, get_mongo_db, get_redis_client
 from app.security.dependencies import get_current_user_from_cookie
 from app.security.hashing import Hasher
 from app.models import Admin, User, Group, GroupMember
@@ -16,6 +17,13 @@ from app.schemas.admin import ConversationSummary
 from app.schemas.message import PaginatedMessageResponse
 from app.websocket.connection_manager import manager
 from app.cache.group_members import remove_group_from_cache, add_member_to_cache, remove_member_from_cache
+from app.cache.presence import get_online_connection_ids
+from app.cache.principals import invalidate_principal
+from app.security.revocation import revocation_list
+from app.db.read_cursors import get_last_read, private_conversation, group_conversation, is_read
+from app.cache.unread import clear_unread
+from app.db.conversations import private_conversation_key
+from app.db.pagination import BEFORE, AFTER, decode_cursor, keyset_filter, keyset_sort, page_cursors, parse_fields
 
 router = APIRouter()
 
@@ -33,22 +41,22 @@ def get_admin_from_dependency(current_entity: Union[User, Admin] = Depends(get_c
 # --- User Management by Admin ---
 
 @router.post("/users", response_model=UserOut, status_code=status.HTTP_201_CREATED)
-def create_user_for_admin(
+async def create_user_for_admin(
     user_in: UserCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_admin: Admin = Depends(get_admin_from_dependency)
 ):
     # ... (logic remains the same)
     full_name = user_in.full_name if user_in.full_name else None
     full_username = f"{user_in.username}{current_admin.admin_key}"
-    db_user = db.query(User).filter(User.username == full_username).first()
+    db_user = await db.scalar(select(User).filter(User.username == full_username))
     if db_user:
         raise HTTPException(status_code=400, detail=f"Username '{user_in.username}' already exists in your tenant.")
-    hashed_password = Hasher.get_password_hash(user_in.password)
+    hashed_password = await Hasher.get_password_hash_async(user_in.password)
     new_user = User(full_name=full_name, username=full_username, password_hash=hashed_password, admin_id=current_admin.id)
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     return new_user
 
 @router.get("/users/all", response_model=List[UserOut])
@@ -75,78 +83,87 @@ def list_deactivated_users_for_admin(
     return db.query(User).filter(User.admin_id == current_admin.id, User.is_active == False).all()
 
 @router.get("/users/online", response_model=List[UserOut])
-def get_online_users(
-    db: Session = Depends(get_db),
+async def get_online_users(
+    db: AsyncSession = Depends(get_async_db),
+    redis_client: redis.Redis = Depends(get_redis_client),
     current_admin: Admin = Depends(get_admin_from_dependency)
 ):
     """Gets a list of all online users within the current admin's tenant."""
-    online_connection_ids = manager.get_all_connection_ids()
+    online_connection_ids = await get_online_connection_ids(current_admin.id, redis_client)
     online_user_ids = [int(cid.split('-')[1]) for cid in online_connection_ids if cid.startswith('user-')]
 
     # Fetch details only for online users that belong to this admin's tenant
-    online_users_in_tenant = db.query(User).filter(
+    online_users_in_tenant = await db.scalars(select(User).filter(
         User.id.in_(online_user_ids),
         User.admin_id == current_admin.id
-    ).all()
-    return online_users_in_tenant
+    ))
+    return online_users_in_tenant.all()
 
 @router.patch("/users/{user_id}/deactivate", status_code=status.HTTP_204_NO_CONTENT)
 async def deactivate_user(
     user_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
+    redis_client: redis.Redis = Depends(get_redis_client),
     current_admin: Admin = Depends(get_admin_from_dependency)
 ):
-    user = db.query(User).filter(User.id == user_id, User.admin_id == current_admin.id).first()
+    user = await db.scalar(select(User).filter(User.id == user_id, User.admin_id == current_admin.id))
     if not user:
         raise HTTPException(status_code=404, detail="User not found in your tenant.")
     user.is_active = False
-    db.commit()
+    await db.commit()
+    await invalidate_principal("user", user.username, redis_client)
+    # Tokens already handed out stop working right away, not when they expire
+    await revocation_list.revoke_subject("user", user.username, redis_client)
     user_connection_id = f"user-{user.id}"
-    if user_connection_id in manager.active_connections:
-        logout_command = json.dumps({"event": "force_logout", "reason": "Your account has been deactivated by the administrator."})
+    if await manager.is_connected(user_connection_id):
+        logout_command = {"event": "force_logout", "reason": "Your account has been deactivated by the administrator."}
         await manager.send_personal_message(logout_command, user_connection_id)
-        manager.disconnect(user_connection_id)
+        await manager.close_connection(user_connection_id)
     return
 
 @router.patch("/users/{user_id}/reactivate", status_code=status.HTTP_204_NO_CONTENT)
-def reactivate_user(
+async def reactivate_user(
     user_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
+    redis_client: redis.Redis = Depends(get_redis_client),
     current_admin: Admin = Depends(get_admin_from_dependency)
 ):
-    # ... (logic remains the same)
-    user = db.query(User).filter(User.id == user_id, User.admin_id == current_admin.id).first()
+    user = await db.scalar(select(User).filter(User.id == user_id, User.admin_id == current_admin.id))
     if not user:
         raise HTTPException(status_code=404, detail="User not found in your tenant.")
     user.is_active = True
-    db.commit()
+    await db.commit()
+    await invalidate_principal("user", user.username, redis_client)
     return
 
 @router.patch("/users/{user_id}/reset-password", status_code=status.HTTP_204_NO_CONTENT)
 async def reset_user_password(
     user_id: int,
     password_data: UserPasswordReset,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
+    redis_client: redis.Redis = Depends(get_redis_client),
     current_admin: Admin = Depends(get_admin_from_dependency)
 ):
     """
     Resets the password for a specific user within the admin's tenant.
     """
     # Find the user and verify they belong to the admin's tenant
-    user = db.query(User).filter(User.id == user_id, User.admin_id == current_admin.id).first()
+    user = await db.scalar(select(User).filter(User.id == user_id, User.admin_id == current_admin.id))
     if not user:
         raise HTTPException(status_code=404, detail="User not found in your tenant.")
 
     # Hash the new password and update the user's record
-    hashed_password = Hasher.get_password_hash(password_data.new_password)
+    hashed_password = await Hasher.get_password_hash_async(password_data.new_password)
     user.password_hash = hashed_password
     
-    db.commit()
+    await db.commit()
+    await invalidate_principal("user", user.username, redis_client)
+    await revocation_list.revoke_subject("user", user.username, redis_client)
     user_connection_id = f"user-{user.id}"
-    if user_connection_id in manager.active_connections:
-        logout_command = json.dumps({"event": "force_logout", "reason": "Please re-authenticate yourself as admin has reset your password."})
+    if await manager.is_connected(user_connection_id):
+        logout_command = {"event": "force_logout", "reason": "Please re-authenticate yourself as admin has reset your password."}
         await manager.send_personal_message(logout_command, user_connection_id)
-        manager.disconnect(user_connection_id)
+        await manager.close_connection(user_connection_id)
     return
 
 # --- Group Management by Admin ---
@@ -154,50 +171,50 @@ async def reset_user_password(
 @router.post("/groups", response_model=GroupOut, status_code=status.HTTP_201_CREATED)
 async def create_group_for_admin(
     group_in: GroupCreateWithMembers,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     redis_client: redis.Redis = Depends(get_redis_client), # Inject Redis client
     current_admin: Admin = Depends(get_admin_from_dependency)
 ):
-    db_group = db.query(Group).filter(Group.name == group_in.name, Group.admin_id == current_admin.id).first()
+    db_group = await db.scalar(select(Group).filter(Group.name == group_in.name, Group.admin_id == current_admin.id))
     if db_group:
         raise HTTPException(status_code=400, detail=f"Group name '{group_in.name}' already exists in your tenant.")
     
     new_group = Group(name=group_in.name, admin_id=current_admin.id)
     db.add(new_group)
-    db.flush()
+    await db.flush()
 
     if group_in.members:
         for user_id in group_in.members:
-            user = db.query(User).filter(User.id == user_id, User.admin_id == current_admin.id).first()
+            user = await db.scalar(select(User).filter(User.id == user_id, User.admin_id == current_admin.id))
             if user:
                 new_member = GroupMember(group_id=new_group.id, user_id=user.id)
                 db.add(new_member)
                 await add_member_to_cache(new_group.id, f"user-{user.id}", redis_client)
 
-    db.commit()
-    db.refresh(new_group)
+    await db.commit()
+    await db.refresh(new_group)
     return new_group
 
 @router.post("/groups/{group_id}/members/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def add_user_to_group(
     group_id: int,
     user_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     redis_client: redis.Redis = Depends(get_redis_client), # Inject Redis client
     current_admin: Admin = Depends(get_admin_from_dependency)
 ):
     # ... (verification logic for group and user is unchanged) ...
-    group = db.query(Group).filter(Group.id == group_id, Group.admin_id == current_admin.id).first()
+    group = await db.scalar(select(Group).filter(Group.id == group_id, Group.admin_id == current_admin.id))
     if not group:
         raise HTTPException(status_code=404, detail="Group not found in your tenant.")
-    user = db.query(User).filter(User.id == user_id, User.admin_id == current_admin.id).first()
+    user = await db.scalar(select(User).filter(User.id == user_id, User.admin_id == current_admin.id))
     if not user:
         raise HTTPException(status_code=404, detail="User not found in your tenant.")
 
-    membership = db.query(GroupMember).filter(
+    membership = await db.scalar(select(GroupMember).filter(
         GroupMember.group_id == group_id, 
         GroupMember.user_id == user_id
-    ).first()
+    ))
     
     if membership:
         if membership.is_member_active:
@@ -209,7 +226,7 @@ async def add_user_to_group(
         new_member = GroupMember(group_id=group_id, user_id=user_id)
         db.add(new_member)
     
-    db.commit()
+    await db.commit()
     
     await add_member_to_cache(group_id, f"user-{user_id}", redis_client)
     
@@ -219,31 +236,40 @@ async def add_user_to_group(
 async def remove_user_from_group(
     group_id: int,
     user_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     redis_client: redis.Redis = Depends(get_redis_client), # Inject Redis client
     current_admin: Admin = Depends(get_admin_from_dependency)
 ):
     # ... (verification logic is unchanged) ...
-    group = db.query(Group).filter(Group.id == group_id, Group.admin_id == current_admin.id).first()
+    group = await db.scalar(select(Group).filter(Group.id == group_id, Group.admin_id == current_admin.id))
     if not group:
         raise HTTPException(status_code=404, detail="Group not found in your tenant.")
-    membership = db.query(GroupMember).filter(GroupMember.group_id == group_id, GroupMember.user_id == user_id).first()
+    membership = await db.scalar(select(GroupMember).filter(GroupMember.group_id == group_id, GroupMember.user_id == user_id))
     if not membership:
         raise HTTPException(status_code=404, detail="User is not a member of this group.")
 
     membership.is_member_active = False
     membership.removed_at = datetime.datetime.utcnow()
-    db.commit()
+    await db.commit()
     
     user_connection_id = f"user-{user_id}"
     await remove_member_from_cache(group_id, user_connection_id, redis_client)
+
+    # A removed member no longer counts the group's messages as unread
+    removed_conversation = group_conversation(group_id)
+    await clear_unread(user_connection_id, removed_conversation, redis_client)
+    await manager.send_personal_message({
+        "event": "unread_update",
+        "conversation": removed_conversation,
+        "unread_count": 0,
+    }, user_connection_id)
     
-    if user_connection_id in manager.active_connections:
-        notification_payload = json.dumps({
+    if await manager.is_connected(user_connection_id):
+        notification_payload = {
             "event": "member_removed",
             "type": "group",
             "id": group_id
-        })
+        }
         await manager.send_personal_message(notification_payload, user_connection_id)
         # print(f"Sent 'member_removed' notification to {user_connection_id}")
 
@@ -314,23 +340,23 @@ def list_deactivated_groups_with_members(
     return result
 
 @router.delete("/groups/{group_id}", status_code=status.HTTP_204_NO_CONTENT)
-def deactivate_group(
+async def deactivate_group(
     group_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_admin: Admin = Depends(get_admin_from_dependency),
     redis_client: redis.Redis = Depends(get_redis_client)
 ):
-    group = db.query(Group).filter(Group.id == group_id, Group.admin_id == current_admin.id).first()
+    group = await db.scalar(select(Group).filter(Group.id == group_id, Group.admin_id == current_admin.id))
     if not group:
         raise HTTPException(status_code=404, detail="Group not found in your tenant.")
     group.is_active = False
-    db.commit()
-    remove_group_from_cache(group_id, redis_client) # Pass the Redis client to the cache function
+    await db.commit()
+    await remove_group_from_cache(group_id, redis_client) # Pass the Redis client to the cache function
     return
 
 @router.get("/conversations/users", response_model=List[ConversationSummary])
 async def list_user_to_user_conversations(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     mongo_db: AsyncIOMotorClient = Depends(get_mongo_db),
     current_admin: Admin = Depends(get_admin_from_dependency)
 ):
@@ -339,7 +365,7 @@ async def list_user_to_user_conversations(
     sorted by the most recent message.
     """
     # 1. Get all user IDs for the current admin's tenant
-    tenant_user_ids = [user.id for user in db.query(User.id).filter(User.admin_id == current_admin.id).all()]
+    tenant_user_ids = list(await db.scalars(select(User.id).filter(User.admin_id == current_admin.id)))
     if not tenant_user_ids:
         return []
 
@@ -353,15 +379,14 @@ async def list_user_to_user_conversations(
             "sender.role": "user",
             "receiver.role": "user",
             "sender.id": {"$in": tenant_user_ids},
-            "receiver.id": {"$in": tenant_user_ids}
+            "receiver.id": {"$in": tenant_user_ids},
+            # Messages not yet backfilled by migration 0002 would all share a null key
+            "conversation_key": {"$exists": True}
         }},
-        # Group by a canonical key (sorted participants)
+        # Group by the conversation key stamped on every message
         {"$group": {
-            "_id": {
-                "participants": {
-                    "$sortArray": {"input": ["$sender", "$receiver"], "sortBy": {"id": 1}}
-                }
-            },
+            "_id": "$conversation_key",
+            "participants": {"$first": ["$sender", "$receiver"]},
             "last_message_timestamp": {"$max": "$timestamp"},
             "message_count": {"$sum": 1}
         }},
@@ -374,7 +399,7 @@ async def list_user_to_user_conversations(
     # 3. Format the response
     response = []
     for item in aggregation_result:
-        participants = item["_id"]["participants"]
+        participants = sorted(item["participants"], key=lambda participant: participant["id"])
         response.append({
             "user_one": {"id": participants[0]["id"], "username": participants[0]["username"]},
             "user_two": {"id": participants[1]["id"], "username": participants[1]["username"]},
@@ -388,56 +413,62 @@ async def list_user_to_user_conversations(
 async def get_user_to_user_message_history(
     user1_id: int,
     user2_id: int,
-    before: Optional[str] = Query(None, description="ISO timestamp cursor for pagination"),
+    before: Optional[str] = Query(None, description="Cursor: return older messages, newest first"),
+    after: Optional[str] = Query(None, description="Cursor: return newer messages, oldest first"),
+    fields: Optional[str] = Query(None, description="Comma-separated message fields to return, e.g. 'content.text,is_deleted'"),
     limit: int = Query(50, gt=0, le=100),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     mongo_db: AsyncIOMotorClient = Depends(get_mongo_db),
     current_admin: Admin = Depends(get_admin_from_dependency)
 ):
     """
     Fetches the detailed message history for a specific user-to-user conversation.
     """
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either 'before' or 'after', not both.")
+    try:
+        # Read status is worked out from the receiver's watermark
+        projection = parse_fields(fields, always=("receiver",))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     # 1. Security Check: Verify both users belong to the admin's tenant
-    users = db.query(User).filter(User.id.in_([user1_id, user2_id]), User.admin_id == current_admin.id).all()
+    users = (await db.scalars(select(User).filter(User.id.in_([user1_id, user2_id]), User.admin_id == current_admin.id))).all()
     if len(users) != 2:
         raise HTTPException(status_code=404, detail="One or both users not found in your tenant.")
 
     # 2. Build the MongoDB query
     messages_collection = mongo_db["messages"]
-    query = {
-        "$or": [
-            {"sender.id": user1_id, "receiver.id": user2_id},
-            {"sender.id": user2_id, "receiver.id": user1_id}
-        ],
-        "type": "private"
-    }
+    query = {"conversation_key": private_conversation_key("user", user1_id, "user", user2_id)}
 
-    if before:
+    direction = AFTER if after else BEFORE
+    cursor = after or before
+    if cursor:
         try:
-            cursor_time = datetime.datetime.fromisoformat(before.replace("Z", "+00:00"))
-            query["timestamp"] = {"$lt": cursor_time}
+            cursor_time, cursor_id = decode_cursor(cursor)
         except ValueError:
-            raise HTTPException(status_code=400, detail="Invalid 'before' timestamp format.")
+            raise HTTPException(status_code=400, detail=f"Invalid '{direction}' cursor.")
+        query.update(keyset_filter(direction, cursor_time, cursor_id))
             
     # 3. Fetch messages
-    messages_cursor = messages_collection.find(query).sort("timestamp", -1).limit(limit)
+    messages_cursor = messages_collection.find(query, projection).sort(keyset_sort(direction)).limit(limit)
     messages = await messages_cursor.to_list(length=limit)
 
+    # Each user's read watermark for the other side of the conversation
+    last_read_at = {
+        user1_id: await get_last_read(mongo_db, {"id": user1_id, "role": "user"}, private_conversation(user2_id, "user")),
+        user2_id: await get_last_read(mongo_db, {"id": user2_id, "role": "user"}, private_conversation(user1_id, "user")),
+    }
+
     for msg in messages:
         msg["_id"] = str(msg["_id"])
-        receiver_identity = {
-            "id": msg["receiver"]["id"],
-            "role": msg["receiver"]["role"]
-        }
         
-        # Check if the receiver's identity object is in the read_by array
-        if receiver_identity in msg.get("read_by", []):
+        # The message is read once the receiver's watermark has passed it
+        if is_read(msg["timestamp"], last_read_at.get(msg["receiver"]["id"])):
             msg["status"] = "read"
         else:
             msg["status"] = "sent"
 
-    next_cursor = None
-    if len(messages) == limit:
-        next_cursor = messages[-1]['timestamp'].isoformat() + "Z"
+    next_cursor, prev_cursor = page_cursors(messages, direction, limit)
         
-    return {"messages": messages, "next_cursor": next_cursor}
\ No newline at end of file
+    return {"messages": messages, "next_cursor": next_cursor, "prev_cursor": prev_cursor}
\ No newline at end of file
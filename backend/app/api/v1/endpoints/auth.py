@@ -1,11 +1,15 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Response, Request
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List
+import redis.asyncio as redis
 
-from app.db.session import get_db
+from app.db.session import get_async_db, get_redis_client
 from app.schemas.user import UserLoginSchema
 from app.security.hashing import Hasher
-from app.security.jwt import create_access_token, create_refresh_token, verify_token
-from app.models import User, Admin, SuperAdmin
+from app.security.throttle import check_login_throttle, record_failed_login, clear_failed_logins
+from app.security.jwt import create_access_token, create_refresh_token, verify_token, get_token_id
+from app.security.revocation import revocation_list
+from app.cache.principals import get_principal, get_login_candidates
 
 router = APIRouter()
 
@@ -37,54 +41,64 @@ def delete_auth_cookies(response: Response):
     response.delete_cookie(key="access_token")
     response.delete_cookie(key="refresh_token")
 
+async def track_issued_tokens(role: str, username: str, tokens: List[str], redis_client: redis.Redis):
+    """Records issued tokens against their subject, so they can all be revoked later."""
+    for token in tokens:
+        jti, exp = get_token_id(token)
+        await revocation_list.track(role, username, jti, exp, redis_client)
+
 @router.post("/login", status_code=status.HTTP_204_NO_CONTENT)
-def login(response: Response, user_credentials: UserLoginSchema, db: Session = Depends(get_db)):
+async def login(
+    request: Request,
+    response: Response,
+    user_credentials: UserLoginSchema,
+    db: AsyncSession = Depends(get_async_db),
+    redis_client: redis.Redis = Depends(get_redis_client)
+):
     """
     Handles login and sets HttpOnly cookies for access and refresh tokens.
     Now includes a check to ensure the user/admin is active.
+    Throttled per client address and per username before any hashing happens.
     """
+    client_ip = request.client.host if request.client else "unknown"
+    await check_login_throttle(user_credentials.username, client_ip, redis_client)
+
     entity = None
-    role = None
-    tenant_id = None
     
     inactive_exception = HTTPException(
         status_code=status.HTTP_403_FORBIDDEN,
         detail="Your account has been deactivated. Please contact your administrator."
     )
 
-    # Check across user, admin, and super_admin tables
-    user = db.query(User).filter(User.username == user_credentials.username).first()
-    if user:
-        if not user.is_active:
+    # Check across user, admin, and super_admin tables in one query; a
+    # deactivated account stops the search, a wrong password falls through
+    for candidate in await get_login_candidates(user_credentials.username, db):
+        if not candidate.is_active:
             raise inactive_exception
-        if Hasher.verify_password(user_credentials.password, user.password_hash):
-            entity, role, tenant_id = user, "user", user.admin_id
-    
-    if not entity:
-        admin = db.query(Admin).filter(Admin.username == user_credentials.username).first()
-        if admin:
-            if not admin.is_active:
-                raise inactive_exception
-            if Hasher.verify_password(user_credentials.password, admin.password_hash):
-                entity, role, tenant_id = admin, "admin", admin.id
-
-    if not entity:
-        super_admin = db.query(SuperAdmin).filter(SuperAdmin.username == user_credentials.username).first()
-        if super_admin and Hasher.verify_password(user_credentials.password, super_admin.password_hash):
-            entity, role, tenant_id = super_admin, "super_admin", None
+        if await Hasher.verify_password_async(user_credentials.password, candidate.password_hash):
+            entity = candidate
+            break
 
     if not entity:
+        await record_failed_login(user_credentials.username, redis_client)
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect username or password")
+    await clear_failed_logins(user_credentials.username, redis_client)
+    role, tenant_id = entity.role, entity.tenant_id
 
     token_data = {"sub": entity.username, "role": role, "tenant_id": tenant_id}
     access_token = create_access_token(data=token_data)
     refresh_token = create_refresh_token(data=token_data)
+    await track_issued_tokens(role, entity.username, [access_token, refresh_token], redis_client)
 
     set_auth_cookies(response, access_token, refresh_token)
     return
 
 @router.post("/refresh", status_code=status.HTTP_204_NO_CONTENT)
-def refresh_token(request: Request, response: Response, db: Session = Depends(get_db)):
+async def refresh_token(
+    request: Request,
+    response: Response,
+    redis_client: redis.Redis = Depends(get_redis_client)
+):
     """
     Uses the refresh_token from cookies to issue a new access_token.
     Now includes a check to ensure the user/admin is still active.
@@ -94,14 +108,12 @@ def refresh_token(request: Request, response: Response, db: Session = Depends(ge
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="No refresh token found")
     
     credentials_exception = HTTPException(status_code=401, detail="Could not validate refresh token")
-    token_data = verify_token(refresh_token, credentials_exception)
+    token_data = await verify_token(refresh_token, credentials_exception)
     
     # *** FIX IS HERE: Verify the user from the token is still active ***
     entity_to_check = None
-    if token_data.role == "user":
-        entity_to_check = db.query(User).filter(User.username == token_data.username).first()
-    elif token_data.role == "admin":
-        entity_to_check = db.query(Admin).filter(Admin.username == token_data.username).first()
+    if token_data.role in ("user", "admin"):
+        entity_to_check = await get_principal(token_data.role, token_data.username)
 
     if entity_to_check and not entity_to_check.is_active:
         # If the user has been deactivated, invalidate their session by deleting cookies
@@ -114,6 +126,7 @@ def refresh_token(request: Request, response: Response, db: Session = Depends(ge
     # Re-create the payload for the new access token
     new_token_data = {"sub": token_data.username, "role": token_data.role, "tenant_id": token_data.tenant_id}
     new_access_token = create_access_token(data=new_token_data)
+    await track_issued_tokens(token_data.role, token_data.username, [new_access_token], redis_client)
     
     response.set_cookie(key="access_token", 
                         value=new_access_token, 
@@ -127,7 +140,22 @@ def refresh_token(request: Request, response: Response, db: Session = Depends(ge
     return
 
 @router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
-def logout(response: Response):
-    """Logs the user out by deleting the auth cookies."""
+async def logout(
+    request: Request,
+    response: Response,
+    redis_client: redis.Redis = Depends(get_redis_client)
+):
+    """Logs the user out by revoking both tokens and deleting the auth cookies."""
+    for cookie_name in ("access_token", "refresh_token"):
+        token = request.cookies.get(cookie_name)
+        if not token:
+            continue
+        try:
+            token_data = await verify_token(token, HTTPException(status_code=401))
+        except HTTPException:
+            # Already expired, revoked or not ours; nothing to revoke
+            continue
+        if token_data.jti:
+            await revocation_list.revoke(token_data.jti, token_data.exp, redis_client)
     delete_auth_cookies(response)
     return
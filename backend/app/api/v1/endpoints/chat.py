@@ -1,65 +1,33 @@
-import json
+import asyncio
 from datetime import datetime
 from bson import ObjectId
 import pytz
-from typing import Union
+from typing import Optional, Union
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, Query, HTTPException, BackgroundTasks
-from sqlalchemy.orm import Session
+from sqlalchemy import select
 from motor.motor_asyncio import AsyncIOMotorClient
 import redis.asyncio as redis
-from app.db.session import get_db, get_mongo_db, get_redis_client
+from app.db.session import get_mongo_db, get_redis_client, AsyncSessionLocal
 from app.security.jwt import verify_token
 from app.models import User, Admin
 from app.websocket.connection_manager import manager
+from app.websocket.protocol import Frame, receive_event
+from app.websocket.presence import presence_aggregator, mark_offline
+from app.websocket.replay import replay_buffer
 from app.cache.group_members import get_group_members
 from app.cache.tenant_members import get_tenant_connection_ids
-
-from app.db.session import get_db, get_mongo_db, SessionLocal
+from app.cache.last_seen import last_seen_buffer
+from app.cache.principals import get_principal
+from app.db.message_batcher import message_batcher
+from app.db.conversations import conversation_key_for_message, private_conversation_key, group_conversation_key
+from app.cache.sequences import allocate_seq
+from app.db.conversation_summaries import record_message, record_deletion
+from app.cache.unread import record_unread, settle_unread, message_conversation
+from app.db.read_cursors import mark_read, private_conversation, group_conversation
+from app.cache.presence import set_presence, get_presence_snapshot, get_presence_changes_since, seed_presence, filter_states
 
 router = APIRouter()
 
-async def broadcast_presence_update(tenant_id: int, user_id: int, role: str, status: str, db: Session, redis_client: redis.Redis):
-    """Broadcasts a user's online/offline status to all users in the same tenant using the cache."""
-    # Use the cache to get the list of who to notify
-    # broadcast_list = get_tenant_connection_ids(tenant_id, db)
-    broadcast_list = await get_tenant_connection_ids(tenant_id, db, redis_client)
-    timestamp = datetime.utcnow().isoformat() + "Z" if status == "offline" else None
-    payload = json.dumps({
-        "event": "presence_update",
-        "user": {"id": user_id, "role": role},
-        "status": status,
-        "timestamp": timestamp,
-        # "timestamp": datetime.now(pytz.timezone('Asia/Kolkata')).isoformat()
-    })
-    print(f"BROADCASTING PRESENCE UPDATE: {payload} to {broadcast_list}")
-    await manager.broadcast_to_users(payload, list(broadcast_list))
-
-def update_last_seen(entity_id: int, entity_role: str):
-    """
-    Synchronously updates the last_seen timestamp for a user or admin.
-    This function creates its own DB session to ensure atomicity.
-    """
-    db = SessionLocal()
-    try:
-        if entity_role == "user":
-            db_entity = db.query(User).filter(User.id == entity_id).first()
-        elif entity_role == "admin":
-            db_entity = db.query(Admin).filter(Admin.id == entity_id).first()
-        else:
-            return
-
-        if db_entity:
-            db_entity.last_seen = datetime.utcnow()
-            db.commit()
-            # print(f"SYNC: Successfully updated last_seen for {entity_role} {entity_id}")
-        else:
-            print(f"No {entity_role} found with ID {entity_id}")
-    except Exception as e:
-        print(f"Error in update_last_seen_sync: {e}")
-        db.rollback()
-    finally:
-        db.close()
-
 async def mark_messages_as_received(user_id: int, user_role: str, db: AsyncIOMotorClient):
     """Background task to update 'sent' messages to 'received'."""
     messages_collection = db["messages"]
@@ -80,19 +48,144 @@ async def mark_messages_as_received(user_id: int, user_role: str, db: AsyncIOMot
 
     for msg in sent_messages:
         sender_connection_id = f"{msg['sender']['role']}-{msg['sender']['id']}"
-        status_update_payload = json.dumps({
+        status_update_payload = {
             "event": "status_update",
             "message_id": str(msg["_id"]),
             "status": "received"
-        })
+        }
         await manager.send_personal_message(status_update_payload, sender_connection_id)
 
 
+def message_conversation_context(message: dict) -> dict:
+    """The conversation of a message as its sender sees it, for acks and failures."""
+    receiver_data = message.get("receiver")
+    group_data = message.get("group")
+    if receiver_data:
+        return {"type": "private", "id": receiver_data["id"], "role": receiver_data["role"]}
+    if group_data:
+        return {"type": "group", "id": group_data["id"], "role": None}
+    return {}
+
+async def resolve_read_position(
+    messages_collection,
+    conversation_key: str,
+    last_message_id: Optional[str]
+) -> Optional[datetime]:
+    """
+    The timestamp a read receipt moves the reader's watermark to: that of the
+    last message the client displayed, as stored. Receipts without one (older
+    clients) fall back to the conversation's newest stored message, so
+    messages still being inserted are never covered. None if there is
+    nothing to mark read.
+    """
+    if last_message_id:
+        try:
+            message_filter = {"_id": ObjectId(last_message_id), "conversation_key": conversation_key}
+        except Exception:
+            return None
+        message = await messages_collection.find_one(message_filter, projection={"timestamp": 1})
+    else:
+        message = await messages_collection.find_one(
+            {"conversation_key": conversation_key},
+            projection={"timestamp": 1},
+            sort=[("timestamp", -1), ("_id", -1)],
+        )
+    return message["timestamp"] if message else None
+
+async def deliver_new_message(
+    mongo_message: dict,
+    inserted: asyncio.Future,
+    previous_delivery: Optional[asyncio.Task],
+    temp_id: Optional[str],
+    connection_id_str: str,
+    session_id: str,
+    mongo_db: AsyncIOMotorClient,
+    redis_client: redis.Redis
+):
+    """
+    Broadcasts a new message and acks it to the sender once its batched insert lands.
+    Waits for the sender's previous delivery first, so a socket's messages are
+    fanned out in the order they were sent.
+    """
+    try:
+        message_id = await inserted
+    except Exception as e:
+        print(f"Error persisting message from {connection_id_str}: {e}")
+        # Tell the sending tab, so it can drop its optimistic copy or retry
+        if temp_id:
+            await manager.send_to_session({
+                "event": "message_failed",
+                "temp_id": temp_id,
+                "conversation": message_conversation_context(mongo_message),
+                "detail": "Message could not be saved",
+            }, connection_id_str, session_id, replay=True)
+        return
+    if previous_delivery:
+        await asyncio.wait([previous_delivery])
+
+    # The stored form (ObjectId, datetime) for the summaries; the payload below is stringified
+    stored_message = {**mongo_message, "_id": message_id}
+    mongo_message["_id"] = str(message_id)
+    mongo_message["timestamp"] = mongo_message["timestamp"].isoformat() + "Z"
+    receiver_data = mongo_message.get("receiver")
+    group_data = mongo_message.get("group")
+
+    # Everyone in the conversation, including the sender's other sessions
+    participants = []
+    if mongo_message["type"] == "private":
+        participants = [
+            connection_id_str,
+            f"{receiver_data['role']}-{receiver_data['id']}"
+        ]
+    elif mongo_message["type"] == "group":
+        participants = set(await get_group_members(group_data["id"], redis_client))
+        participants.add(connection_id_str)
+
+    # 1. Count it as unread for everyone else before they can see it, so a
+    # quick read receipt always finds the increment to clear
+    recipients = [cid for cid in participants if cid != connection_id_str]
+    unread_counts = {}
+    try:
+        unread_counts = await record_unread(stored_message, recipients, redis_client)
+    except Exception as e:
+        print(f"Error updating unread counters for {mongo_message['_id']}: {e}")
+
+    # 2. Broadcast the new message to all relevant participants
+    # (but not the sending session); encoded once and shared by every recipient
+    broadcast_payload = Frame({"event": "new_message", **mongo_message})
+    await manager.broadcast_to_users(broadcast_payload, list(participants), exclude_session=session_id)
+
+    # 3. Send the acknowledgment back to the original sender
+    if temp_id:
+        ack_payload = {
+            "event": "message_acknowledged",
+            "temp_id": temp_id,
+            "new_id": mongo_message["_id"],
+            "timestamp": mongo_message["timestamp"],
+            "seq": mongo_message["seq"],
+            "conversation": message_conversation_context(mongo_message)
+        }
+        await manager.send_to_session(ack_payload, connection_id_str, session_id, replay=True)
+
+    # 4. Push the recipients' new badge counts
+    conversation = message_conversation(stored_message)
+    for recipient, unread_count in unread_counts.items():
+        await manager.send_personal_message({
+            "event": "unread_update",
+            "conversation": conversation,
+            "unread_count": unread_count,
+        }, recipient)
+
+    # 5. Make it the latest message of its conversation for everyone in it
+    try:
+        await record_message(mongo_db, stored_message)
+    except Exception as e:
+        print(f"Error updating conversation summaries for {mongo_message['_id']}: {e}")
+
 @router.websocket("/ws")
 async def websocket_endpoint(
     websocket: WebSocket,
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db),
     mongo_db: AsyncIOMotorClient = Depends(get_mongo_db)
 ):
     # Get Redis client directly from application state
@@ -106,14 +199,12 @@ async def websocket_endpoint(
 
         # 2. Verify the token
         credentials_exception = HTTPException(status_code=403)
-        token_data = verify_token(token, credentials_exception)
+        token_data = await verify_token(token, credentials_exception)
         
         # 3. Fetch the user/admin from the database
         entity: Union[User, Admin] = None
-        if token_data.role == 'user':
-            entity = db.query(User).filter(User.username == token_data.username).first()
-        elif token_data.role == 'admin':
-            entity = db.query(Admin).filter(Admin.username == token_data.username).first()
+        if token_data.role in ('user', 'admin'):
+            entity = await get_principal(token_data.role, token_data.username)
 
         if not entity:
             await websocket.close(code=1008)
@@ -125,61 +216,92 @@ async def websocket_endpoint(
         return
 
     connection_id_str = f"{token_data.role}-{entity.id}"
-    await manager.connect(connection_id_str, websocket)
-
     tenant_id = entity.id if isinstance(entity, Admin) else entity.admin_id
-    
-    online_connection_ids = manager.get_all_connection_ids()
-    # all_tenant_members = get_tenant_connection_ids(tenant_id, db)
-    all_tenant_members = await get_tenant_connection_ids(tenant_id, db, redis_client)
-
-    # 1. Identify which users in the tenant are offline
-    offline_user_ids = []
-    for member_cid in all_tenant_members:
-        if member_cid.startswith('user-') and member_cid not in online_connection_ids:
-            offline_user_ids.append(int(member_cid.split('-')[1]))
-    
-    # 2. Query the database for their last_seen timestamps in one go
-    offline_users_info = {
-        user.id: user.last_seen 
-        for user in db.query(User.id, User.last_seen).filter(User.id.in_(offline_user_ids)).all()
-    }
-
-    # 3. Build the initial state map with the correct data
-    initial_state = {}
-    for member_cid in all_tenant_members:
-        role, member_id_str = member_cid.split('-')
-        member_id = int(member_id_str)
-        
-        if member_id == entity.id and role == token_data.role:
-            continue
-
-        if member_cid in online_connection_ids:
-            status = "online"
-            last_seen = None
-        else:
-            status = "offline"
-            # Use the fetched timestamp if available
-            last_seen = offline_users_info.get(member_id)
-        
-        # Ensure timestamp is in ISO format if it exists
-        last_seen_iso = last_seen.isoformat() + "Z" if last_seen else None
-        initial_state[member_cid] = {"status": status, "lastSeen": last_seen_iso}
-    print(f"Initial presence state for {connection_id_str}: {initial_state}")
-    await manager.send_personal_message(json.dumps({
-        "event": "initial_presence_state",
-        "users": initial_state
-    }), connection_id_str)
+    # Each tab/device gets its own session; presence only changes on the
+    # identity's first connect and last disconnect.
+    session_id, is_first_session = await manager.connect(connection_id_str, websocket, tenant_id)
+
+    # A client that dropped briefly reconnects with its resume token and the last
+    # "eid" it saw, and gets the frames it missed instead of reloading everything.
+    # Frames that also arrived live meanwhile can repeat; clients skip eids they've seen.
+    resume_token = replay_buffer.new_resume_token()
+    missed_frames = None
+    previous_token = websocket.query_params.get("resume_token")
+    last_event_id = websocket.query_params.get("last_eid", "")
+    if previous_token and last_event_id.isdigit():
+        missed_frames = await replay_buffer.resume(previous_token, connection_id_str, int(last_event_id))
+    await manager.send_to_session({
+        "event": "session_resume",
+        "resume_token": resume_token,
+        "resumed": missed_frames is not None,
+    }, connection_id_str, session_id)
+    for frame in missed_frames or []:
+        await manager.send_to_session(frame, connection_id_str, session_id)
+
+    # Record the arrival first so the snapshot below already reflects it
+    if is_first_session:
+        presence_version = await set_presence(tenant_id, connection_id_str, "online", None, redis_client)
+
+    all_tenant_members = await get_tenant_connection_ids(tenant_id, redis_client)
+
+    # Clients that remember the last presence version they saw only get what changed since
+    initial_state = None
+    known_version = websocket.query_params.get("presence_version")
+    if known_version and known_version.isdigit():
+        delta = await get_presence_changes_since(tenant_id, int(known_version), redis_client)
+        if delta:
+            version, changes = delta
+            initial_state = {
+                "event": "initial_presence_state",
+                "version": version,
+                "since": int(known_version),
+                "users": filter_states(changes, all_tenant_members, exclude=connection_id_str),
+            }
+
+    if initial_state is None:
+        version, states = await get_presence_snapshot(tenant_id, redis_client)
+
+        # Members never recorded in the store are offline; seed them from
+        # Postgres once so later connects are a single HGETALL.
+        missing = set(all_tenant_members) - set(states)
+        if missing:
+            missing_user_ids = [int(cid.split('-')[1]) for cid in missing if cid.startswith('user-')]
+            async with AsyncSessionLocal() as db:
+                rows = await db.execute(select(User.id, User.last_seen).filter(User.id.in_(missing_user_ids)))
+            last_seen_by_id = {user.id: user.last_seen for user in rows}
+            # Disconnects not yet flushed to Postgres are newer than what it has
+            last_seen_by_id.update(last_seen_buffer.get_pending(missing_user_ids))
+            seeded = {}
+            for member_cid in missing:
+                role, member_id_str = member_cid.split('-')
+                last_seen = last_seen_by_id.get(int(member_id_str)) if role == 'user' else None
+                seeded[member_cid] = {
+                    "status": "offline",
+                    "lastSeen": last_seen.isoformat() + "Z" if last_seen else None,
+                }
+            await seed_presence(tenant_id, seeded, redis_client)
+            states.update(seeded)
+
+        initial_state = {
+            "event": "initial_presence_state",
+            "version": version,
+            "users": filter_states(states, all_tenant_members, exclude=connection_id_str),
+        }
+    await manager.send_to_session(initial_state, connection_id_str, session_id)
 
     # Announce the new user's arrival to everyone else
-    await broadcast_presence_update(tenant_id, entity.id, token_data.role, "online", db, redis_client)
+    if is_first_session:
+        await presence_aggregator.record(tenant_id, entity.id, token_data.role, "online", presence_version)
     
     background_tasks.add_task(mark_messages_as_received, entity.id, token_data.role, mongo_db)
+
+    # In-flight new_message deliveries; each one waits for the one before it
+    pending_deliveries = set()
+    previous_delivery = None
     
     try:
         while True:
-            data = await websocket.receive_text()
-            message_data = json.loads(data)
+            message_data = await receive_event(websocket)
             event_type = message_data.get("event", "new_message")
             messages_collection = mongo_db["messages"]
 
@@ -187,50 +309,65 @@ async def websocket_endpoint(
                 partner_data = message_data.get("partner")
                 # print("Read receipt data:", message_data)
                 group_id_data = message_data.get("group_id")
-                
+                # The newest message the client has actually displayed
+                last_message_id = message_data.get("last_message_id")
+
                 reader_identity = {"id": entity.id, "role": token_data.role}
-                
-                query = {}
-                message_sender = None
+                read_conversation = None
 
                 if partner_data: # Private chat read receipt
-                    # Find messages where the reader is the receiver and has not read them yet.
-                    query = {
-                        "type": "private",
-                        "sender.id": partner_data["id"], "sender.role": partner_data["role"],
-                        "receiver.id": entity.id, "receiver.role": token_data.role,
-                        "read_by": {"$not": {"$elemMatch": reader_identity}}
-                    }
-                    message_sender = partner_data
+                    conversation_key = private_conversation_key(
+                        partner_data["role"], partner_data["id"], token_data.role, entity.id
+                    )
+                    read_at = await resolve_read_position(messages_collection, conversation_key, last_message_id)
+                    if read_at is None:
+                        continue
 
-                elif group_id_data: # Group chat read receipt
-                    # Find messages in the group that the reader has not read yet.
-                    query = {
-                        "type": "group",
-                        "group.id": group_id_data,
-                        "read_by": {"$not": {"$elemMatch": reader_identity}}
+                    # Move the reader's watermark for this conversation forward in one upsert
+                    read_conversation = private_conversation(partner_data["id"], partner_data["role"])
+                    previous_read_at = await mark_read(mongo_db, reader_identity, read_conversation, read_at)
+
+                    # Only tell the partner if this actually read something new of theirs
+                    newly_read_query = {
+                        "conversation_key": conversation_key,
+                        "sender.id": partner_data["id"], "sender.role": partner_data["role"],
+                        "timestamp": {"$lte": read_at},
                     }
-                    # For groups, we don't notify a single sender, but this could be enhanced later.
-                
-                if query:
-                    # Use $addToSet to add the reader's identity to the array, preventing duplicates.
-                    update_result = await messages_collection.update_many(
-                        query,
-                        {"$addToSet": {"read_by": reader_identity}}
-                    )
-                    updated_count = update_result.modified_count
-                    # print(f"{token_data.role} {entity.id} read {updated_count} messages.")
+                    if previous_read_at:
+                        newly_read_query["timestamp"]["$gt"] = previous_read_at
+                    newly_read = await messages_collection.find_one(newly_read_query, projection={"_id": 1})
 
                     # --- INSTRUCTION 3: Send the new 'messages_now_read' event ---
-                    if updated_count > 0 and message_sender:
-                        sender_connection_id = f"{message_sender['role']}-{message_sender['id']}"
+                    if newly_read:
+                        sender_connection_id = f"{partner_data['role']}-{partner_data['id']}"
                         
-                        read_notification = json.dumps({
+                        read_notification = {
                             "event": "messages_status_update",
                             "reader": reader_identity
-                        })
+                        }
                         await manager.send_personal_message(read_notification, sender_connection_id)
 
+                elif group_id_data: # Group chat read receipt
+                    # For groups, we don't notify a single sender, but this could be enhanced later.
+                    read_at = await resolve_read_position(
+                        messages_collection, group_conversation_key(group_id_data), last_message_id
+                    )
+                    if read_at is None:
+                        continue
+                    read_conversation = group_conversation(group_id_data)
+                    await mark_read(mongo_db, reader_identity, read_conversation, read_at)
+
+                if read_conversation:
+                    # Update the badge, including on the reader's other tabs and devices
+                    unread_count = await settle_unread(
+                        reader_identity, read_conversation, read_at, mongo_db, redis_client
+                    )
+                    await manager.send_personal_message({
+                        "event": "unread_update",
+                        "conversation": read_conversation,
+                        "unread_count": unread_count,
+                    }, connection_id_str)
+
             if event_type == "new_message":
                 # Get all necessary data from the payload
                 content = message_data.get("content", {})
@@ -248,7 +385,6 @@ async def websocket_endpoint(
                     "sender": {"id": entity.id, "role": token_data.role, "username": entity.username},
                     "content": content,
                     "timestamp": datetime.utcnow(),  # Always use UTC for timestamps
-                    "read_by": [{"id": entity.id, "role": token_data.role}],
                     "is_deleted": False
                 }
 
@@ -260,48 +396,20 @@ async def websocket_endpoint(
                 else:
                     continue # Invalid message structure
 
-                # Insert into DB and prepare for broadcast
-                result = await messages_collection.insert_one(mongo_message)
-                mongo_message["_id"] = str(result.inserted_id)
-                mongo_message["timestamp"] = mongo_message["timestamp"].isoformat() + "Z"
-
-                # 1. Broadcast the new message to all relevant participants
-                participants = []
-                if mongo_message["type"] == "private":
-                    participants = [
-                        # connection_id_str, # Send back to the sender
-                        f"{receiver_data['role']}-{receiver_data['id']}"
-                    ]
-                elif mongo_message["type"] == "group":
-                    # participants = set(get_group_members(group_data["id"], db=db))
-                    participants = set(await get_group_members(group_data["id"], db, redis_client))
-                    participants.discard(connection_id_str) 
-                
-                broadcast_payload = json.dumps({"event": "new_message", **mongo_message})
-                await manager.broadcast_to_users(broadcast_payload, list(participants))
-                
-                # 2. Send the acknowledgment back to the original sender
-                if temp_id:
-                    conversation_context = {}
-                    if receiver_data:
-                        conversation_context = {
-                            "type": "private", "id": receiver_data["id"], "role": receiver_data["role"]
-                        }
-                    elif group_data:
-                        conversation_context = {
-                            "type": "group", "id": group_data["id"], "role": None
-                        }
+                # Stamp the conversation and its next sequence number, so clients can
+                # spot gaps and fetch just the messages after the last seq they saw
+                mongo_message["conversation_key"] = conversation_key_for_message(mongo_message)
+                mongo_message["seq"] = await allocate_seq(mongo_message["conversation_key"], mongo_db, redis_client)
 
-                    ack_payload = json.dumps({
-                        "event": "message_acknowledged",
-                        "temp_id": temp_id,
-                        "new_id": mongo_message["_id"],
-                        "timestamp": mongo_message["timestamp"],
-                        "conversation": conversation_context
-                    })
-                    await manager.send_personal_message(ack_payload, connection_id_str)
-                    # print(f"Sent acknowledgment for temp_id {temp_id} to user {entity.id}")
-                    # print(ack_payload)
+                # Queue the insert in arrival order; fan-out and the ack run once it lands,
+                # so a burst of messages is written with a handful of insert_many calls
+                inserted = message_batcher.submit(mongo_message)
+                previous_delivery = asyncio.create_task(deliver_new_message(
+                    mongo_message, inserted, previous_delivery, temp_id,
+                    connection_id_str, session_id, mongo_db, redis_client
+                ))
+                pending_deliveries.add(previous_delivery)
+                previous_delivery.add_done_callback(pending_deliveries.discard)
 
 
             if event_type == "delete_message":
@@ -326,6 +434,7 @@ async def websocket_endpoint(
                     {"_id": obj_id},
                     {"$set": {"is_deleted": True}}
                 )
+                await record_deletion(mongo_db, conversation_key_for_message(message_to_delete), obj_id)
 
                 conversation_payload = {}
                 # Notify participants
@@ -352,24 +461,25 @@ async def websocket_endpoint(
                         "role": None
                     }
                     # participants = list(get_group_members(group["id"], db=db))
-                    participants = list(await get_group_members(group["id"], db, redis_client))
+                    participants = list(await get_group_members(group["id"], redis_client))
 
-                delete_notification = json.dumps({
+                delete_notification = {
                     "event": "message_deleted",
                     "message_id": message_id,
                     "conversation": conversation_payload
-                })
+                }
                 await manager.broadcast_to_users(delete_notification, participants)
 
                 print(f"Message {message_id} successfully marked as deleted.")
                 continue
             
     except WebSocketDisconnect:
-        manager.disconnect(connection_id_str)
-        update_last_seen(entity.id, token_data.role)
-        await broadcast_presence_update(tenant_id, entity.id, token_data.role, "offline", db, redis_client)
+        pass
     except Exception as e:
         print(f"Error in WebSocket: {e}")
-        manager.disconnect(connection_id_str)
-        update_last_seen(entity.id, token_data.role)
-        await broadcast_presence_update(tenant_id, entity.id, token_data.role, "offline", db, redis_client)
\ No newline at end of file
+
+    # Only the identity's last session going away marks it offline
+    is_last_session = await manager.disconnect(connection_id_str, session_id)
+    await replay_buffer.suspend(resume_token, connection_id_str, session_id)
+    if is_last_session:
+        await mark_offline(tenant_id, connection_id_str, redis_client)
@@ -1,32 +1,39 @@
 # app/api/v1/endpoints/messages.py
 from fastapi import APIRouter, Depends, HTTPException, Query, Path
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from motor.motor_asyncio import AsyncIOMotorClient
 from typing import Union, Optional, Dict, Any
 import datetime
 
-from app.db.session import get_db, get_mongo_db
+from app.db.session import get_async_db, get_mongo_db
 from app.security.dependencies import get_current_user_from_cookie
 from app.models import User, Admin, Group, GroupMember
-from app.schemas.message import PaginatedMessageResponse
+from app.core.config import settings
+from app.core.responses import FastJSONResponse
+from app.schemas.message import PaginatedMessageResponse, message_out
+from app.db.conversations import private_conversation_key, group_conversation_key
+from app.db.pagination import BEFORE, AFTER, decode_cursor, keyset_filter, keyset_sort, page_cursors, parse_fields
+from app.db.read_cursors import get_last_read, private_conversation, group_conversation, is_read
 
 router = APIRouter()
 
-def calculate_status_for_user(message: Dict[str, Any], current_user_identity: Dict[str, Any]) -> str:
+def calculate_status_for_user(
+    message: Dict[str, Any],
+    current_user_identity: Dict[str, Any],
+    my_last_read_at: Optional[datetime.datetime],
+    partner_last_read_at: Optional[datetime.datetime]
+) -> str:
     """
-    Calculates the 'status' string based on the new 'read_by' array of objects.
+    Calculates the 'status' string from the read watermarks of the current
+    user and (for private chats) their partner.
     """
-    read_by_list = message.get("read_by", [])
     if message.get("sender") == current_user_identity:
-        if message["type"] == "private":
-            receiver_id = message.get("receiver").get("id")
-            receiver_role = message.get("receiver").get("role")
-            receiver_identity = {"id": receiver_id, "role": receiver_role}
-            if receiver_identity in read_by_list:
-                return "read"
+        if message["type"] == "private" and is_read(message["timestamp"], partner_last_read_at):
+            return "read"
         return "sent"
     else:
-        if current_user_identity in read_by_list:
+        if is_read(message["timestamp"], my_last_read_at):
             return "read"
         else:
             return "sent"
@@ -36,10 +43,13 @@ async def get_message_history(
     conversation_type: str = Path(..., description="Type of conversation: 'private' or 'group'"),
     partner_id: int = Path(..., description="ID of the user, admin, or group"),
     partner_role: Optional[str] = Query(None, description="Role of the partner if private: 'user' or 'admin'"),
-    before: Optional[str] = Query(None, description="ISO timestamp cursor for pagination"),
+    before: Optional[str] = Query(None, description="Cursor: return older messages, newest first"),
+    after: Optional[str] = Query(None, description="Cursor: return newer messages, oldest first"),
+    fields: Optional[str] = Query(None, description="Comma-separated message fields to return, e.g. 'content.text,is_deleted'"),
+    after_seq: Optional[int] = Query(None, ge=0, description="Return messages after this seq, oldest first"),
     limit: int = Query(50, gt=0, le=100),
     current_entity: Union[User, Admin] = Depends(get_current_user_from_cookie),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     mongo_db: AsyncIOMotorClient = Depends(get_mongo_db)
 ):
     messages_collection = mongo_db["messages"]
@@ -48,34 +58,34 @@ async def get_message_history(
     entity_role = "admin" if isinstance(current_entity, Admin) else "user"
     entity_name = current_entity.username
     
-    query = {"type": conversation_type}
+    if sum(param is not None for param in (before, after, after_seq)) > 1:
+        raise HTTPException(status_code=400, detail="Use only one of 'before', 'after' or 'after_seq'.")
+
+    try:
+        # Seq paging continues from the last seq, so it always needs it
+        projection = parse_fields(fields, always=("seq",) if after_seq is not None else ())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    query = {}
 
     if conversation_type == "private":
         if not partner_role:
             raise HTTPException(status_code=400, detail="Partner role is required for private chats.")
         
-        # --- FIX IS HERE: Use Dot Notation for Precise Matching ---
-        # This query checks the fields inside the sub-documents, which is robust.
-        query["$or"] = [
-            {
-                "sender.id": entity_id, "sender.role": entity_role,
-                "receiver.id": partner_id, "receiver.role": partner_role
-            },
-            {
-                "sender.id": partner_id, "sender.role": partner_role,
-                "receiver.id": entity_id, "receiver.role": entity_role
-            }
-        ]
+        # Both directions of the conversation share one key, so this is a
+        # single range scan on (conversation_key, timestamp)
+        conversation_key = private_conversation_key(entity_role, entity_id, partner_role, partner_id)
     elif conversation_type == "group":
         # --- MODIFICATION: Check membership status before querying ---
         membership = None
         if isinstance(current_entity, User):
-            membership = db.query(GroupMember).filter(
+            membership = await db.scalar(select(GroupMember).filter(
                 GroupMember.group_id == partner_id, 
                 GroupMember.user_id == entity_id
-            ).first()
+            ))
         elif isinstance(current_entity, Admin):
-            group = db.query(Group).filter(Group.id == partner_id, Group.admin_id == entity_id).first()
+            group = await db.scalar(select(Group).filter(Group.id == partner_id, Group.admin_id == entity_id))
             if group:
                 # Create a mock active membership for the admin
                 membership = GroupMember(is_member_active=True)
@@ -83,7 +93,7 @@ async def get_message_history(
         if not membership:
             raise HTTPException(status_code=403, detail="You are not a member of this group.")
 
-        query["group.id"] = partner_id
+        conversation_key = group_conversation_key(partner_id)
         
         # If the member is inactive, add a timestamp filter to the query
         if not membership.is_member_active and membership.removed_at:
@@ -92,31 +102,70 @@ async def get_message_history(
     else:
         raise HTTPException(status_code=400, detail="Invalid conversation type.")
 
-    if before:
+    query["conversation_key"] = conversation_key
+
+    direction = AFTER if after else BEFORE
+    cursor = after or before
+    if cursor:
         try:
-            cursor_time = datetime.datetime.fromisoformat(before.replace("Z", "+00:00"))
-            query["timestamp"] = {"$lt": cursor_time}
+            cursor_time, cursor_id = decode_cursor(cursor)
         except ValueError:
-            raise HTTPException(status_code=400, detail="Invalid 'before' timestamp format.")
+            raise HTTPException(status_code=400, detail=f"Invalid '{direction}' cursor.")
+        query.setdefault("$and", []).append(keyset_filter(direction, cursor_time, cursor_id))
 
-    messages_cursor = messages_collection.find(query).sort("timestamp", -1).limit(limit)
+    if after_seq is not None:
+        # Catch-up read: an indexed (conversation_key, seq) range, oldest first
+        query["seq"] = {"$gt": after_seq}
+        messages_cursor = messages_collection.find(query, projection).sort("seq", 1).limit(limit)
+    else:
+        messages_cursor = messages_collection.find(query, projection).sort(keyset_sort(direction)).limit(limit)
     messages_from_db = await messages_cursor.to_list(length=limit)
 
+    # Read state comes from per-member watermarks rather than per-message arrays
+    reader_identity = {"id": entity_id, "role": entity_role}
+    partner_last_read_at = None
+    if conversation_type == "private":
+        my_last_read_at = await get_last_read(
+            mongo_db, reader_identity, private_conversation(partner_id, partner_role)
+        )
+        partner_last_read_at = await get_last_read(
+            mongo_db, {"id": partner_id, "role": partner_role}, private_conversation(entity_id, entity_role)
+        )
+    else:
+        my_last_read_at = await get_last_read(mongo_db, reader_identity, group_conversation(partner_id))
+
     current_user_identity = {"id": entity_id, "username": entity_name, "role": entity_role}
     # print("Current User Identity:", current_user_identity)
     processed_messages = []
     for msg in messages_from_db:
-        status = calculate_status_for_user(msg, current_user_identity)
-        msg_with_status = {**msg, "status": status}
-        processed_messages.append(msg_with_status)
+        status = calculate_status_for_user(msg, current_user_identity, my_last_read_at, partner_last_read_at)
+        if settings.FAST_JSON_RESPONSES:
+            # Shaped directly instead of being validated through MessageOut
+            processed_messages.append(message_out(msg, status))
+        else:
+            processed_messages.append({**msg, "status": status})
 
     next_cursor = None
-    if len(messages_from_db) == limit:
-        oldest_message = messages_from_db[-1]
-        next_cursor = oldest_message["timestamp"].isoformat() + "Z"
+    prev_cursor = None
+    next_after_seq = None
+    if after_seq is not None:
+        if len(messages_from_db) == limit:
+            next_after_seq = messages_from_db[-1]["seq"]
+    else:
+        next_cursor, prev_cursor = page_cursors(messages_from_db, direction, limit)
+
+    if settings.FAST_JSON_RESPONSES:
+        return FastJSONResponse({
+            "messages": processed_messages,
+            "next_cursor": next_cursor,
+            "prev_cursor": prev_cursor,
+            "next_after_seq": next_after_seq,
+        })
         
     return PaginatedMessageResponse(
         messages=processed_messages, 
-        next_cursor=next_cursor
+        next_cursor=next_cursor,
+        prev_cursor=prev_cursor,
+        next_after_seq=next_after_seq
     )
 
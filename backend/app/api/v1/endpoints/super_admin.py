@@ -1,10 +1,15 @@
 # app/api/v1/endpoints/super_admin.py
 from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List
+import redis.asyncio as redis
 
-from app.db.session import get_db
+from app.db.session import get_db, get_async_db, get_redis_client
 from app.security.dependencies import get_current_super_admin
+from app.cache.principals import invalidate_principal, invalidate_principals
+from app.security.revocation import revocation_list
 from app.security.hashing import Hasher
 from app.models import Admin, User, Group, SuperAdmin
 from app.schemas.super_admin import SuperAdminCreate, AdminOut
@@ -12,42 +17,43 @@ from app.schemas.super_admin import SuperAdminCreate, AdminOut
 router = APIRouter()
 
 @router.post("/admins", response_model=AdminOut, status_code=status.HTTP_201_CREATED)
-def create_admin(
+async def create_admin(
     admin_in: SuperAdminCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_super_admin: SuperAdmin = Depends(get_current_super_admin)
 ):
     """
     Create a new Admin tenant. (Super Admin only)
     """
     # Check for uniqueness
-    if db.query(Admin).filter(Admin.username == admin_in.username).first():
+    if await db.scalar(select(Admin).filter(Admin.username == admin_in.username)):
         raise HTTPException(status_code=400, detail="Admin username already exists.")
-    if db.query(Admin).filter(Admin.admin_key == admin_in.admin_key).first():
+    if await db.scalar(select(Admin).filter(Admin.admin_key == admin_in.admin_key)):
         raise HTTPException(status_code=400, detail="Admin key is already in use.")
 
-    hashed_password = Hasher.get_password_hash(admin_in.password)
+    hashed_password = await Hasher.get_password_hash_async(admin_in.password)
     new_admin = Admin(
         username=admin_in.username,
         password_hash=hashed_password,
         admin_key=admin_in.admin_key
     )
     db.add(new_admin)
-    db.commit()
-    db.refresh(new_admin)
+    await db.commit()
+    await db.refresh(new_admin)
     return new_admin
 
 @router.patch("/admins/{admin_id}/deactivate", response_model=AdminOut)
 async def deactivate_admin(
     admin_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
+    redis_client: redis.Redis = Depends(get_redis_client),
     current_super_admin: SuperAdmin = Depends(get_current_super_admin)
 ):
     """
     Deactivates an admin and cascades the deactivation to all their users and groups.
     (Super Admin only)
     """
-    admin = db.query(Admin).filter(Admin.id == admin_id).first()
+    admin = await db.scalar(select(Admin).filter(Admin.id == admin_id))
     if not admin:
         raise HTTPException(status_code=404, detail="Admin not found.")
     
@@ -55,27 +61,40 @@ async def deactivate_admin(
     admin.is_active = False
     
     # Cascade deactivate all users of this admin
-    db.query(User).filter(User.admin_id == admin_id).update({"is_active": False})
+    user_usernames = await db.scalars(
+        update(User).where(User.admin_id == admin_id).values(is_active=False).returning(User.username)
+    )
+    user_usernames = list(user_usernames)
     
     # Cascade deactivate all groups of this admin
-    db.query(Group).filter(Group.admin_id == admin_id).update({"is_active": False})
+    await db.execute(update(Group).where(Group.admin_id == admin_id).values(is_active=False))
     
-    db.commit()
-    db.refresh(admin)
+    await db.commit()
+    await db.refresh(admin)
+
+    # Drop the cached identities of everyone affected
+    await invalidate_principal("admin", admin.username, redis_client)
+    await invalidate_principals("user", user_usernames, redis_client)
+
+    # And revoke every token they were issued
+    await revocation_list.revoke_subject("admin", admin.username, redis_client)
+    for username in user_usernames:
+        await revocation_list.revoke_subject("user", username, redis_client)
     
     return admin
 
 @router.patch("/admins/{admin_id}/reactivate", response_model=AdminOut)
-def reactivate_admin(
+async def reactivate_admin(
     admin_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
+    redis_client: redis.Redis = Depends(get_redis_client),
     current_super_admin: SuperAdmin = Depends(get_current_super_admin)
 ):
     """
     Reactivates an admin and cascades the reactivation to all their users and groups.
     (Super Admin only)
     """
-    admin = db.query(Admin).filter(Admin.id == admin_id).first()
+    admin = await db.scalar(select(Admin).filter(Admin.id == admin_id))
     if not admin:
         raise HTTPException(status_code=404, detail="Admin not found.")
         
@@ -83,13 +102,20 @@ def reactivate_admin(
     admin.is_active = True
     
     # Cascade reactivate all users
-    db.query(User).filter(User.admin_id == admin_id).update({"is_active": True})
+    user_usernames = await db.scalars(
+        update(User).where(User.admin_id == admin_id).values(is_active=True).returning(User.username)
+    )
+    user_usernames = list(user_usernames)
     
     # Cascade reactivate all groups
-    db.query(Group).filter(Group.admin_id == admin_id).update({"is_active": True})
+    await db.execute(update(Group).where(Group.admin_id == admin_id).values(is_active=True))
     
-    db.commit()
-    db.refresh(admin)
+    await db.commit()
+    await db.refresh(admin)
+
+    # Drop the cached identities of everyone affected
+    await invalidate_principal("admin", admin.username, redis_client)
+    await invalidate_principals("user", user_usernames, redis_client)
     return admin
 
 @router.get("/admins", response_model=List[AdminOut])
@@ -1,22 +1,29 @@
 from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
+from sqlalchemy import or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from motor.motor_asyncio import AsyncIOMotorClient
 from typing import Union
+import redis.asyncio as redis
 
-from app.db.session import get_db, get_mongo_db
+from app.db.session import get_db, get_async_db, get_mongo_db, get_redis_client
 from app.security.dependencies import get_current_user_from_cookie
+from app.core.config import settings
+from app.core.responses import FastJSONResponse
+from app.cache.principals import invalidate_principal, principal_role
+from app.db.conversation_summaries import get_private_summaries, get_group_summaries, get_group_summary_before
 from app.models import User, Admin, SuperAdmin, Group, GroupMember, PinnedConversation
 
 
-from app.schemas.user import SearchResult, ConversationList, ConversationPartner, MeProfileOut, PasswordUpdate, FullNameUpdate 
+from app.schemas.user import SearchResult, ConversationList, MeProfileOut, PasswordUpdate, FullNameUpdate, conversation_partner_out
 from app.security.hashing import Hasher 
 
 router = APIRouter()
 
 @router.get("/me", response_model=MeProfileOut)
-def read_users_me(
-    current_entity: Union[User, Admin, SuperAdmin] = Depends(get_current_user_from_cookie)
+async def read_users_me(
+    current_entity: Union[User, Admin, SuperAdmin] = Depends(get_current_user_from_cookie),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get the profile of the currently authenticated user or admin.
@@ -32,7 +39,10 @@ def read_users_me(
 
     if isinstance(current_entity, User):
         response_data["type"] = "user"
-        response_data["created_by"] = current_entity.owner_admin.username
+        # The cached principal is detached, so look the owner up directly
+        response_data["created_by"] = await db.scalar(
+            select(Admin.username).filter(Admin.id == current_entity.admin_id)
+        )
     
     elif isinstance(current_entity, Admin):
         response_data["type"] = "admin"
@@ -112,16 +122,16 @@ def search_for_entities(
 @router.get("/conversations", response_model=ConversationList)
 async def get_user_conversations(
     current_entity: Union[User, Admin] = Depends(get_current_user_from_cookie),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     mongo_db: AsyncIOMotorClient = Depends(get_mongo_db)
 ):
-    messages_collection = mongo_db["messages"]
-    
     entity_id = current_entity.id
     entity_role = "admin" if isinstance(current_entity, Admin) else "user"
 
     # --- 1. FETCH PINNED CONVERSATIONS FOR THE CURRENT USER ---
-    pinned_items = db.query(PinnedConversation).filter_by(pinner_id=entity_id, pinner_role=entity_role).all()
+    pinned_items = (await db.scalars(
+        select(PinnedConversation).filter_by(pinner_id=entity_id, pinner_role=entity_role)
+    )).all()
     
     pinned_set = {
         f"{pin.conversation_role or pin.conversation_type}-{pin.conversation_id}" for pin in pinned_items
@@ -131,111 +141,79 @@ async def get_user_conversations(
     # --- 1. Fetch Detailed Group Membership Info ---
     memberships_map = {}
     if isinstance(current_entity, User):
-        memberships = db.query(GroupMember).filter_by(user_id=entity_id).all()
+        memberships = await db.scalars(select(GroupMember).filter_by(user_id=entity_id))
         memberships_map = {m.group_id: m for m in memberships}
     elif isinstance(current_entity, Admin):
-        groups = db.query(Group).filter_by(admin_id=entity_id).all()
+        groups = await db.scalars(select(Group).filter_by(admin_id=entity_id))
         for group in groups:
             mock_membership = GroupMember(group_id=group.id, is_member_active=True, removed_at=None)
             memberships_map[group.id] = mock_membership
 
-    # --- 2. Dynamically Build the Match Query ---
-    match_conditions = [
-        {"sender.id": entity_id, "sender.role": entity_role},
-        {"receiver.id": entity_id, "receiver.role": entity_role},
-    ]
+    # --- 2. Read the Latest Message of Each Conversation from the Summaries ---
+    owner = {"id": entity_id, "role": entity_role}
+    latest_messages = await get_private_summaries(mongo_db, owner)
 
     active_group_ids = [gid for gid, m in memberships_map.items() if m.is_member_active]
-    if active_group_ids:
-        match_conditions.append({"group.id": {"$in": active_group_ids}})
+    latest_messages += await get_group_summaries(mongo_db, active_group_ids)
 
+    # Removed members only see the group up to the moment they were removed
     inactive_memberships = [m for m in memberships_map.values() if not m.is_member_active]
     for m in inactive_memberships:
         if m.removed_at:
-            match_conditions.append({
-                "group.id": m.group_id,
-                "timestamp": {"$lt": m.removed_at}
-            })
-
-    pipeline = [
-        {"$match": {"$or": match_conditions}},
-        {"$sort": {"timestamp": -1}},
-        {"$group": {
-            "_id": {
-                "$cond": {
-                    "if": {"$eq": ["$type", "private"]},
-                    "then": {
-                        "participants": {
-                            "$sortArray": { "input": [ "$sender", "$receiver" ], "sortBy": { "id": 1 } }
-                        }
-                    },
-                    "else": "$group.id"
-                }
-            },
-            "last_message_doc": {"$first": "$$ROOT"}
-        }},
-        {"$replaceRoot": {"newRoot": "$last_message_doc"}}
-    ]
-
-    latest_messages = await messages_collection.aggregate(pipeline).to_list(length=None)
+            summary = await get_group_summary_before(mongo_db, m.group_id, m.removed_at)
+            if summary:
+                latest_messages.append(summary)
     
     # --- EFFICIENTLY FETCH FULL NAMES ---
     user_ids_to_fetch = set()
     admin_ids_to_fetch = set()
-    for msg in latest_messages:
-        if msg['type'] == 'private':
-            partner = msg['receiver'] if msg['sender']['id'] == entity_id and msg['sender']['role'] == entity_role else msg['sender']
+    for summary in latest_messages:
+        if summary['type'] == 'private':
+            partner = summary['partner']
             if partner['role'] == 'user':
                 user_ids_to_fetch.add(partner['id'])
             elif partner['role'] == 'admin':
                 admin_ids_to_fetch.add(partner['id'])
 
-    users_data = db.query(User.id, User.username, User.full_name).filter(User.id.in_(user_ids_to_fetch)).all()
-    admins_data = db.query(Admin.id, Admin.username, Admin.full_name).filter(Admin.id.in_(admin_ids_to_fetch)).all()
+    users_data = await db.execute(select(User.id, User.username, User.full_name).filter(User.id.in_(user_ids_to_fetch)))
+    admins_data = await db.execute(select(Admin.id, Admin.username, Admin.full_name).filter(Admin.id.in_(admin_ids_to_fetch)))
     
     details_map = {f"user-{u.id}": u for u in users_data}
     details_map.update({f"admin-{a.id}": a for a in admins_data})
 
     # --- BUILD THE FINAL RESPONSE ---
     conversations = []
-    for msg in sorted(latest_messages, key=lambda x: x['timestamp'], reverse=True):
-        last_message_text = msg.get("content", {}).get("text")
-        if not last_message_text:
-            if msg.get("content", {}).get("image") or msg.get("content", {}).get("file"):
-                last_message_text = "[Attachment]"
-            else:
-                last_message_text = ""
-        
-        if msg['type'] == 'private':
-            partner = msg['receiver'] if msg['sender']['id'] == entity_id and msg['sender']['role'] == entity_role else msg['sender']
+    for summary in sorted(latest_messages, key=lambda x: x['timestamp'], reverse=True):
+        if summary['type'] == 'private':
+            partner = summary['partner']
             partner_key = f"{partner['role']}-{partner['id']}"
             partner_details = details_map.get(partner_key)
 
             if partner_details:
-                conversations.append(ConversationPartner(
+                conversations.append(conversation_partner_out(
                     id=partner_details.id,
                     name=partner_details.username,
                     full_name=partner_details.full_name,
                     type=partner['role'],
-                    last_message_id=msg["_id"],
-                    last_message=last_message_text,
-                    last_message_is_deleted=msg.get("is_deleted", False),
-                    timestamp=msg['timestamp'],
+                    last_message_id=summary["last_message_id"],
+                    last_message=summary["last_message"],
+                    last_message_is_deleted=summary["last_message_is_deleted"],
+                    timestamp=summary['timestamp'],
                     is_member_active=True # Always true for private chats
                 ))
-        elif msg['type'] == 'group':
-            group = msg['group']
+        elif summary['type'] == 'group':
+            group = summary['group']
             membership = memberships_map.get(group['id'])
             
-            conversations.append(ConversationPartner(
+            conversations.append(conversation_partner_out(
                 id=group['id'],
                 name=group['name'],
                 full_name=None,
                 type='group',
-                last_message_id=msg["_id"],
-                last_message=last_message_text,
-                last_message_is_deleted=msg.get("is_deleted", False),
-                timestamp=msg['timestamp'],
+                last_message_id=summary["last_message_id"],
+                last_message=summary["last_message"],
+                last_message_is_deleted=summary["last_message_is_deleted"],
+                timestamp=summary['timestamp'],
                 is_member_active=membership.is_member_active if membership else False
             ))
     
@@ -244,56 +222,68 @@ async def get_user_conversations(
 
     for conv in conversations:
         # Create a unique key for the conversation to check against the pinned_set
-        conv_key = f"{conv.type}-{conv.id}"
+        conv_key = f"{conv['type']}-{conv['id']}"
         # print(conv_key)
 
         if conv_key in pinned_set:
-            conv.is_pinned = True
+            conv["is_pinned"] = True
             pinned_list.append(conv)
         else:
-            conv.is_pinned = False
+            conv["is_pinned"] = False
             unpinned_list.append(conv)
     
     final_conversations = pinned_list + unpinned_list
 
+    if settings.FAST_JSON_RESPONSES:
+        # Rows are already in ConversationPartner's shape; skip validating each one
+        return FastJSONResponse({"conversations": final_conversations})
+
     return {"conversations": final_conversations}
 
 
 
 @router.patch("/me/password", status_code=status.HTTP_204_NO_CONTENT)
-def update_password(
+async def update_password(
     password_data: PasswordUpdate,
     current_entity: Union[User, Admin, SuperAdmin] = Depends(get_current_user_from_cookie),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
+    redis_client: redis.Redis = Depends(get_redis_client),
 ):
     """
     Allows the currently authenticated user or admin to change their own password.
     """
     # 1. Verify the old password
-    if not Hasher.verify_password(password_data.old_password, current_entity.password_hash):
+    if not await Hasher.verify_password_async(password_data.old_password, current_entity.password_hash):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Incorrect current password.",
         )
 
     # 2. Hash the new password
-    new_password_hash = Hasher.get_password_hash(password_data.new_password)
+    new_password_hash = await Hasher.get_password_hash_async(password_data.new_password)
 
     # 3. Update the password in the database
-    current_entity.password_hash = new_password_hash
-    db.commit()
+    model = type(current_entity)
+    await db.execute(update(model).where(model.id == current_entity.id).values(password_hash=new_password_hash))
+    await db.commit()
+
+    # 4. Drop the cached identity everywhere
+    await invalidate_principal(principal_role(current_entity), current_entity.username, redis_client)
 
     return None
 
 @router.patch("/me/full-name", status_code=status.HTTP_204_NO_CONTENT)
-def update_full_name(
+async def update_full_name(
     name_data: FullNameUpdate,
     current_entity: Union[User, Admin] = Depends(get_current_user_from_cookie),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
+    redis_client: redis.Redis = Depends(get_redis_client),
 ):
     """
     Allows the currently authenticated user or admin to update their own full name.
     """
-    current_entity.full_name = name_data.full_name
-    db.commit()
+    model = type(current_entity)
+    await db.execute(update(model).where(model.id == current_entity.id).values(full_name=name_data.full_name))
+    await db.commit()
+    await invalidate_principal(principal_role(current_entity), current_entity.username, redis_client)
     return None
\ No newline at end of file
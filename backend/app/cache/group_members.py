@@ -53,60 +53,80 @@
 #     cache_key = f"group:{group_id}:members"
 #     redis_client.delete(cache_key)
 
-from sqlalchemy.orm import Session
+from sqlalchemy import select
 from fastapi import Depends
 import redis.asyncio as redis # Use the async version of the redis library
 
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal
+from app.cache.local_cache import LocalCache, cache_invalidator
+from app.cache.single_flight import EMPTY_SENTINEL, get_or_load_set
 from app.models import GroupMember, Group
 
 # Define a cache expiration time in seconds (e.g., 1 hour)
 CACHE_EXPIRATION_SECONDS = 3600
 
+# In-process L1 in front of the Redis set, so chatty groups don't pay an
+# SMEMBERS round trip per message. Kept coherent across workers by publishing
+# an invalidation whenever membership changes.
+_group_members_l1 = cache_invalidator.register(LocalCache(
+    "group_members", settings.GROUP_MEMBERS_L1_MAX_ENTRIES, settings.GROUP_MEMBERS_L1_TTL_SECONDS
+))
+
 # The function is now async
 async def get_group_members(
     group_id: int, 
-    db: Session, 
     redis_client: redis.Redis
 ) -> set[str]:
     """
-    Returns a set of connection IDs for a group, using Redis as a cache.
+    Returns a set of connection IDs for a group, from the in-process L1,
+    then Redis, then PostgreSQL (on a session of its own, since the load is
+    shared with every caller waiting on the same group).
     """
+    cached_members = _group_members_l1.get(str(group_id))
+    if cached_members is not None:
+        return set(cached_members)
+    generation = _group_members_l1.generation()
+
     cache_key = f"group:{group_id}:members"
-    
-    # All redis calls must now be awaited
-    cached_members = await redis_client.smembers(cache_key)
-    if cached_members:
-        return cached_members
-
-    group = db.query(Group).get(group_id)
-    if not group:
-        return set()
-
-    members = db.query(GroupMember).filter_by(group_id=group.id, is_member_active=True).all()
-    connection_ids = {f"user-{m.user_id}" for m in members}
-    connection_ids.add(f"admin-{group.admin_id}")
-    
-    if connection_ids:
-        pipeline = redis_client.pipeline()
-        await pipeline.sadd(cache_key, *connection_ids)
-        await pipeline.expire(cache_key, CACHE_EXPIRATION_SECONDS)
-        await pipeline.execute()
-        
+
+    async def load_from_db() -> set[str]:
+        async with AsyncSessionLocal() as db:
+            group = await db.get(Group, group_id)
+            if not group:
+                return set()
+
+            member_ids = (await db.scalars(
+                select(GroupMember.user_id).filter_by(group_id=group.id, is_member_active=True)
+            )).all()
+        connection_ids = {f"user-{user_id}" for user_id in member_ids}
+        connection_ids.add(f"admin-{group.admin_id}")
+        return connection_ids
+
+    # One loader per group across coroutines and workers; unknown groups are cached empty
+    connection_ids = await get_or_load_set(cache_key, load_from_db, redis_client, CACHE_EXPIRATION_SECONDS)
+    _group_members_l1.set(str(group_id), frozenset(connection_ids), generation)
     return connection_ids
 
 # Update the other functions to also accept the client
 async def add_member_to_cache(group_id: int, connection_id: str, redis_client: redis.Redis):
     cache_key = f"group:{group_id}:members"
     if await redis_client.exists(cache_key):
-        await redis_client.sadd(cache_key, connection_id)
+        pipeline = redis_client.pipeline()
+        pipeline.srem(cache_key, EMPTY_SENTINEL)
+        pipeline.sadd(cache_key, connection_id)
+        await pipeline.execute()
+    await cache_invalidator.invalidate(_group_members_l1.name, group_id, redis_client)
 
 async def remove_member_from_cache(group_id: int, connection_id: str, redis_client: redis.Redis):
     cache_key = f"group:{group_id}:members"
     await redis_client.srem(cache_key, connection_id)
+    await cache_invalidator.invalidate(_group_members_l1.name, group_id, redis_client)
 
 async def remove_group_from_cache(group_id: int, redis_client: redis.Redis):
     cache_key = f"group:{group_id}:members"
     await redis_client.delete(cache_key)
+    await cache_invalidator.invalidate(_group_members_l1.name, group_id, redis_client)
 
 # async def add_member_to_cache(group_id: int, connection_id: str, redis_client: redis.Redis):
 #     """Adds a member to a group's cache in Redis."""
@@ -0,0 +1,76 @@
+# app/cache/last_seen.py
+import asyncio
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import update
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.db.session import AsyncSessionLocal
+from app.models import User
+
+class LastSeenBuffer:
+    """
+    Write-behind buffer for users' last_seen timestamps.
+    Disconnects only record the timestamp in memory; a background task
+    flushes everything pending in one bulk UPDATE every flush interval, so a
+    mass disconnect (deploys, network blips) doesn't become a storm of
+    single-row commits.
+    """
+    def __init__(self, flush_interval_seconds: float):
+        self.flush_interval_seconds = flush_interval_seconds
+        # user_id -> latest last_seen not yet written to Postgres
+        self._pending: Dict[int, datetime] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        metrics.register_collector(lambda: {"last_seen.pending": len(self._pending)})
+
+    def record(self, user_id: int, last_seen: datetime):
+        current = self._pending.get(user_id)
+        if current is None or last_seen > current:
+            self._pending[user_id] = last_seen
+
+    def get_pending(self, user_ids: Iterable[int]) -> Dict[int, datetime]:
+        """Returns the not-yet-flushed timestamps for the given users."""
+        return {uid: self._pending[uid] for uid in user_ids if uid in self._pending}
+
+    async def flush(self):
+        """Writes every pending timestamp in a single bulk UPDATE."""
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(User),
+                    [{"id": user_id, "last_seen": last_seen} for user_id, last_seen in batch.items()],
+                )
+                await db.commit()
+            metrics.incr("last_seen.flushes")
+            metrics.incr("last_seen.rows_written", len(batch))
+        except Exception as e:
+            print(f"Error flushing last_seen for {len(batch)} users: {e}")
+            # Put the batch back, keeping anything newer recorded meanwhile
+            for user_id, last_seen in batch.items():
+                self.record(user_id, last_seen)
+
+    async def start(self):
+        self._flush_task = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self):
+        """Stops the periodic flush and writes whatever is still pending."""
+        if self._flush_task:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval_seconds)
+            await self.flush()
+
+last_seen_buffer = LastSeenBuffer(settings.LAST_SEEN_FLUSH_INTERVAL_SECONDS)
@@ -0,0 +1,122 @@
+# app/cache/local_cache.py
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, List, Optional
+import redis.asyncio as redis
+
+from app.core.metrics import metrics
+
+# Invalidations are published as "{cache_name}\n{key}[\n{key}...]" so every
+# worker drops its in-process copies, not just the one that made the change.
+INVALIDATION_CHANNEL = "cache:invalidate"
+
+class LocalCache:
+    """
+    A bounded in-process LRU cache with a per-entry TTL, used as an L1 in
+    front of Redis. Holds at most max_entries; the least recently used entry
+    is evicted first.
+
+    Loads race with invalidations: take a generation() before loading and
+    pass it to set(), which skips the write if anything was invalidated
+    meanwhile, so a stale value never outlives the invalidation.
+    """
+    def __init__(self, name: str, max_entries: int, ttl_seconds: float):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._generation = 0
+        metrics.register_collector(lambda: {f"{self.name}.l1_entries": len(self._entries)})
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            metrics.incr(f"{self.name}.l1_misses")
+            return None
+        value, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            metrics.incr(f"{self.name}.l1_misses")
+            return None
+        self._entries.move_to_end(key)
+        metrics.incr(f"{self.name}.l1_hits")
+        return value
+
+    def generation(self) -> int:
+        return self._generation
+
+    def set(self, key: Hashable, value: Any, generation: Optional[int] = None):
+        if self.max_entries <= 0:
+            return
+        if generation is not None and generation != self._generation:
+            return
+        self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            metrics.incr(f"{self.name}.l1_evictions")
+
+    def invalidate(self, key: Hashable):
+        self._generation += 1
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._generation += 1
+        self._entries.clear()
+
+class CacheInvalidator:
+    """Fans invalidations for registered LocalCaches out to every worker over Redis pub/sub."""
+    def __init__(self):
+        self._caches: Dict[str, LocalCache] = {}
+        self._pubsub = None
+        self._listener_task: Optional[asyncio.Task] = None
+
+    def register(self, cache: LocalCache) -> LocalCache:
+        self._caches[cache.name] = cache
+        return cache
+
+    async def start(self, redis_client: redis.Redis):
+        self._pubsub = redis_client.pubsub()
+        await self._pubsub.subscribe(INVALIDATION_CHANNEL)
+        self._listener_task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener_task:
+            self._listener_task.cancel()
+            try:
+                await self._listener_task
+            except asyncio.CancelledError:
+                pass
+            self._listener_task = None
+        if self._pubsub:
+            await self._pubsub.unsubscribe(INVALIDATION_CHANNEL)
+            await self._pubsub.close()
+            self._pubsub = None
+
+    async def invalidate(self, cache_name: str, key: Any, redis_client: redis.Redis):
+        """Drops the key here right away, then tells every other worker to drop it."""
+        await self.invalidate_many(cache_name, [key], redis_client)
+
+    async def invalidate_many(self, cache_name: str, keys: Iterable[Any], redis_client: redis.Redis):
+        """Like invalidate, for several keys of one cache in a single message."""
+        keys = [str(key) for key in keys]
+        if not keys:
+            return
+        self._invalidate_local(cache_name, keys)
+        await redis_client.publish(INVALIDATION_CHANNEL, "\n".join([cache_name, *keys]))
+
+    def _invalidate_local(self, cache_name: str, keys: List[str]):
+        cache = self._caches.get(cache_name)
+        if cache:
+            for key in keys:
+                cache.invalidate(key)
+
+    async def _listen(self):
+        async for raw in self._pubsub.listen():
+            if raw.get("type") != "message":
+                continue
+            cache_name, *keys = raw["data"].split("\n")
+            self._invalidate_local(cache_name, keys)
+
+cache_invalidator = CacheInvalidator()
@@ -0,0 +1,108 @@
+# app/cache/presence.py
+import json
+from typing import Dict, Iterable, Optional, Tuple
+import redis.asyncio as redis
+
+from app.core.config import settings
+
+# Per tenant we keep:
+#   presence:{tenant}          hash  connection_id -> {"status", "lastSeen"}
+#   presence:{tenant}:version  int   bumped on every status change
+#   presence:{tenant}:log      zset  recent changes scored by version, so a
+#                                    client can catch up from a known version
+def _state_key(tenant_id: int) -> str:
+    return f"presence:{tenant_id}"
+
+def _version_key(tenant_id: int) -> str:
+    return f"presence:{tenant_id}:version"
+
+def _log_key(tenant_id: int) -> str:
+    return f"presence:{tenant_id}:log"
+
+# Writes the new state, bumps the version and appends to the trimmed change log
+# atomically. Returns the new version.
+_SET_PRESENCE_SCRIPT = """
+local version = redis.call('INCR', KEYS[2])
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+local change = cjson.encode({v = version, id = ARGV[1], state = cjson.decode(ARGV[2])})
+redis.call('ZADD', KEYS[3], version, change)
+redis.call('ZREMRANGEBYRANK', KEYS[3], 0, -(tonumber(ARGV[3]) + 1))
+return version
+"""
+
+async def set_presence(
+    tenant_id: int,
+    connection_id: str,
+    status: str,
+    last_seen: Optional[str],
+    redis_client: redis.Redis
+) -> int:
+    """Records a member's status and returns the tenant's new presence version."""
+    state = json.dumps({"status": status, "lastSeen": last_seen})
+    version = await redis_client.eval(
+        _SET_PRESENCE_SCRIPT, 3,
+        _state_key(tenant_id), _version_key(tenant_id), _log_key(tenant_id),
+        connection_id, state, settings.PRESENCE_LOG_SIZE
+    )
+    return int(version)
+
+async def get_presence_snapshot(tenant_id: int, redis_client: redis.Redis) -> Tuple[int, Dict[str, dict]]:
+    """Returns (version, {connection_id: state}) for a tenant in one round trip."""
+    pipeline = redis_client.pipeline(transaction=True)
+    pipeline.hgetall(_state_key(tenant_id))
+    pipeline.get(_version_key(tenant_id))
+    states, version = await pipeline.execute()
+    return int(version or 0), {cid: json.loads(state) for cid, state in states.items()}
+
+async def get_presence_changes_since(
+    tenant_id: int,
+    since_version: int,
+    redis_client: redis.Redis
+) -> Optional[Tuple[int, Dict[str, dict]]]:
+    """
+    Returns (version, {connection_id: state}) with only what changed after
+    since_version, or None if the log no longer reaches back that far and the
+    caller needs a full snapshot instead.
+    """
+    pipeline = redis_client.pipeline(transaction=True)
+    pipeline.get(_version_key(tenant_id))
+    pipeline.zrange(_log_key(tenant_id), 0, 0, withscores=True)
+    pipeline.zrangebyscore(_log_key(tenant_id), f"({since_version}", "+inf")
+    version, oldest, entries = await pipeline.execute()
+    version = int(version or 0)
+
+    if since_version > version:
+        # The client knows a version we never issued (e.g. Redis was flushed)
+        return None
+    if since_version == version:
+        return version, {}
+    if not oldest or int(oldest[0][1]) > since_version + 1:
+        return None
+
+    changes = {}
+    for entry in entries:
+        change = json.loads(entry)
+        changes[change["id"]] = change["state"]
+    return version, changes
+
+async def seed_presence(tenant_id: int, states: Dict[str, dict], redis_client: redis.Redis):
+    """
+    Fills in members that have never been recorded (e.g. offline since before
+    the store existed) without bumping the version or overwriting live state.
+    """
+    if not states:
+        return
+    pipeline = redis_client.pipeline()
+    for connection_id, state in states.items():
+        pipeline.hsetnx(_state_key(tenant_id), connection_id, json.dumps(state))
+    await pipeline.execute()
+
+async def get_online_connection_ids(tenant_id: int, redis_client: redis.Redis) -> set[str]:
+    """Returns the connection ids currently online in a tenant."""
+    _, states = await get_presence_snapshot(tenant_id, redis_client)
+    return {cid for cid, state in states.items() if state.get("status") == "online"}
+
+def filter_states(states: Dict[str, dict], members: Iterable[str], exclude: Optional[str] = None) -> Dict[str, dict]:
+    """Keeps only the states of current tenant members, optionally leaving one out."""
+    members = set(members)
+    return {cid: state for cid, state in states.items() if cid in members and cid != exclude}
@@ -0,0 +1,90 @@
+# app/cache/principals.py
+from typing import Iterable, List, Optional, Union
+import redis.asyncio as redis
+from sqlalchemy import inspect, select, union_all, literal_column, null, true
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
+
+from app.core.config import settings
+from app.cache.local_cache import LocalCache, cache_invalidator
+from app.db.session import AsyncSessionLocal
+from app.models import User, Admin, SuperAdmin
+
+Principal = Union[User, Admin, SuperAdmin]
+
+_MODELS = {"user": User, "admin": Admin, "super_admin": SuperAdmin}
+
+# Authenticated identities keyed by "{role}:{username}", so the username lookup
+# behind every request is served from memory. Only column values are cached;
+# each caller gets its own detached instance built from them.
+_principals_l1 = cache_invalidator.register(LocalCache(
+    "principals", settings.PRINCIPAL_CACHE_MAX_ENTRIES, settings.PRINCIPAL_CACHE_TTL_SECONDS
+))
+
+def _cache_key(role: str, username: str) -> str:
+    return f"{role}:{username}"
+
+def principal_role(entity: Principal) -> str:
+    if isinstance(entity, SuperAdmin):
+        return "super_admin"
+    return "admin" if isinstance(entity, Admin) else "user"
+
+async def get_principal(role: str, username: str) -> Optional[Principal]:
+    """
+    Returns the user, admin or super admin behind a token as a detached
+    instance (no relationships loaded), or None if they don't exist.
+    """
+    model = _MODELS.get(role)
+    if model is None:
+        return None
+
+    key = _cache_key(role, username)
+    columns = _principals_l1.get(key)
+    if columns is None:
+        generation = _principals_l1.generation()
+        async with AsyncSessionLocal() as db:
+            entity = await db.scalar(select(model).filter(model.username == username))
+        if entity is None:
+            return None
+        columns = {attr.key: getattr(entity, attr.key) for attr in inspect(model).column_attrs}
+        _principals_l1.set(key, columns, generation)
+
+    principal = model(**columns)
+    make_transient_to_detached(principal)
+    return principal
+
+def _credentials_query(username: str):
+    # One row per table the username exists in, each from its unique username
+    # index. `rank` preserves the user -> admin -> super_admin precedence.
+    # Constants are inlined so the driver never has to type untyped parameters.
+    users = select(
+        literal_column("0").label("rank"), literal_column("'user'").label("role"), User.id, User.username,
+        User.password_hash, User.is_active, User.admin_id.label("tenant_id"),
+    ).where(User.username == username)
+    admins = select(
+        literal_column("1"), literal_column("'admin'"), Admin.id, Admin.username,
+        Admin.password_hash, Admin.is_active, Admin.id,
+    ).where(Admin.username == username)
+    super_admins = select(
+        literal_column("2"), literal_column("'super_admin'"), SuperAdmin.id, SuperAdmin.username,
+        SuperAdmin.password_hash, true(), null(),
+    ).where(SuperAdmin.username == username)
+    combined = union_all(users, admins, super_admins).subquery()
+    return select(combined).order_by(combined.c.rank)
+
+async def get_login_candidates(username: str, db: AsyncSession) -> List:
+    """
+    Every principal with this username, in login precedence order, fetched in
+    a single round trip. Rows carry role, id, username, password_hash,
+    is_active and tenant_id (the token claim).
+    """
+    return list(await db.execute(_credentials_query(username)))
+
+async def invalidate_principal(role: str, username: str, redis_client: redis.Redis):
+    """Drops a cached identity on every worker; call after changing the row."""
+    await cache_invalidator.invalidate(_principals_l1.name, _cache_key(role, username), redis_client)
+
+async def invalidate_principals(role: str, usernames: Iterable[str], redis_client: redis.Redis):
+    await cache_invalidator.invalidate_many(
+        _principals_l1.name, [_cache_key(role, username) for username in usernames], redis_client
+    )
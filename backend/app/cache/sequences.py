@@ -0,0 +1,114 @@
+# app/cache/sequences.py
+import redis.asyncio as redis
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import DESCENDING, ReturnDocument
+
+from app.core.config import settings
+from app.core.metrics import metrics
+
+# Per-conversation message sequence numbers. Redis hands them out with INCR on
+#   seq:{conversation_key}
+# The key is seeded from the highest seq already stored in Mongo, so a flushed
+# or evicted key picks up where the conversation left off. If Redis is down we
+# allocate from a counter document in Mongo instead and flag it for resync;
+# once Redis answers again, flagged keys are raised past those counters before
+# any more INCRs, so a key that survived the outage can't reissue their seqs.
+COUNTERS_COLLECTION = "conversation_counters"
+
+# Set when this process fell back to Mongo; cleared once counters are resynced
+_fallback_pending = False
+
+def _seq_key(conversation_key: str) -> str:
+    return f"seq:{conversation_key}"
+
+# INCR only if the key exists; returns nil so the caller can seed it first.
+# Refreshing the TTL means idle conversations are reseeded from Mongo later.
+_INCR_EXISTING_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+local seq = redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return seq
+"""
+
+# Raises the key to at least ARGV[1], never lowering it, and refreshes the TTL.
+_RAISE_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+if current < tonumber(ARGV[1]) then
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+end
+return 1
+"""
+
+async def _stored_max_seq(conversation_key: str, mongo_db: AsyncIOMotorDatabase) -> int:
+    """The highest seq persisted for a conversation, in messages or the fallback counter."""
+    latest = await mongo_db["messages"].find_one(
+        {"conversation_key": conversation_key, "seq": {"$exists": True}},
+        projection={"seq": 1},
+        sort=[("seq", DESCENDING)],
+    )
+    counter = await mongo_db[COUNTERS_COLLECTION].find_one({"_id": conversation_key})
+    return max(latest["seq"] if latest else 0, counter["seq"] if counter else 0)
+
+async def _allocate_from_redis(
+    conversation_key: str,
+    mongo_db: AsyncIOMotorDatabase,
+    redis_client: redis.Redis
+) -> int:
+    key = _seq_key(conversation_key)
+    ttl = settings.MESSAGE_SEQ_KEY_TTL_SECONDS
+    seq = await redis_client.eval(_INCR_EXISTING_SCRIPT, 1, key, ttl)
+    if seq is None:
+        # Seed once; if another worker got there first, its seed wins
+        await redis_client.set(key, await _stored_max_seq(conversation_key, mongo_db), nx=True, ex=ttl)
+        seq = await redis_client.eval(_INCR_EXISTING_SCRIPT, 1, key, ttl)
+    return int(seq)
+
+async def _allocate_from_mongo(conversation_key: str, mongo_db: AsyncIOMotorDatabase) -> int:
+    counters = mongo_db[COUNTERS_COLLECTION]
+    # Make sure the counter is past everything Redis already handed out and persisted
+    await counters.update_one(
+        {"_id": conversation_key},
+        {"$max": {"seq": await _stored_max_seq(conversation_key, mongo_db)}},
+        upsert=True,
+    )
+    counter = await counters.find_one_and_update(
+        {"_id": conversation_key},
+        {"$inc": {"seq": 1}, "$set": {"resync": True}},
+        return_document=ReturnDocument.AFTER,
+    )
+    return counter["seq"]
+
+async def _resync_after_fallback(mongo_db: AsyncIOMotorDatabase, redis_client: redis.Redis):
+    """
+    Raises the Redis key of every conversation that was allocated from Mongo
+    (by any worker) to max(stored seq, fallback counter).
+    """
+    counters = mongo_db[COUNTERS_COLLECTION]
+    ttl = settings.MESSAGE_SEQ_KEY_TTL_SECONDS
+    async for counter in counters.find({"resync": True}, projection={"seq": 1}):
+        conversation_key = counter["_id"]
+        floor = await _stored_max_seq(conversation_key, mongo_db)
+        await redis_client.eval(_RAISE_SCRIPT, 1, _seq_key(conversation_key), floor, ttl)
+        # Leave the flag if another fallback allocation moved the counter meanwhile
+        await counters.update_one({"_id": conversation_key, "seq": counter["seq"]}, {"$unset": {"resync": ""}})
+        metrics.incr("message_seq.resynced_keys")
+
+async def allocate_seq(
+    conversation_key: str,
+    mongo_db: AsyncIOMotorDatabase,
+    redis_client: redis.Redis
+) -> int:
+    """Returns the next sequence number for a conversation."""
+    global _fallback_pending
+    try:
+        if _fallback_pending:
+            await _resync_after_fallback(mongo_db, redis_client)
+            _fallback_pending = False
+        return await _allocate_from_redis(conversation_key, mongo_db, redis_client)
+    except redis.RedisError as e:
+        _fallback_pending = True
+        print(f"Redis unavailable for seq allocation ({e}); falling back to Mongo.")
+        metrics.incr("message_seq.mongo_fallbacks")
+        return await _allocate_from_mongo(conversation_key, mongo_db)
@@ -0,0 +1,132 @@
+# app/cache/single_flight.py
+import asyncio
+import random
+import uuid
+from typing import Awaitable, Callable, Dict, Set
+import redis.asyncio as redis
+
+from app.core.config import settings
+from app.core.metrics import metrics
+
+# Stored in place of an empty set, so "no members" is cached like any other result
+EMPTY_SENTINEL = "__empty__"
+
+# Deletes the lock only if we still hold it
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+def jittered_ttl(ttl_seconds: int) -> int:
+    """Spreads expiries out so keys cached together don't all expire together."""
+    return int(ttl_seconds * (1 + random.uniform(0, settings.CACHE_TTL_JITTER_RATIO)))
+
+def _strip_sentinel(members: Set[str]) -> Set[str]:
+    members.discard(EMPTY_SENTINEL)
+    return members
+
+class _LeaderCancelled(Exception):
+    """Set on a shared load whose caller was cancelled before it finished."""
+
+class SingleFlight:
+    """
+    Runs at most one loader per key at a time; concurrent callers share its
+    result. If the caller running the load is cancelled, the waiting callers
+    aren't: the first of them to wake up runs the load again and the rest
+    join that one. Loaders must not depend on the caller that started them
+    (e.g. on its DB session), since their result outlives it.
+    """
+    def __init__(self):
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    async def run(self, key: str, loader: Callable[[], Awaitable]):
+        while key in self._in_flight:
+            metrics.incr("cache.single_flight_joins")
+            try:
+                return await asyncio.shield(self._in_flight[key])
+            except _LeaderCancelled:
+                metrics.incr("cache.single_flight_retries")
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await loader()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.set_exception(_LeaderCancelled())
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody may be waiting; don't warn about an unretrieved exception
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+
+single_flight = SingleFlight()
+
+async def get_or_load_set(
+    cache_key: str,
+    loader: Callable[[], Awaitable[Set[str]]],
+    redis_client: redis.Redis,
+    ttl_seconds: int
+) -> Set[str]:
+    """
+    Returns a cached Redis set, loading it on a miss with stampede protection:
+    coroutines in this worker share one load, and workers coordinate through
+    a short Redis lock so only one of them runs the loader. Empty results are
+    cached with a sentinel member for CACHE_EMPTY_TTL_SECONDS.
+    """
+    cached = await redis_client.smembers(cache_key)
+    if cached:
+        return _strip_sentinel(cached)
+    return set(await single_flight.run(
+        cache_key, lambda: _load_with_lock(cache_key, loader, redis_client, ttl_seconds)
+    ))
+
+async def _load_with_lock(
+    cache_key: str,
+    loader: Callable[[], Awaitable[Set[str]]],
+    redis_client: redis.Redis,
+    ttl_seconds: int
+) -> Set[str]:
+    lock_key = f"{cache_key}:lock"
+    lock_token = uuid.uuid4().hex
+    lock_ms = settings.CACHE_LOAD_LOCK_MS
+
+    if not await redis_client.set(lock_key, lock_token, nx=True, px=lock_ms):
+        # Another worker is loading; wait for it to fill the key
+        metrics.incr("cache.lock_waits")
+        deadline = asyncio.get_running_loop().time() + lock_ms / 1000
+        while asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(0.05)
+            cached = await redis_client.smembers(cache_key)
+            if cached:
+                return _strip_sentinel(cached)
+        # The holder died or is too slow; load it ourselves
+        metrics.incr("cache.lock_timeouts")
+        return await loader()
+
+    try:
+        # It may have been filled between our miss and taking the lock
+        cached = await redis_client.smembers(cache_key)
+        if cached:
+            return _strip_sentinel(cached)
+
+        metrics.incr("cache.loads")
+        members = await loader()
+        pipeline = redis_client.pipeline()
+        if members:
+            pipeline.sadd(cache_key, *members)
+            pipeline.expire(cache_key, jittered_ttl(ttl_seconds))
+        else:
+            pipeline.sadd(cache_key, EMPTY_SENTINEL)
+            pipeline.expire(cache_key, jittered_ttl(settings.CACHE_EMPTY_TTL_SECONDS))
+        await pipeline.execute()
+        return members
+    finally:
+        await redis_client.eval(_RELEASE_LOCK_SCRIPT, 1, lock_key, lock_token)
@@ -38,46 +38,39 @@
 #     cache_key = f"tenant:{tenant_id}:members"
 #     redis_client.delete(cache_key)
 
-from sqlalchemy.orm import Session
+from sqlalchemy import select
 from fastapi import Depends
 import redis.asyncio as redis
 
+from app.cache.single_flight import get_or_load_set
+from app.db.session import AsyncSessionLocal
 from app.models import User, Admin
 
 CACHE_EXPIRATION_SECONDS = 3600
 
 async def get_tenant_connection_ids(
     tenant_id: int, 
-    db: Session, 
     redis_client: redis.Redis
 ) -> set[str]:
     """
     Returns a set of connection IDs for a tenant, using Redis as a cache.
+    A cold tenant is loaded from PostgreSQL once, however many sockets connect
+    at the same time, on a session of its own rather than the first caller's.
     """
     cache_key = f"tenant:{tenant_id}:members"
 
-    cached_members = await redis_client.smembers(cache_key)
-    if cached_members:
-        return cached_members
-    
-    print("--- CACHE MISS ---")
+    async def load_from_db() -> set[str]:
+        async with AsyncSessionLocal() as db:
+            tenant_user_ids = (await db.scalars(select(User.id).filter(User.admin_id == tenant_id))).all()
+            tenant_admin_id = await db.scalar(select(Admin.id).filter(Admin.id == tenant_id))
 
-    tenant_users = db.query(User.id).filter(User.admin_id == tenant_id).all()
-    tenant_admin = db.query(Admin.id).filter(Admin.id == tenant_id).first()
+        connection_ids = {f"user-{uid}" for uid in tenant_user_ids}
+        if tenant_admin_id:
+            connection_ids.add(f"admin-{tenant_admin_id}")
+        return connection_ids
 
-    connection_ids = {f"user-{uid}" for uid, in tenant_users}
-    if tenant_admin:
-        connection_ids.add(f"admin-{tenant_admin.id}")
-    
-    if connection_ids:
-        pipeline = redis_client.pipeline()
-        await pipeline.sadd(cache_key, *connection_ids)
-        await pipeline.expire(cache_key, CACHE_EXPIRATION_SECONDS)
-        await pipeline.execute()
-    
-    return connection_ids
+    return await get_or_load_set(cache_key, load_from_db, redis_client, CACHE_EXPIRATION_SECONDS)
 
 async def invalidate_tenant_cache(tenant_id: int, redis_client: redis.Redis):
     cache_key = f"tenant:{tenant_id}:members"
     await redis_client.delete(cache_key)
-    await redis_client.delete(cache_key)
@@ -0,0 +1,292 @@
+# app/cache/unread.py
+import json
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+import redis.asyncio as redis
+from redis.exceptions import WatchError
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from app.db.conversations import private_conversation_key, group_conversation_key
+from app.db.conversation_summaries import message_preview
+from app.db.read_cursors import get_reader_cursors, get_last_read
+
+# Unread state per reader, kept in Redis and moved on every write instead of
+# being recounted from messages on every poll:
+#   unread:{role}-{id}         hash  conversation field -> unread count
+#   unread:{role}-{id}:latest  hash  conversation field -> JSON of the newest
+#                                    unread message (name, preview, timestamp)
+# Conversation fields are named from the reader's side: "private:admin-3"
+# (the partner) or "group:42".
+
+def _counts_key(reader_cid: str) -> str:
+    return f"unread:{reader_cid}"
+
+def _latest_key(reader_cid: str) -> str:
+    return f"unread:{reader_cid}:latest"
+
+def conversation_field(conversation: Dict[str, Any]) -> str:
+    if conversation["type"] == "group":
+        return f"group:{conversation['id']}"
+    return f"private:{conversation['role']}-{conversation['id']}"
+
+def _conversation_from_field(field: str) -> Dict[str, Any]:
+    kind, name = field.split(":", 1)
+    if kind == "group":
+        return {"type": "group", "id": int(name), "role": None}
+    role, id_str = name.split("-")
+    return {"type": "private", "id": int(id_str), "role": role}
+
+def message_conversation(message: Dict[str, Any]) -> Dict[str, Any]:
+    """The conversation a message belongs to, as seen by its recipients."""
+    if message["type"] == "group":
+        return {"type": "group", "id": message["group"]["id"], "role": None}
+    return {"type": "private", "id": message["sender"]["id"], "role": message["sender"]["role"]}
+
+def _latest_entry(message: Dict[str, Any]) -> str:
+    name = message["group"]["name"] if message["type"] == "group" else message["sender"]["username"]
+    timestamp = message["timestamp"]
+    if isinstance(timestamp, datetime):
+        timestamp = timestamp.isoformat() + "Z"
+    return json.dumps({"name": name, "preview": message_preview(message), "timestamp": timestamp})
+
+async def record_unread(
+    message: Dict[str, Any],
+    recipients: Iterable[str],
+    redis_client: redis.Redis
+) -> Dict[str, int]:
+    """
+    Counts a new message as unread for each recipient connection id (the
+    sender should not be among them). Returns each recipient's new count.
+    """
+    recipients = list(recipients)
+    if not recipients:
+        return {}
+    field = conversation_field(message_conversation(message))
+    latest = _latest_entry(message)
+    pipe = redis_client.pipeline(transaction=False)
+    for recipient in recipients:
+        pipe.hincrby(_counts_key(recipient), field, 1)
+        pipe.hset(_latest_key(recipient), field, latest)
+    results = await pipe.execute()
+    return {recipient: int(count) for recipient, count in zip(recipients, results[::2])}
+
+async def clear_unread(reader_cid: str, conversation: Dict[str, Any], redis_client: redis.Redis):
+    """Drops a conversation's counter outright, e.g. when the reader leaves the group."""
+    field = conversation_field(conversation)
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hdel(_counts_key(reader_cid), field)
+    pipe.hdel(_latest_key(reader_cid), field)
+    await pipe.execute()
+
+def _entry_timestamp(entry: str) -> datetime:
+    """The timestamp of a latest-message entry, at the millisecond precision Mongo stores."""
+    timestamp = datetime.fromisoformat(json.loads(entry)["timestamp"].rstrip("Z"))
+    return timestamp.replace(microsecond=timestamp.microsecond // 1000 * 1000)
+
+async def settle_unread(
+    reader: Dict[str, Any],
+    conversation: Dict[str, Any],
+    read_at: datetime,
+    mongo_db: AsyncIOMotorDatabase,
+    redis_client: redis.Redis,
+    attempts: int = 3
+) -> int:
+    """
+    Brings a conversation's counter in line with a read receipt up to read_at.
+    If that covers the newest counted message the counter is cleared,
+    otherwise the conversation is recounted from Mongo. Both are a
+    compare-and-set against the counted messages, so an increment landing
+    meanwhile is retried, not lost. Returns the reader's remaining count.
+    """
+    reader_cid = f"{reader['role']}-{reader['id']}"
+    counts_key, latest_key = _counts_key(reader_cid), _latest_key(reader_cid)
+    field = conversation_field(conversation)
+    async with redis_client.pipeline(transaction=True) as pipe:
+        for _ in range(attempts):
+            try:
+                await pipe.watch(counts_key, latest_key)
+                entry = await pipe.hget(latest_key, field)
+                unread = None
+                if entry is not None and _entry_timestamp(entry) > read_at:
+                    # Messages newer than what the reader saw are still unread
+                    unread = await count_conversation_unread(reader, conversation, mongo_db)
+
+                pipe.multi()
+                if unread:
+                    pipe.hset(counts_key, field, unread["count"])
+                    pipe.hset(latest_key, field, _latest_entry(unread["latest"]))
+                else:
+                    pipe.hdel(counts_key, field)
+                    pipe.hdel(latest_key, field)
+                await pipe.execute()
+                return unread["count"] if unread else 0
+            except WatchError:
+                continue
+    # Still moving: leave it to the next receipt or the reconciler
+    return int(await redis_client.hget(counts_key, field) or 0)
+
+async def get_unread(reader_cid: str, redis_client: redis.Redis) -> List[Dict[str, Any]]:
+    """
+    Every conversation with unread messages for the reader, newest first, in
+    the notifications summary shape (without full names).
+    """
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hgetall(_counts_key(reader_cid))
+    pipe.hgetall(_latest_key(reader_cid))
+    counts, latest = await pipe.execute()
+
+    notifications = []
+    for field, count in counts.items():
+        if int(count) <= 0 or field not in latest:
+            continue
+        conversation = _conversation_from_field(field)
+        entry = json.loads(latest[field])
+        notifications.append({
+            "conversation_details": {
+                "id": conversation["id"],
+                "name": entry["name"],
+                "type": conversation["role"] or "group",
+            },
+            "last_message": {"preview": entry["preview"], "timestamp": entry["timestamp"]},
+            "unread_count": int(count),
+        })
+    notifications.sort(
+        key=lambda notif: datetime.fromisoformat(notif["last_message"]["timestamp"].replace("Z", "+00:00")),
+        reverse=True,
+    )
+    return notifications
+
+async def count_unread(
+    reader: Dict[str, Any],
+    group_ids: List[int],
+    mongo_db: AsyncIOMotorDatabase
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Recounts a reader's unread messages from Mongo and their read watermarks,
+    counting groups only from group_ids (the reader's active memberships).
+    Returns conversation field -> {"count", "latest"}; only used to repair drift.
+    """
+    # Turn the reader's watermarks into "newer than" conditions per conversation
+    private_watermarks = []
+    group_watermarks = {}
+    for cursor in await get_reader_cursors(mongo_db, reader):
+        conversation = cursor["conversation"]
+        if conversation["type"] == "private":
+            private_watermarks.append((conversation, cursor["last_read_at"]))
+        else:
+            group_watermarks[conversation["id"]] = cursor["last_read_at"]
+
+    unread_conditions = [
+        # Private messages from partners the reader has a watermark for
+        {
+            "conversation_key": private_conversation_key(reader["role"], reader["id"], partner["role"], partner["id"]),
+            "sender.id": partner["id"], "sender.role": partner["role"],
+            "timestamp": {"$gt": last_read_at}
+        }
+        for partner, last_read_at in private_watermarks
+    ]
+    # Private messages from partners the reader has never read anything from
+    unread_private = {"receiver.id": reader["id"], "receiver.role": reader["role"]}
+    if private_watermarks:
+        unread_private["$nor"] = [
+            {"sender.id": partner["id"], "sender.role": partner["role"]}
+            for partner, _ in private_watermarks
+        ]
+    unread_conditions.append(unread_private)
+    # Messages only from groups the reader is an active member of
+    for group_id in group_ids:
+        condition = {"conversation_key": group_conversation_key(group_id)}
+        if group_id in group_watermarks:
+            condition["timestamp"] = {"$gt": group_watermarks[group_id]}
+        unread_conditions.append(condition)
+
+    pipeline = [
+        {"$match": {
+            "$or": unread_conditions,
+            # A reader's own messages are never unread.
+            "$nor": [{"sender.id": reader["id"], "sender.role": reader["role"]}]
+        }},
+        {"$sort": {"timestamp": -1}},
+        {"$group": {
+            "_id": {"$cond": {
+                "if": {"$eq": ["$type", "private"]},
+                "then": {"type": "private", "id": "$sender.id", "role": "$sender.role"},
+                "else": {"type": "group", "id": "$group.id", "role": None},
+            }},
+            "latest": {"$first": "$$ROOT"},
+            "count": {"$sum": 1},
+        }},
+    ]
+    unread = {}
+    async for row in mongo_db["messages"].aggregate(pipeline, allowDiskUse=True):
+        unread[conversation_field(row["_id"])] = {"count": row["count"], "latest": row["latest"]}
+    return unread
+
+async def count_conversation_unread(
+    reader: Dict[str, Any],
+    conversation: Dict[str, Any],
+    mongo_db: AsyncIOMotorDatabase
+) -> Optional[Dict[str, Any]]:
+    """
+    count_unread for a single conversation: {"count", "latest"} past the
+    reader's watermark, or None if nothing is unread.
+    """
+    if conversation["type"] == "group":
+        query = {"conversation_key": group_conversation_key(conversation["id"])}
+    else:
+        query = {
+            "conversation_key": private_conversation_key(
+                reader["role"], reader["id"], conversation["role"], conversation["id"]
+            ),
+            "sender.id": conversation["id"], "sender.role": conversation["role"],
+        }
+    last_read_at = await get_last_read(mongo_db, reader, conversation)
+    if last_read_at:
+        query["timestamp"] = {"$gt": last_read_at}
+    query["$nor"] = [{"sender.id": reader["id"], "sender.role": reader["role"]}]
+
+    count = await mongo_db["messages"].count_documents(query)
+    if not count:
+        return None
+    latest = await mongo_db["messages"].find_one(query, sort=[("timestamp", -1), ("_id", -1)])
+    return {"count": count, "latest": latest}
+
+async def reconcile_unread(
+    reader: Dict[str, Any],
+    group_ids: List[int],
+    mongo_db: AsyncIOMotorDatabase,
+    redis_client: redis.Redis,
+    attempts: int = 3
+) -> bool:
+    """
+    Rewrites a reader's counters from Mongo. Returns True if they had drifted.
+    The rewrite is a compare-and-set: if an increment lands between the
+    recount and the write, it is retried rather than overwritten. A message
+    already stored at recount time whose increment arrives after the write
+    is still counted twice, until the reader next reads the conversation.
+    """
+    reader_cid = f"{reader['role']}-{reader['id']}"
+    counts_key, latest_key = _counts_key(reader_cid), _latest_key(reader_cid)
+    async with redis_client.pipeline(transaction=True) as pipe:
+        for _ in range(attempts):
+            try:
+                await pipe.watch(counts_key)
+                unread = await count_unread(reader, group_ids, mongo_db)
+                expected = {field: str(entry["count"]) for field, entry in unread.items()}
+                if await pipe.hgetall(counts_key) == expected:
+                    await pipe.unwatch()
+                    return False
+
+                pipe.multi()
+                pipe.delete(counts_key, latest_key)
+                if unread:
+                    pipe.hset(counts_key, mapping=expected)
+                    pipe.hset(latest_key, mapping={
+                        field: _latest_entry(entry["latest"]) for field, entry in unread.items()
+                    })
+                await pipe.execute()
+                return True
+            except WatchError:
+                continue
+    print(f"Gave up reconciling unread counters of {reader_cid}: they kept changing")
+    return False
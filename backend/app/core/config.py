@@ -31,11 +31,81 @@ class Settings:
     # Redis settings
     REDIS_URL: str = os.getenv("REDIS_URL", "redis://localhost:6379")
 
+    # WebSocket delivery settings
+    # Max frames buffered per connection before the slow-consumer policy kicks in
+    WS_SEND_QUEUE_SIZE: int = int(os.getenv("WS_SEND_QUEUE_SIZE", 256))
+    # "drop_oldest", "drop_newest" or "disconnect"
+    WS_SLOW_CONSUMER_POLICY: str = os.getenv("WS_SLOW_CONSUMER_POLICY", "drop_oldest")
+
+    # Nodes refresh a liveness key this often; sessions of a node silent for
+    # the TTL are swept and their identities marked offline
+    WS_NODE_HEARTBEAT_SECONDS: float = float(os.getenv("WS_NODE_HEARTBEAT_SECONDS", 10))
+    WS_NODE_TTL_SECONDS: int = int(os.getenv("WS_NODE_TTL_SECONDS", 30))
+
+    # Bearer token scrapers must send to read /metrics; unset disables the endpoint
+    METRICS_TOKEN: str = os.getenv("METRICS_TOKEN", "")
+
+    # Recent frames kept per identity so a reconnecting client can resume (0 disables)
+    WS_REPLAY_BUFFER_SIZE: int = int(os.getenv("WS_REPLAY_BUFFER_SIZE", 200))
+    # How long a dropped session can be resumed, and how long idle buffers are kept
+    WS_REPLAY_RETENTION_SECONDS: int = int(os.getenv("WS_REPLAY_RETENTION_SECONDS", 120))
+
+    # Presence changes are coalesced per tenant for this long before being sent
+    PRESENCE_COALESCE_WINDOW_MS: int = int(os.getenv("PRESENCE_COALESCE_WINDOW_MS", 250))
+    # Per-tenant overrides, e.g. "12:500,31:0" (0 sends every change immediately)
+    PRESENCE_COALESCE_WINDOW_OVERRIDES: str = os.getenv("PRESENCE_COALESCE_WINDOW_OVERRIDES", "")
+
+    # How many recent presence changes are kept per tenant for version catch-up
+    PRESENCE_LOG_SIZE: int = int(os.getenv("PRESENCE_LOG_SIZE", 1000))
+
+    # Membership caches: TTLs get up to this fraction added at random, empty results
+    # are cached for a shorter time, and a cold key is loaded under a Redis lock this long
+    CACHE_TTL_JITTER_RATIO: float = float(os.getenv("CACHE_TTL_JITTER_RATIO", 0.1))
+    CACHE_EMPTY_TTL_SECONDS: int = int(os.getenv("CACHE_EMPTY_TTL_SECONDS", 60))
+    CACHE_LOAD_LOCK_MS: int = int(os.getenv("CACHE_LOAD_LOCK_MS", 5000))
+
+    # In-process L1 over the Redis group membership sets
+    GROUP_MEMBERS_L1_MAX_ENTRIES: int = int(os.getenv("GROUP_MEMBERS_L1_MAX_ENTRIES", 10000))
+    GROUP_MEMBERS_L1_TTL_SECONDS: float = float(os.getenv("GROUP_MEMBERS_L1_TTL_SECONDS", 30))
+
+    # Authenticated identities are cached in-process for this long (invalidated on change)
+    PRINCIPAL_CACHE_TTL_SECONDS: float = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", 60))
+    PRINCIPAL_CACHE_MAX_ENTRIES: int = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", 10000))
+
+    # last_seen timestamps are buffered in memory and written in bulk this often
+    LAST_SEEN_FLUSH_INTERVAL_SECONDS: float = float(os.getenv("LAST_SEEN_FLUSH_INTERVAL_SECONDS", 5))
+
+    # New messages are inserted with one insert_many per window (or once this many are queued)
+    MESSAGE_BATCH_WINDOW_MS: int = int(os.getenv("MESSAGE_BATCH_WINDOW_MS", 5))
+    MESSAGE_BATCH_MAX_SIZE: int = int(os.getenv("MESSAGE_BATCH_MAX_SIZE", 500))
+
+    # Redis seq counters expire after this long idle and are reseeded from Mongo
+    MESSAGE_SEQ_KEY_TTL_SECONDS: int = int(os.getenv("MESSAGE_SEQ_KEY_TTL_SECONDS", 86400))
+
     # JWT settings
     SECRET_KEY: str = os.getenv("SECRET_KEY", "a_very_secret_key")
     ALGORITHM: str = os.getenv("ALGORITHM", "HS256")
     ACCESS_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
 
+    # bcrypt runs on its own pool; hashes beyond workers + queue are rejected
+    PASSWORD_HASH_WORKERS: int = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 2))
+    PASSWORD_HASH_MAX_QUEUE: int = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", 64))
+
+    # Login throttling: attempts per client address, failures per username
+    LOGIN_IP_MAX_ATTEMPTS: int = int(os.getenv("LOGIN_IP_MAX_ATTEMPTS", 30))
+    LOGIN_IP_WINDOW_SECONDS: int = int(os.getenv("LOGIN_IP_WINDOW_SECONDS", 60))
+    LOGIN_USERNAME_MAX_FAILURES: int = int(os.getenv("LOGIN_USERNAME_MAX_FAILURES", 10))
+    LOGIN_USERNAME_WINDOW_SECONDS: int = int(os.getenv("LOGIN_USERNAME_WINDOW_SECONDS", 900))
+
+    # Per-process Bloom filter of revoked token ids; sized for this many revocations
+    TOKEN_REVOCATION_FILTER_CAPACITY: int = int(os.getenv("TOKEN_REVOCATION_FILTER_CAPACITY", 100000))
+    TOKEN_REVOCATION_FILTER_ERROR_RATE: float = float(os.getenv("TOKEN_REVOCATION_FILTER_ERROR_RATE", 0.01))
+    # ...and rebuilt from the live revoked set this often, so expired entries drop out
+    TOKEN_REVOCATION_FILTER_REBUILD_SECONDS: float = float(os.getenv("TOKEN_REVOCATION_FILTER_REBUILD_SECONDS", 3600))
+
+    # Hot read endpoints skip per-item Pydantic validation and encode with orjson
+    FAST_JSON_RESPONSES: bool = os.getenv("FAST_JSON_RESPONSES", "false").lower() in ("1", "true", "yes")
+
     # API settings
     API_V1_STR: str = "/api/v1"
 
@@ -0,0 +1,36 @@
+# app/core/metrics.py
+import inspect
+from collections import defaultdict
+from typing import Any, Callable, Dict, List
+
+class Metrics:
+    """
+    A tiny in-process metrics registry.
+    Counters only ever go up, gauges hold the latest value, and collectors
+    are callables (sync or async) polled for extra gauges at snapshot time.
+    """
+    def __init__(self):
+        self._counters: Dict[str, int] = defaultdict(int)
+        self._gauges: Dict[str, Any] = {}
+        self._collectors: List[Callable] = []
+
+    def incr(self, name: str, value: int = 1):
+        self._counters[name] += value
+
+    def set_gauge(self, name: str, value: Any):
+        self._gauges[name] = value
+
+    def register_collector(self, collector: Callable):
+        self._collectors.append(collector)
+
+    async def snapshot(self) -> Dict[str, Any]:
+        """Returns every counter and gauge, including collected ones."""
+        gauges = dict(self._gauges)
+        for collector in self._collectors:
+            collected = collector()
+            if inspect.isawaitable(collected):
+                collected = await collected
+            gauges.update(collected)
+        return {"counters": dict(self._counters), "gauges": gauges}
+
+metrics = Metrics()
@@ -0,0 +1,26 @@
+# app/core/responses.py
+from typing import Any
+import orjson
+from bson import ObjectId
+from fastapi.responses import Response
+
+def _default(value: Any) -> Any:
+    # orjson handles datetimes natively; ObjectIds go out as their hex string
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+def encode_json(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default)
+
+class FastJSONResponse(Response):
+    """
+    JSON response for content that is already in its response model's output
+    shape. Returning it from an endpoint skips response_model validation, so
+    the endpoint must shape every item exactly as the model would; the model
+    still documents the endpoint in OpenAPI.
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return encode_json(content)
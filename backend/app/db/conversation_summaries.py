@@ -0,0 +1,152 @@
+# app/db/conversation_summaries.py
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import DESCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.db.conversations import conversation_key_for_message, group_conversation_key
+
+# The latest message of every conversation, kept up to date as messages are
+# written, so listing someone's conversations never scans their history:
+# {
+#   "conversation_key": "p:admin-3|user-7" | "g:42",
+#   "type": "private" | "group",
+#   "owner": {"id": 7, "role": "user"},       # private: one document per side
+#            None,                            # group: one document per group
+#   "partner": {"id": 3, "role": "admin"},    # private only, the other side
+#   "group": {"id": 42, "name": "..."},       # group only
+#   "last_message_id": ObjectId,
+#   "last_message": "text" | "[Attachment]" | "",
+#   "last_message_is_deleted": bool,
+#   "timestamp": datetime
+# }
+SUMMARIES_COLLECTION = "conversation_summaries"
+
+def message_preview(message: Dict[str, Any]) -> str:
+    content = message.get("content") or {}
+    if content.get("text"):
+        return content["text"]
+    if content.get("image") or content.get("file"):
+        return "[Attachment]"
+    return ""
+
+def _identity(entity: Dict[str, Any]) -> Dict[str, Any]:
+    return {"id": entity["id"], "role": entity["role"]}
+
+def summary_updates(message: Dict[str, Any]) -> List[UpdateOne]:
+    """
+    Upserts that make `message` the latest of its conversation, for each
+    summary document it belongs to. Each one only applies if the message is
+    newer than what the summary already holds (timestamp, then _id), so
+    concurrent or replayed writes can't move a summary backwards.
+    """
+    conversation_key = message.get("conversation_key") or conversation_key_for_message(message)
+    latest = {
+        "last_message_id": message["_id"],
+        "last_message": message_preview(message),
+        "last_message_is_deleted": message.get("is_deleted", False),
+        "timestamp": message["timestamp"],
+    }
+
+    # Filters are equality on exactly the unique index's fields, so Mongo retries
+    # an upsert that loses a race to insert the same summary instead of failing it
+    if message["type"] == "group":
+        targets = [({"conversation_key": conversation_key, "owner.role": None, "owner.id": None},
+                    {"type": "group", "owner": None, "group": message["group"]})]
+    else:
+        sender, receiver = _identity(message["sender"]), _identity(message["receiver"])
+        targets = [
+            ({"conversation_key": conversation_key, "owner.role": sides[0]["role"], "owner.id": sides[0]["id"]},
+             {"type": "private", "owner": sides[0], "partner": sides[1]})
+            for sides in ((sender, receiver), (receiver, sender))
+        ]
+        if sender == receiver:
+            targets = targets[:1]
+
+    is_newer = {"$or": [
+        {"$gt": [message["timestamp"], "$timestamp"]},
+        {"$and": [
+            {"$eq": [message["timestamp"], "$timestamp"]},
+            {"$gt": [message["_id"], "$last_message_id"]},
+        ]},
+    ]}
+    operations = []
+    for summary_filter, fields in targets:
+        fields = {**fields, **latest}
+        operations.append(UpdateOne(
+            summary_filter,
+            [
+                {"$set": {"_is_newer": is_newer}},
+                # $literal so message text is never read as an expression or field path
+                {"$set": {
+                    field: {"$cond": ["$_is_newer", {"$literal": value}, f"${field}"]}
+                    for field, value in fields.items()
+                }},
+                {"$unset": "_is_newer"},
+            ],
+            upsert=True,
+        ))
+    return operations
+
+async def record_message(mongo_db: AsyncIOMotorDatabase, message: Dict[str, Any]):
+    """Folds a newly stored message into its conversation's summaries."""
+    operations = summary_updates(message)
+    try:
+        await mongo_db[SUMMARIES_COLLECTION].bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        # Servers that don't retry a racing upsert themselves report a duplicate
+        # key; by now the summary exists, so the same update applies to it
+        write_errors = e.details.get("writeErrors", [])
+        if not write_errors or any(error["code"] != 11000 for error in write_errors):
+            raise
+        await mongo_db[SUMMARIES_COLLECTION].bulk_write(
+            [operations[error["index"]] for error in write_errors], ordered=False
+        )
+
+async def record_deletion(mongo_db: AsyncIOMotorDatabase, conversation_key: str, message_id: ObjectId):
+    """Flags the summaries whose latest message was just deleted."""
+    await mongo_db[SUMMARIES_COLLECTION].update_many(
+        {"conversation_key": conversation_key, "last_message_id": message_id},
+        {"$set": {"last_message_is_deleted": True}},
+    )
+
+async def get_private_summaries(mongo_db: AsyncIOMotorDatabase, owner: Dict[str, Any]) -> List[Dict[str, Any]]:
+    cursor = mongo_db[SUMMARIES_COLLECTION].find(
+        {"owner.id": owner["id"], "owner.role": owner["role"]}
+    ).sort("timestamp", DESCENDING)
+    return await cursor.to_list(length=None)
+
+async def get_group_summaries(mongo_db: AsyncIOMotorDatabase, group_ids: List[int]) -> List[Dict[str, Any]]:
+    if not group_ids:
+        return []
+    cursor = mongo_db[SUMMARIES_COLLECTION].find({
+        "conversation_key": {"$in": [group_conversation_key(group_id) for group_id in group_ids]},
+        "owner": None,
+    })
+    return await cursor.to_list(length=None)
+
+async def get_group_summary_before(
+    mongo_db: AsyncIOMotorDatabase,
+    group_id: int,
+    before: datetime
+) -> Optional[Dict[str, Any]]:
+    """
+    What a removed member sees: the group's latest message from before they
+    were removed. Read from messages, since the shared summary has moved on.
+    """
+    message = await mongo_db["messages"].find_one(
+        {"conversation_key": group_conversation_key(group_id), "timestamp": {"$lt": before}},
+        sort=[("timestamp", DESCENDING)],
+    )
+    if not message:
+        return None
+    return {
+        "type": "group",
+        "group": message["group"],
+        "last_message_id": message["_id"],
+        "last_message": message_preview(message),
+        "last_message_is_deleted": message.get("is_deleted", False),
+        "timestamp": message["timestamp"],
+    }
@@ -0,0 +1,18 @@
+# app/db/conversations.py
+from typing import Any, Dict
+
+# Every message is stamped with a conversation_key that names its conversation
+# the same way from both sides:
+#   private: "p:admin-3|user-7"   (both connection ids, sorted)
+#   group:   "g:42"
+def private_conversation_key(role_a: str, id_a: int, role_b: str, id_b: int) -> str:
+    return "p:" + "|".join(sorted((f"{role_a}-{id_a}", f"{role_b}-{id_b}")))
+
+def group_conversation_key(group_id: int) -> str:
+    return f"g:{group_id}"
+
+def conversation_key_for_message(message: Dict[str, Any]) -> str:
+    if message["type"] == "group":
+        return group_conversation_key(message["group"]["id"])
+    sender, receiver = message["sender"], message["receiver"]
+    return private_conversation_key(sender["role"], sender["id"], receiver["role"], receiver["id"])
@@ -0,0 +1,240 @@
+# app/db/indexes.py
+from datetime import datetime
+from typing import Any, Dict, List
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from app.cache.sequences import COUNTERS_COLLECTION
+from app.db.read_cursors import READS_COLLECTION
+from app.db.conversation_summaries import SUMMARIES_COLLECTION
+from app.db.pagination import BEFORE, AFTER, keyset_filter, keyset_sort
+
+# Every Mongo index the app relies on, by collection. Reconciled at startup:
+# missing indexes are created, ones that differ from their spec are reported.
+# Add the index here together with any new query shape (and the query to
+# CANONICAL_QUERIES below), so check_query_plans.py keeps both honest.
+INDEXES: Dict[str, List[IndexModel]] = {
+    "messages": [
+        # Keyset-paged history (timestamp, _id), read receipts, what removed members can still see
+        IndexModel(
+            [("conversation_key", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)],
+            name="conversation_key_timestamp_id",
+        ),
+        # Unread recounts for partners never read from, the admin's user-to-user listing
+        IndexModel(
+            [("receiver.id", ASCENDING), ("receiver.role", ASCENDING), ("timestamp", DESCENDING)],
+            name="receiver_timestamp",
+        ),
+        # Seq seeding and "messages after seq N" range reads
+        IndexModel(
+            [("conversation_key", ASCENDING), ("seq", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"seq": {"$exists": True}},
+            name="conversation_key_seq",
+        ),
+        # Legacy messages still waiting to be marked received on connect
+        IndexModel(
+            [("receiver.id", ASCENDING), ("receiver.role", ASCENDING)],
+            partialFilterExpression={"status": "sent"},
+            name="receiver_undelivered",
+        ),
+    ],
+    COUNTERS_COLLECTION: [
+        # Fallback counters still to be pushed into Redis once it's back
+        IndexModel(
+            [("resync", ASCENDING)],
+            partialFilterExpression={"resync": True},
+            name="pending_resync",
+        ),
+    ],
+    READS_COLLECTION: [
+        # One watermark per (reader, conversation); default name, as the migration built it
+        IndexModel(
+            [("reader.id", ASCENDING), ("reader.role", ASCENDING),
+             ("conversation.type", ASCENDING), ("conversation.id", ASCENDING),
+             ("conversation.role", ASCENDING)],
+            unique=True,
+        ),
+    ],
+    SUMMARIES_COLLECTION: [
+        # One summary per (conversation, side); group summaries have no owner
+        IndexModel(
+            [("conversation_key", ASCENDING), ("owner.role", ASCENDING), ("owner.id", ASCENDING)],
+            unique=True,
+            name="conversation_key_owner",
+        ),
+        # "My private conversations, newest first"
+        IndexModel(
+            [("owner.id", ASCENDING), ("owner.role", ASCENDING), ("timestamp", DESCENDING)],
+            name="owner_timestamp",
+        ),
+    ],
+}
+
+# Options that make two indexes with the same keys behave differently
+_COMPARED_OPTIONS = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds")
+
+def _describe(index: Dict[str, Any]) -> Dict[str, Any]:
+    description = {"key": list(index["key"].items())}
+    for option in _COMPARED_OPTIONS:
+        if index.get(option):
+            description[option] = index[option]
+    return description
+
+async def ensure_indexes(mongo_db: AsyncIOMotorDatabase) -> List[str]:
+    """
+    Creates every registered index that doesn't exist yet. Indexes whose
+    definition differs from the registry are left alone (rebuilding one is
+    an operational decision) and returned as "collection.name" so the caller
+    can report them.
+    """
+    mismatched = []
+    for collection_name, specs in INDEXES.items():
+        collection = mongo_db[collection_name]
+        existing = {index["name"]: index async for index in collection.list_indexes()}
+        missing = []
+        for spec in specs:
+            wanted = spec.document
+            current = existing.get(wanted["name"])
+            if current is None:
+                missing.append(spec)
+            elif _describe(current) != _describe(wanted):
+                mismatched.append(f"{collection_name}.{wanted['name']}")
+        if missing:
+            try:
+                created = await collection.create_indexes(missing)
+                print(f"Created indexes on {collection_name}: {', '.join(created)}")
+            except OperationFailure as e:
+                # Another worker racing us, or an equivalent index under another name
+                print(f"Could not create indexes on {collection_name}: {e}")
+    for name in mismatched:
+        print(f"Warning: index {name} differs from its definition in app/db/indexes.py")
+    return mismatched
+
+# One representative of every query shape the app sends, with sample values.
+# Each must be answerable from an index (see find_collection_scans).
+_SAMPLE_TIME = datetime(2024, 1, 1)
+_SAMPLE_ID = ObjectId("65920080" + "0" * 16)
+
+CANONICAL_QUERIES: List[Dict[str, Any]] = [
+    {
+        "name": "messages.private_history",
+        "collection": "messages",
+        "filter": {"conversation_key": "p:admin-2|user-1", **keyset_filter(BEFORE, _SAMPLE_TIME, _SAMPLE_ID)},
+        "sort": keyset_sort(BEFORE),
+    },
+    {
+        "name": "messages.group_history_after",
+        "collection": "messages",
+        "filter": {"conversation_key": "g:1", "timestamp": {"$lt": _SAMPLE_TIME},
+                   "$and": [keyset_filter(AFTER, _SAMPLE_TIME, _SAMPLE_ID)]},
+        "sort": keyset_sort(AFTER),
+    },
+    {
+        "name": "messages.after_seq",
+        "collection": "messages",
+        "filter": {"conversation_key": "g:1", "seq": {"$gt": 10}},
+        "sort": [("seq", ASCENDING)],
+    },
+    {
+        "name": "messages.stored_max_seq",
+        "collection": "messages",
+        "filter": {"conversation_key": "g:1", "seq": {"$exists": True}},
+        "sort": [("seq", DESCENDING)],
+    },
+    {
+        "name": "messages.undelivered",
+        "collection": "messages",
+        "filter": {"receiver.id": 1, "receiver.role": "user", "status": "sent"},
+    },
+    {
+        "name": "messages.newly_read",
+        "collection": "messages",
+        "filter": {"conversation_key": "p:admin-2|user-1", "sender.id": 2, "sender.role": "admin",
+                   "timestamp": {"$lte": _SAMPLE_TIME, "$gt": _SAMPLE_TIME}},
+    },
+    {
+        "name": "messages.removed_member_latest",
+        "collection": "messages",
+        "filter": {"conversation_key": "g:1", "timestamp": {"$lt": _SAMPLE_TIME}},
+        "sort": [("timestamp", DESCENDING)],
+    },
+    {
+        "name": "messages.unread_recount",
+        "collection": "messages",
+        "filter": {
+            "$or": [
+                {"conversation_key": "p:admin-2|user-1", "sender.id": 2, "sender.role": "admin",
+                 "timestamp": {"$gt": _SAMPLE_TIME}},
+                {"receiver.id": 1, "receiver.role": "user",
+                 "$nor": [{"sender.id": 2, "sender.role": "admin"}]},
+                {"conversation_key": "g:1", "timestamp": {"$gt": _SAMPLE_TIME}},
+            ],
+            "$nor": [{"sender.id": 1, "sender.role": "user"}],
+        },
+        "sort": [("timestamp", DESCENDING)],
+    },
+    {
+        "name": "messages.admin_user_history",
+        "collection": "messages",
+        "filter": {"conversation_key": "p:user-1|user-3"},
+        "sort": keyset_sort(BEFORE),
+    },
+    {
+        "name": "messages.admin_user_conversations",
+        "collection": "messages",
+        "filter": {"type": "private", "sender.role": "user", "receiver.role": "user",
+                   "sender.id": {"$in": [1, 3]}, "receiver.id": {"$in": [1, 3]},
+                   "conversation_key": {"$exists": True}},
+    },
+    {
+        "name": "conversation_counters.pending_resync",
+        "collection": COUNTERS_COLLECTION,
+        "filter": {"resync": True},
+    },
+    {
+        "name": "conversation_reads.cursor",
+        "collection": READS_COLLECTION,
+        "filter": {"reader.id": 1, "reader.role": "user", "conversation.type": "private",
+                   "conversation.id": 2, "conversation.role": "admin"},
+    },
+    {
+        "name": "conversation_reads.reader",
+        "collection": READS_COLLECTION,
+        "filter": {"reader.id": 1, "reader.role": "user"},
+    },
+    {
+        "name": "conversation_summaries.private",
+        "collection": SUMMARIES_COLLECTION,
+        "filter": {"owner.id": 1, "owner.role": "user"},
+        "sort": [("timestamp", DESCENDING)],
+    },
+    {
+        "name": "conversation_summaries.groups",
+        "collection": SUMMARIES_COLLECTION,
+        "filter": {"conversation_key": {"$in": ["g:1", "g:2"]}, "owner": None},
+    },
+]
+
+def _has_collection_scan(plan: Any) -> bool:
+    if isinstance(plan, dict):
+        if plan.get("stage") == "COLLSCAN":
+            return True
+        return any(_has_collection_scan(value) for value in plan.values())
+    if isinstance(plan, list):
+        return any(_has_collection_scan(item) for item in plan)
+    return False
+
+async def find_collection_scans(mongo_db: AsyncIOMotorDatabase) -> List[str]:
+    """Explains every canonical query and returns the names of those whose winning plan scans a collection."""
+    offenders = []
+    for query in CANONICAL_QUERIES:
+        cursor = mongo_db[query["collection"]].find(query["filter"])
+        if query.get("sort"):
+            cursor = cursor.sort(query["sort"])
+        explanation = await cursor.explain()
+        if _has_collection_scan(explanation["queryPlanner"]["winningPlan"]):
+            offenders.append(query["name"])
+    return offenders
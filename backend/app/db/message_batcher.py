@@ -0,0 +1,112 @@
+# app/db/message_batcher.py
+import asyncio
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from app.core.config import settings
+from app.core.metrics import metrics
+
+class MessageBatcher:
+    """
+    Gathers message inserts from every connection and writes them with one
+    insert_many per window, instead of one insert_one round trip per message.
+
+    submit() queues a document and returns a future that resolves to its
+    ObjectId once the batch containing it is written, or fails with that
+    document's own write error. Inserts are unordered, so one bad document
+    (e.g. a duplicate seq) doesn't take the rest of its window down with it;
+    readers order messages by timestamp and seq, not by insertion.
+    """
+    def __init__(self, window_ms: int, max_batch_size: int):
+        self.window_ms = window_ms
+        self.max_batch_size = max(1, max_batch_size)
+        self._collection = None
+        self._pending: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        self._has_pending = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        self._writer_task: Optional[asyncio.Task] = None
+        self._stopping = False
+        metrics.register_collector(lambda: {"message_batcher.pending": len(self._pending)})
+
+    def submit(self, document: Dict[str, Any]) -> asyncio.Future:
+        """Queues a message for insertion. The document gets its _id set in place."""
+        if self._writer_task is None:
+            raise RuntimeError("MessageBatcher is not running")
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((document, future))
+        self._has_pending.set()
+        if len(self._pending) >= self.max_batch_size:
+            self._batch_full.set()
+        return future
+
+    async def insert(self, document: Dict[str, Any]) -> ObjectId:
+        return await self.submit(document)
+
+    async def start(self, collection):
+        self._collection = collection
+        self._writer_task = asyncio.create_task(self._write_batches())
+
+    async def stop(self):
+        """
+        Stops the writer and writes whatever is still queued. A batch already
+        being inserted is let finish rather than cancelled, so every submitted
+        message is either acked or failed.
+        """
+        if self._writer_task:
+            self._stopping = True
+            self._has_pending.set()
+            self._batch_full.set()
+            await self._writer_task
+            self._writer_task = None
+            self._stopping = False
+        await self._flush()
+
+    async def _write_batches(self):
+        while not self._stopping:
+            await self._has_pending.wait()
+            if self.window_ms > 0 and len(self._pending) < self.max_batch_size:
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), self.window_ms / 1000)
+                except asyncio.TimeoutError:
+                    pass
+            await self._flush()
+
+    async def _flush(self):
+        batch, self._pending = self._pending, []
+        self._has_pending.clear()
+        self._batch_full.clear()
+        for start in range(0, len(batch), self.max_batch_size):
+            await self._write(batch[start:start + self.max_batch_size])
+
+    async def _write(self, batch: List[Tuple[Dict[str, Any], asyncio.Future]]):
+        documents = [document for document, _ in batch]
+        # Index in the batch -> why that document wasn't inserted
+        errors: Dict[int, Exception] = {}
+        try:
+            await self._collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details.get("writeErrors", []):
+                errors[write_error["index"]] = BulkWriteError({**e.details, "writeErrors": [write_error]})
+            if not errors:
+                # e.g. a write concern error: we can't tell which documents landed
+                errors = {index: e for index in range(len(batch))}
+        except Exception as e:
+            errors = {index: e for index in range(len(batch))}
+
+        metrics.incr("message_batcher.batches")
+        metrics.incr("message_batcher.messages_written", len(batch) - len(errors))
+        if errors:
+            metrics.incr("message_batcher.messages_failed", len(errors))
+        for index, (document, future) in enumerate(batch):
+            if future.done():
+                continue
+            if index in errors:
+                future.set_exception(errors[index])
+            else:
+                future.set_result(document["_id"])
+        if errors:
+            print(f"Error inserting {len(errors)} of {len(batch)} batched messages: {next(iter(errors.values()))}")
+
+message_batcher = MessageBatcher(settings.MESSAGE_BATCH_WINDOW_MS, settings.MESSAGE_BATCH_MAX_SIZE)
@@ -0,0 +1,82 @@
+# app/db/pagination.py
+import base64
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, DESCENDING
+
+# Message history pages are keyset-paginated on (timestamp, _id), so messages
+# sharing a timestamp are neither skipped nor repeated across pages. Cursors
+# are opaque to clients: base64url("{iso timestamp}|{message id}").
+#   before=<cursor>  older messages, newest first (the default direction)
+#   after=<cursor>   newer messages, oldest first
+# Bare ISO timestamps are still accepted as `before` from older clients.
+
+BEFORE = "before"
+AFTER = "after"
+
+# Message fields a `fields` projection can ask for. _id, type, sender and
+# timestamp are always returned: paging and read status depend on them.
+ALWAYS_PROJECTED = ("_id", "type", "sender", "timestamp")
+PROJECTABLE_FIELDS = {
+    "receiver", "group", "content", "content.text", "content.image", "content.file",
+    "seq", "is_deleted",
+}
+
+def encode_cursor(message: Dict[str, Any]) -> str:
+    raw = f"{message['timestamp'].isoformat()}|{message['_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, Optional[ObjectId]]:
+    """
+    Returns the (timestamp, _id) position a cursor points at; the id is None
+    for a legacy bare-timestamp cursor. Raises ValueError if it is neither.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, message_id = raw.split("|")
+        return datetime.fromisoformat(timestamp), ObjectId(message_id)
+    except (ValueError, UnicodeDecodeError, InvalidId):
+        return datetime.fromisoformat(cursor.replace("Z", "+00:00")), None
+
+def keyset_filter(direction: str, timestamp: datetime, message_id: Optional[ObjectId]) -> Dict[str, Any]:
+    """Everything strictly past the cursor position in the given direction."""
+    op = "$lt" if direction == BEFORE else "$gt"
+    if message_id is None:
+        return {"timestamp": {op: timestamp}}
+    return {"$or": [
+        {"timestamp": {op: timestamp}},
+        {"timestamp": timestamp, "_id": {op: message_id}},
+    ]}
+
+def keyset_sort(direction: str) -> List[Tuple[str, int]]:
+    order = DESCENDING if direction == BEFORE else ASCENDING
+    return [("timestamp", order), ("_id", order)]
+
+def page_cursors(messages: List[Dict[str, Any]], direction: str, limit: int) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Returns (next_cursor, prev_cursor) for a page in the given direction:
+    next_cursor continues the same way (only when the page was full),
+    prev_cursor pages back the other way from the start of this page.
+    """
+    if not messages:
+        return None, None
+    next_cursor = encode_cursor(messages[-1]) if len(messages) == limit else None
+    return next_cursor, encode_cursor(messages[0])
+
+def parse_fields(fields: Optional[str], always: Iterable[str] = ()) -> Optional[Dict[str, int]]:
+    """
+    Turns a comma-separated `fields` parameter into a Mongo projection, or
+    None for whole documents. Raises ValueError on unknown fields.
+    """
+    if not fields:
+        return None
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - PROJECTABLE_FIELDS
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    # "content" already covers its parts, and Mongo rejects overlapping paths
+    if "content" in requested:
+        requested = {field for field in requested if not field.startswith("content.")}
+    return {field: 1 for field in (*ALWAYS_PROJECTED, *always, *requested)}
@@ -0,0 +1,71 @@
+# app/db/read_cursors.py
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+
+# One document per (reader, conversation) holding how far the reader has read:
+# {
+#   "reader": {"id": 7, "role": "user"},
+#   "conversation": {"type": "private", "id": 3, "role": "admin"}   # the partner
+#                or {"type": "group", "id": 42, "role": None},
+#   "last_read_at": datetime
+# }
+# Everything in the conversation up to last_read_at counts as read.
+READS_COLLECTION = "conversation_reads"
+
+def private_conversation(partner_id: int, partner_role: str) -> Dict[str, Any]:
+    """A private conversation as seen from the reader's side (keyed by the partner)."""
+    return {"type": "private", "id": partner_id, "role": partner_role}
+
+def group_conversation(group_id: int) -> Dict[str, Any]:
+    return {"type": "group", "id": group_id, "role": None}
+
+def cursor_filter(reader: Dict[str, Any], conversation: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "reader.id": reader["id"],
+        "reader.role": reader["role"],
+        "conversation.type": conversation["type"],
+        "conversation.id": conversation["id"],
+        "conversation.role": conversation.get("role"),
+    }
+
+async def mark_read(
+    mongo_db: AsyncIOMotorDatabase,
+    reader: Dict[str, Any],
+    conversation: Dict[str, Any],
+    read_at: datetime
+) -> Optional[datetime]:
+    """
+    Moves the reader's watermark forward to read_at (never backwards) with a
+    single upsert. Returns the previous watermark, or None if there wasn't one.
+    """
+    previous = await mongo_db[READS_COLLECTION].find_one_and_update(
+        cursor_filter(reader, conversation),
+        {"$max": {"last_read_at": read_at}},
+        upsert=True,
+        projection={"last_read_at": 1},
+        return_document=ReturnDocument.BEFORE,
+    )
+    return previous["last_read_at"] if previous else None
+
+async def get_last_read(
+    mongo_db: AsyncIOMotorDatabase,
+    reader: Dict[str, Any],
+    conversation: Dict[str, Any]
+) -> Optional[datetime]:
+    doc = await mongo_db[READS_COLLECTION].find_one(
+        cursor_filter(reader, conversation), projection={"last_read_at": 1}
+    )
+    return doc["last_read_at"] if doc else None
+
+async def get_reader_cursors(mongo_db: AsyncIOMotorDatabase, reader: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """All of a reader's watermarks, across every conversation."""
+    cursor = mongo_db[READS_COLLECTION].find(
+        {"reader.id": reader["id"], "reader.role": reader["role"]},
+        projection={"_id": 0, "conversation": 1, "last_read_at": 1},
+    )
+    return await cursor.to_list(length=None)
+
+def is_read(timestamp: datetime, last_read_at: Optional[datetime]) -> bool:
+    return last_read_at is not None and timestamp <= last_read_at
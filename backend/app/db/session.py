@@ -1,5 +1,7 @@
 # app/db/session.py
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from motor.motor_asyncio import AsyncIOMotorClient
 from app.core.config import settings
@@ -25,6 +27,50 @@ def get_db():
     finally:
         db.close()
 
+# --- PostgreSQL (SQLAlchemy, async) Setup ---
+# Async handlers (WebSocket, history, conversations, notifications, ...) must
+# not block the event loop on sync queries, so they use this engine instead.
+_ASYNC_DRIVERS = {
+    "postgres": "postgresql+asyncpg",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+}
+
+def get_async_database_url(database_url: str) -> str:
+    """
+    Converts the sync DATABASE_URL into its async-driver equivalent
+    (asyncpg for Postgres, aiosqlite for SQLite).
+    """
+    url = make_url(database_url)
+    url = url.set(drivername=_ASYNC_DRIVERS.get(url.drivername, url.drivername))
+    if url.drivername == "postgresql+asyncpg":
+        # asyncpg doesn't understand libpq-only params like sslmode/channel_binding
+        query = dict(url.query)
+        sslmode = query.pop("sslmode", None)
+        query.pop("channel_binding", None)
+        if sslmode and "ssl" not in query:
+            query["ssl"] = sslmode
+        url = url.set(query=query)
+    return url.render_as_string(hide_password=False)
+
+async_engine = create_async_engine(
+    get_async_database_url(settings.DATABASE_URL),
+    pool_pre_ping=True,
+)
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+
+async def get_async_db():
+    """
+    Async dependency to get a DB session.
+    Ensures the session is always closed after the request.
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
 # --- MongoDB (Motor) Setup ---
 class DataBase:
     client: AsyncIOMotorClient = None
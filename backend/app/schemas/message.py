@@ -129,8 +129,10 @@ class MessageOut(BaseModel):
     sender: MessageParticipant
     receiver: Optional[MessageParticipant] = None
     group: Optional[MessageGroup] = None
-    content: MessageContent
+    # Empty when a `fields` projection leaves the content out
+    content: MessageContent = MessageContent()
     timestamp: datetime.datetime
+    seq: Optional[int] = None
     is_deleted: bool = False
     read_by: Optional[List[ReadReceipt]] = []
     status: str 
@@ -145,4 +147,35 @@ class MessageOut(BaseModel):
 # Model for the paginated response
 class PaginatedMessageResponse(BaseModel):
     messages: List[MessageOut]
-    next_cursor: Optional[str] = None
\ No newline at end of file
+    # Opaque (timestamp, _id) cursors: next_cursor continues in the direction
+    # requested (pass it back as before/after), prev_cursor goes the other way
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+    # Set when paging forward with after_seq: pass it back as after_seq for more
+    next_after_seq: Optional[int] = None
+
+
+# --- Pre-shaped output for the fast response path ---
+# These must produce exactly what PaginatedMessageResponse would serialize;
+# keep them in step with the models above.
+def _participant_out(participant):
+    return {"id": participant["id"], "username": participant["username"], "role": participant["role"]}
+
+def message_out(message, status):
+    """A stored message in MessageOut's output shape (ObjectIds and datetimes left for the encoder)."""
+    receiver = message.get("receiver")
+    group = message.get("group")
+    content = message.get("content") or {}
+    return {
+        "_id": message["_id"],
+        "type": message["type"],
+        "sender": _participant_out(message["sender"]),
+        "receiver": _participant_out(receiver) if receiver else None,
+        "group": {"id": group["id"], "name": group["name"]} if group else None,
+        "content": {"text": content.get("text"), "image": content.get("image"), "file": content.get("file")},
+        "timestamp": message["timestamp"],
+        "seq": message.get("seq"),
+        "is_deleted": message.get("is_deleted", False),
+        "read_by": [{"id": r["id"], "role": r["role"]} for r in message.get("read_by") or [] if isinstance(r, dict)],
+        "status": status,
+    }
@@ -9,6 +9,8 @@ class TokenData(BaseModel):
     username: Optional[str] = None
     role: Optional[str] = None
     tenant_id: Optional[int] = None
+    jti: Optional[str] = None
+    exp: Optional[int] = None
 
 class TokenRequest(BaseModel):
     username: str
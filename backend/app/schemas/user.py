@@ -66,6 +66,27 @@ class ConversationPartner(BaseModel):
 class ConversationList(BaseModel):
     conversations: List[ConversationPartner]
 
+def conversation_partner_out(
+    id, name, type, last_message, timestamp, full_name=None, last_message_id=None,
+    last_message_is_deleted=False, is_member_active=True, is_pinned=False
+):
+    """
+    A ConversationPartner in its output shape, as a plain dict, so the fast
+    response path can encode it without validation. Keep in step with the model.
+    """
+    return {
+        "id": id,
+        "name": name,
+        "full_name": full_name,
+        "type": type,
+        "last_message_id": last_message_id,
+        "last_message": last_message,
+        "last_message_is_deleted": last_message_is_deleted,
+        "timestamp": timestamp,
+        "is_member_active": is_member_active,
+        "is_pinned": is_pinned,
+    }
+
 class UserLoginSchema(BaseModel):
     username: str
     password: str
@@ -1,14 +1,18 @@
+import secrets
 from fastapi import Depends, HTTPException, status, Request
-from sqlalchemy.orm import Session
-from typing import Union
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from typing import Optional, Union
 
-from app.db.session import get_db
+from app.core.config import settings
 from app.security.jwt import verify_token
+from app.cache.principals import get_principal
 from app.models import User, Admin, SuperAdmin
 
-def get_current_user_from_cookie(request: Request, db: Session = Depends(get_db)) -> Union[User, Admin, SuperAdmin]:
+async def get_current_user_from_cookie(request: Request) -> Union[User, Admin, SuperAdmin]:
     """
     New primary dependency to get the current user from the access_token cookie.
+    The entity comes from the identity cache and is detached: relationships
+    aren't loaded, and changes must be written with explicit UPDATEs.
     """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -20,19 +24,10 @@ def get_current_user_from_cookie(request: Request, db: Session = Depends(get_db)
     if token is None:
         raise credentials_exception
         
-    token_data = verify_token(token, credentials_exception)
+    token_data = await verify_token(token, credentials_exception)
     
     # Based on the role in the token, fetch from the correct table
-    role = token_data.role
-    username = token_data.username
-    
-    user = None
-    if role == "user":
-        user = db.query(User).filter(User.username == username).first()
-    elif role == "admin":
-        user = db.query(Admin).filter(Admin.username == username).first()
-    elif role == "super_admin":
-        user = db.query(SuperAdmin).filter(SuperAdmin.username == username).first()
+    user = await get_principal(token_data.role, token_data.username)
 
     if user is None:
         raise credentials_exception
@@ -48,4 +43,21 @@ def get_current_super_admin(current_user: SuperAdmin = Depends(get_current_user_
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Operation not permitted. Requires super admin privileges."
         )
-    return current_user
\ No newline at end of file
+    return current_user
+
+def require_metrics_token(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(HTTPBearer(auto_error=False))
+):
+    """
+    Dependency for internal endpoints: the caller must send
+    "Authorization: Bearer <METRICS_TOKEN>". Without a configured token the
+    endpoint is disabled.
+    """
+    if not settings.METRICS_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if credentials is None or not secrets.compare_digest(credentials.credentials, settings.METRICS_TOKEN):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid metrics token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
@@ -1,8 +1,55 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 from passlib.context import CryptContext
 
+from app.core.config import settings
+from app.core.metrics import metrics
+
 # Use bcrypt for password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+class HashingPoolFull(Exception):
+    """Raised when too many hashes are already queued."""
+
+class HashingPool:
+    """
+    A dedicated, size-limited pool for bcrypt, so a login storm queues here
+    instead of occupying the threadpool every sync endpoint shares. bcrypt
+    releases the GIL, so threads hash in parallel. At most max_queue jobs wait
+    beyond the running ones; more than that are rejected rather than piled up.
+    """
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._pending = 0
+        metrics.register_collector(lambda: {
+            "hashing.in_flight": min(self._pending, self.workers),
+            "hashing.queued": max(0, self._pending - self.workers),
+        })
+
+    async def run(self, fn, *args):
+        if self._pending >= self.workers + self.max_queue:
+            metrics.incr("hashing.rejected")
+            raise HashingPoolFull()
+        self._pending += 1
+        submitted_at = time.perf_counter()
+
+        def timed():
+            started_at = time.perf_counter()
+            return started_at - submitted_at, fn(*args)
+
+        try:
+            queue_wait, result = await asyncio.get_running_loop().run_in_executor(self._executor, timed)
+        finally:
+            self._pending -= 1
+        metrics.incr("hashing.jobs")
+        metrics.incr("hashing.queue_wait_ms_total", int(queue_wait * 1000))
+        return result
+
+hashing_pool = HashingPool(settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_MAX_QUEUE)
+
 class Hasher:
     @staticmethod
     def verify_password(plain_password, hashed_password):
@@ -12,4 +59,14 @@ class Hasher:
     @staticmethod
     def get_password_hash(password):
         """Hashes a plain password."""
-        return pwd_context.hash(password)
\ No newline at end of file
+        return pwd_context.hash(password)
+
+    @staticmethod
+    async def verify_password_async(plain_password, hashed_password):
+        """verify_password on the dedicated hashing pool."""
+        return await hashing_pool.run(pwd_context.verify, plain_password, hashed_password)
+
+    @staticmethod
+    async def get_password_hash_async(password):
+        """get_password_hash on the dedicated hashing pool."""
+        return await hashing_pool.run(pwd_context.hash, password)
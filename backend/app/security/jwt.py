@@ -1,8 +1,10 @@
+import uuid
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
 from jose import JWTError, jwt
 from app.core.config import settings
 from app.schemas.token import TokenData
+from app.security.revocation import revocation_list
 
 ACCESS_TOKEN_EXPIRE_MINUTES = 15  # 15 minutes
 REFRESH_TOKEN_EXPIRE_DAYS = 7     # 7 days
@@ -11,7 +13,7 @@ def create_access_token(data: dict):
     """Creates a short-lived access token."""
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
@@ -19,22 +21,35 @@ def create_refresh_token(data: dict):
     """Creates a long-lived refresh token."""
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
-def verify_token(token: str, credentials_exception) -> TokenData:
-    """Verifies any JWT token and returns its payload."""
+def get_token_id(token: str) -> Tuple[Optional[str], Optional[int]]:
+    """Returns (jti, exp) of a token we issued, without verifying it."""
+    claims = jwt.get_unverified_claims(token)
+    return claims.get("jti"), claims.get("exp")
+
+async def verify_token(token: str, credentials_exception) -> TokenData:
+    """
+    Verifies any JWT token and returns its payload. Revoked tokens are rejected;
+    the revocation check may go to Redis, so this is awaited.
+    """
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         username: str = payload.get("sub")
         role: str = payload.get("role")
         tenant_id: int = payload.get("tenant_id")
+        jti: Optional[str] = payload.get("jti")
 
         if username is None or role is None:
             raise credentials_exception
+
+        # Tokens issued before jti claims existed can't be revoked individually
+        if jti and await revocation_list.is_revoked(jti):
+            raise credentials_exception
         
-        token_data = TokenData(username=username, role=role, tenant_id=tenant_id)
+        token_data = TokenData(username=username, role=role, tenant_id=tenant_id, jti=jti, exp=payload.get("exp"))
         return token_data
     except JWTError:
         raise credentials_exception
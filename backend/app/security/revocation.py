@@ -0,0 +1,183 @@
+# app/security/revocation.py
+import asyncio
+import hashlib
+import math
+import time
+from typing import Iterable, Optional
+import redis.asyncio as aioredis
+
+from app.core.config import settings
+from app.core.metrics import metrics
+
+# Revoked token ids live in Redis until the token would have expired anyway:
+#   auth:revoked:{jti}            "1", expiring with the token
+#   auth:tokens:{role}:{username} zset of the subject's live jtis scored by exp,
+#                                 so "log this person out everywhere" can find them
+# Revocations are also published so every worker adds them to its Bloom filter.
+# The filter is rebuilt from the live revoked keys periodically, so jtis whose
+# tokens have expired drop out and its false positive rate doesn't creep up.
+REVOKED_KEY_PREFIX = "auth:revoked:"
+SUBJECT_TOKENS_PREFIX = "auth:tokens:"
+REVOCATION_CHANNEL = "auth:revocations"
+
+def _revoked_key(jti: str) -> str:
+    return f"{REVOKED_KEY_PREFIX}{jti}"
+
+def _subject_key(role: str, username: str) -> str:
+    return f"{SUBJECT_TOKENS_PREFIX}{role}:{username}"
+
+# Adds a jti to its subject's zset, drops expired ones, and keeps the key
+# alive until the last live token expires: tracking a short-lived token
+# must not cut short the expiry set for a longer-lived one.
+_TRACK_SCRIPT = """
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[3])
+local latest = redis.call('ZRANGE', KEYS[1], -1, -1, 'WITHSCORES')
+if latest[2] then
+    redis.call('EXPIREAT', KEYS[1], string.format('%d', math.ceil(tonumber(latest[2]))))
+end
+return 1
+"""
+
+class BloomFilter:
+    """A fixed-size Bloom filter: no false negatives, about error_rate false positives at capacity."""
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+class RevocationList:
+    """
+    Revoked JWT ids, checked on every token verification.
+    Almost every token is not revoked, and the local Bloom filter answers that
+    in microseconds; only a "maybe" goes to Redis to confirm.
+    """
+    def __init__(self, capacity: int, error_rate: float, rebuild_interval_seconds: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.rebuild_interval_seconds = rebuild_interval_seconds
+        self._filter = BloomFilter(capacity, error_rate)
+        # The filter being rebuilt, if any; new revocations go into both
+        self._next_filter: Optional[BloomFilter] = None
+        self.redis_client: Optional[aioredis.Redis] = None
+        self._pubsub = None
+        self._listener_task: Optional[asyncio.Task] = None
+        self._rebuild_task: Optional[asyncio.Task] = None
+
+    async def start(self, redis_client: aioredis.Redis):
+        """Loads every still-revoked jti into the filter and follows new revocations."""
+        self.redis_client = redis_client
+        self._pubsub = redis_client.pubsub()
+        await self._pubsub.subscribe(REVOCATION_CHANNEL)
+        self._listener_task = asyncio.create_task(self._listen())
+        await self.rebuild()
+        if self.rebuild_interval_seconds > 0:
+            self._rebuild_task = asyncio.create_task(self._rebuild_periodically())
+
+    async def stop(self):
+        for task in (self._listener_task, self._rebuild_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._listener_task = self._rebuild_task = None
+        if self._pubsub:
+            await self._pubsub.unsubscribe(REVOCATION_CHANNEL)
+            await self._pubsub.close()
+            self._pubsub = None
+
+    async def rebuild(self):
+        """
+        Replaces the filter with one holding only the jtis still revoked in
+        Redis (their keys expire with the tokens). Revocations published
+        while the scan runs are added to both filters.
+        """
+        fresh = BloomFilter(self.capacity, self.error_rate)
+        self._next_filter = fresh
+        try:
+            count = 0
+            async for key in self.redis_client.scan_iter(match=f"{REVOKED_KEY_PREFIX}*", count=1000):
+                fresh.add(key[len(REVOKED_KEY_PREFIX):])
+                count += 1
+            self._filter = fresh
+        finally:
+            self._next_filter = None
+        metrics.set_gauge("auth.revocation_filter_entries", count)
+        metrics.incr("auth.revocation_filter_rebuilds")
+
+    async def _rebuild_periodically(self):
+        while True:
+            await asyncio.sleep(self.rebuild_interval_seconds)
+            try:
+                await self.rebuild()
+            except Exception as e:
+                print(f"Error rebuilding the token revocation filter: {e}")
+
+    async def track(self, role: str, username: str, jti: str, expires_at: float, redis_client: aioredis.Redis):
+        """Remembers an issued token so revoke_subject can find it."""
+        await redis_client.eval(_TRACK_SCRIPT, 1, _subject_key(role, username), jti, expires_at, time.time())
+
+    async def revoke(self, jti: str, expires_at: float, redis_client: aioredis.Redis):
+        await self._revoke({jti: expires_at}, redis_client)
+
+    async def revoke_subject(self, role: str, username: str, redis_client: aioredis.Redis):
+        """Revokes every live token issued to one identity."""
+        key = _subject_key(role, username)
+        live = await redis_client.zrangebyscore(key, time.time(), "+inf", withscores=True)
+        await self._revoke(dict(live), redis_client)
+        await redis_client.delete(key)
+
+    async def _revoke(self, expiries: dict, redis_client: aioredis.Redis):
+        now = time.time()
+        expiries = {jti: exp for jti, exp in expiries.items() if exp > now}
+        if not expiries:
+            return
+        pipeline = redis_client.pipeline()
+        for jti, exp in expiries.items():
+            pipeline.set(_revoked_key(jti), "1", ex=max(1, math.ceil(exp - now)))
+        pipeline.publish(REVOCATION_CHANNEL, "\n".join(expiries))
+        await pipeline.execute()
+        self._add_local(expiries)
+        metrics.incr("auth.tokens_revoked", len(expiries))
+
+    async def is_revoked(self, jti: str) -> bool:
+        if jti not in self._filter:
+            return False
+        metrics.incr("auth.revocation_filter_hits")
+        if self.redis_client is None:
+            # Not started (e.g. scripts): trust the filter
+            return True
+        return bool(await self.redis_client.exists(_revoked_key(jti)))
+
+    def _add_local(self, jtis: Iterable[str]):
+        for jti in jtis:
+            self._filter.add(jti)
+            if self._next_filter is not None:
+                self._next_filter.add(jti)
+
+    async def _listen(self):
+        async for raw in self._pubsub.listen():
+            if raw.get("type") != "message":
+                continue
+            self._add_local(raw["data"].split("\n"))
+
+revocation_list = RevocationList(
+    settings.TOKEN_REVOCATION_FILTER_CAPACITY,
+    settings.TOKEN_REVOCATION_FILTER_ERROR_RATE,
+    settings.TOKEN_REVOCATION_FILTER_REBUILD_SECONDS,
+)
@@ -0,0 +1,51 @@
+# app/security/throttle.py
+import redis.asyncio as redis
+from fastapi import HTTPException, status
+
+from app.core.config import settings
+from app.core.metrics import metrics
+
+# Fixed-window login throttling, checked before any password is hashed:
+#   auth:throttle:ip:{ip}           every attempt from an address
+#   auth:throttle:user:{username}   failed attempts against an account
+def _ip_key(client_ip: str) -> str:
+    return f"auth:throttle:ip:{client_ip}"
+
+def _username_key(username: str) -> str:
+    return f"auth:throttle:user:{username}"
+
+def _too_many_attempts(retry_after: int) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many login attempts. Please try again later.",
+        headers={"Retry-After": str(max(1, retry_after))},
+    )
+
+async def check_login_throttle(username: str, client_ip: str, redis_client: redis.Redis):
+    """Counts this attempt and raises 429 if the address or the account is over its limit."""
+    ip_key = _ip_key(client_ip)
+    username_key = _username_key(username)
+    pipeline = redis_client.pipeline()
+    pipeline.set(ip_key, 0, ex=settings.LOGIN_IP_WINDOW_SECONDS, nx=True)
+    pipeline.incr(ip_key)
+    pipeline.ttl(ip_key)
+    pipeline.get(username_key)
+    pipeline.ttl(username_key)
+    _, ip_attempts, ip_ttl, username_failures, username_ttl = await pipeline.execute()
+
+    if ip_attempts > settings.LOGIN_IP_MAX_ATTEMPTS:
+        metrics.incr("auth.login_throttled")
+        raise _too_many_attempts(ip_ttl)
+    if username_failures and int(username_failures) >= settings.LOGIN_USERNAME_MAX_FAILURES:
+        metrics.incr("auth.login_throttled")
+        raise _too_many_attempts(username_ttl)
+
+async def record_failed_login(username: str, redis_client: redis.Redis):
+    username_key = _username_key(username)
+    pipeline = redis_client.pipeline()
+    pipeline.set(username_key, 0, ex=settings.LOGIN_USERNAME_WINDOW_SECONDS, nx=True)
+    pipeline.incr(username_key)
+    await pipeline.execute()
+
+async def clear_failed_logins(username: str, redis_client: redis.Redis):
+    await redis_client.delete(_username_key(username))
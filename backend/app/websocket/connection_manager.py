@@ -1,36 +1,489 @@
 # app/websocket/connection_manager.py
+import asyncio
+import json
+import uuid
+from collections import defaultdict
 from fastapi import WebSocket
-from typing import Dict, List, Set
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple, Union
+import redis.asyncio as redis
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.websocket.protocol import Frame, JSON_PROTOCOL, MSGPACK_SUBPROTOCOL, as_frame, negotiate_protocol
+from app.websocket.replay import replay_buffer
+
+# Anything the send methods accept: an event dict, a pre-encoded JSON string or a Frame
+Message = Union[Frame, Dict[str, Any], str]
+
+# Hash per identity ("role-id") of session_id -> node_id, shared by every worker/host.
+SESSIONS_KEY_PREFIX = "ws:sessions:"
+# Set of identities with at least one live session anywhere.
+ONLINE_KEY = "ws:online"
+# Each node listens on its own channel for events addressed to its sockets.
+NODE_CHANNEL_PREFIX = "ws:node:"
+# Set of node ids that have registered sessions. Each node also keeps
+#   ws:node:{node_id}:alive     heartbeat key, expires if the node dies
+#   ws:node:{node_id}:sessions  hash "identity|session_id" -> tenant id
+# so the sessions of a node that crashed can be found and swept.
+NODES_KEY = "ws:nodes"
+# Events for every online member of a tenant go to all nodes on one channel.
+TENANT_CHANNEL = "ws:tenants"
+
+# Register a session; returns 1 if it is the identity's first one.
+_REGISTER_SCRIPT = """
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+redis.call('HSET', KEYS[3], ARGV[3] .. '|' .. ARGV[1], ARGV[4])
+if redis.call('HLEN', KEYS[1]) == 1 then
+    redis.call('SADD', KEYS[2], ARGV[3])
+    return 1
+end
+return 0
+"""
+
+# Unregister a session; returns 1 if it was the identity's last one.
+# Only removes the entry if it still points at this node.
+_UNREGISTER_SCRIPT = """
+redis.call('HDEL', KEYS[3], ARGV[3] .. '|' .. ARGV[1])
+if redis.call('HGET', KEYS[1], ARGV[1]) ~= ARGV[2] then
+    return 0
+end
+redis.call('HDEL', KEYS[1], ARGV[1])
+if redis.call('HLEN', KEYS[1]) == 0 then
+    redis.call('SREM', KEYS[2], ARGV[3])
+    return 1
+end
+return 0
+"""
+
+def _sessions_key(connection_id: str) -> str:
+    return f"{SESSIONS_KEY_PREFIX}{connection_id}"
+
+def _alive_key(node_id: str) -> str:
+    return f"{NODE_CHANNEL_PREFIX}{node_id}:alive"
+
+def _node_sessions_key(node_id: str) -> str:
+    return f"{NODE_CHANNEL_PREFIX}{node_id}:sessions"
+
+# Called with (tenant_id, connection_id) when an identity's last session is swept
+OfflineHandler = Callable[[int, str], Awaitable[None]]
+
+SLOW_CONSUMER_POLICIES = ("drop_oldest", "drop_newest", "disconnect")
+
+class _CloseFrame:
+    """Queued after pending frames so a close never overtakes them."""
+    def __init__(self, code: int):
+        self.code = code
+
+class Connection:
+    """
+    A single WebSocket with its own bounded outbound queue.
+    Producers only ever enqueue; a dedicated writer task drains the queue,
+    so one slow client can't stall delivery to anyone else.
+    """
+    def __init__(self, connection_id: str, websocket: WebSocket, max_queue_size: int, policy: str,
+                 protocol: str = JSON_PROTOCOL, tenant_id: Optional[int] = None):
+        self.connection_id = connection_id
+        self.websocket = websocket
+        self.tenant_id = tenant_id
+        self.protocol = protocol
+        self.policy = policy
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self.closed = False
+        self._writer_task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._writer_task = asyncio.create_task(self._writer())
+
+    def enqueue(self, message: Frame) -> bool:
+        """Queues a frame without blocking. Returns False if it was dropped."""
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        metrics.incr("ws.queue_full")
+        if self.policy == "drop_newest":
+            metrics.incr("ws.dropped_frames")
+            return False
+        if self.policy == "disconnect":
+            metrics.incr("ws.slow_consumer_disconnects")
+            self._abort(code=1013)  # "Try again later"
+            return False
+
+        # drop_oldest: keep the connection, lose the stalest frame
+        self.queue.get_nowait()
+        self.queue.put_nowait(message)
+        metrics.incr("ws.dropped_frames")
+        return True
+
+    def close(self, code: int = 1000):
+        """Closes the socket once everything queued before it has been sent."""
+        if self.closed:
+            return
+        self.closed = True
+        frame = _CloseFrame(code)
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            self.queue.get_nowait()
+            self.queue.put_nowait(frame)
+
+    async def stop(self):
+        """Stops the writer without touching the socket (it is already gone)."""
+        self.closed = True
+        if self._writer_task and self._writer_task is not asyncio.current_task():
+            self._writer_task.cancel()
+            try:
+                await self._writer_task
+            except asyncio.CancelledError:
+                pass
+
+    def _abort(self, code: int):
+        # Discard the backlog and close as soon as the writer gets to it
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.closed = True
+        self.queue.put_nowait(_CloseFrame(code))
+
+    async def _writer(self):
+        while True:
+            item = await self.queue.get()
+            if isinstance(item, _CloseFrame):
+                try:
+                    await self.websocket.close(code=item.code)
+                except RuntimeError:
+                    # Socket already closed by the client
+                    pass
+                return
+            try:
+                payload = item.encode(self.protocol)
+                if isinstance(payload, bytes):
+                    await self.websocket.send_bytes(payload)
+                else:
+                    await self.websocket.send_text(payload)
+                metrics.incr("ws.frames_sent")
+            except Exception as e:
+                print(f"Error writing to {self.connection_id}: {e}")
+                self.closed = True
+                return
 
 class ConnectionManager:
-    def __init__(self):
-        # Maps user_id to their active WebSocket connection
-        self.active_connections: Dict[int, WebSocket] = {}
+    def __init__(self, node_id: Optional[str] = None):
+        # Maps connection_id ("role-id") to the sessions (tabs/devices) held
+        # by THIS process, keyed by session_id.
+        self.active_connections: Dict[str, Dict[str, Connection]] = {}
+        # tenant_id -> connection ids with a session on THIS process
+        self.tenant_connections: Dict[int, Set[str]] = {}
+        self.node_id = node_id or uuid.uuid4().hex
+        self.redis_client: Optional[redis.Redis] = None
+        self.max_queue_size = settings.WS_SEND_QUEUE_SIZE
+        self.slow_consumer_policy = settings.WS_SLOW_CONSUMER_POLICY
+        if self.slow_consumer_policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown WS_SLOW_CONSUMER_POLICY: {self.slow_consumer_policy}")
+        self._pubsub = None
+        self._listener_task: Optional[asyncio.Task] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self.on_offline: Optional[OfflineHandler] = None
+        metrics.register_collector(self.queue_metrics)
 
-    async def connect(self, user_id: int, websocket: WebSocket):
-        """Accept a new WebSocket connection."""
-        await websocket.accept()
-        self.active_connections[user_id] = websocket
+    @property
+    def channel(self) -> str:
+        return f"{NODE_CHANNEL_PREFIX}{self.node_id}"
 
-    def disconnect(self, user_id: int):
-        """Disconnect a WebSocket."""
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
+    async def start(self, redis_client: redis.Redis, on_offline: Optional[OfflineHandler] = None):
+        """
+        Attach to Redis and start routing events published to this node.
+        on_offline is called for identities whose last session was held by a
+        node that died, so they can be marked offline.
+        """
+        self.redis_client = redis_client
+        self.on_offline = on_offline
+        replay_buffer.start(redis_client)
+        await redis_client.set(_alive_key(self.node_id), 1, ex=settings.WS_NODE_TTL_SECONDS)
+        await redis_client.sadd(NODES_KEY, self.node_id)
+        self._pubsub = redis_client.pubsub()
+        await self._pubsub.subscribe(self.channel, TENANT_CHANNEL)
+        self._listener_task = asyncio.create_task(self._listen())
+        self._heartbeat_task = asyncio.create_task(self._heartbeat())
+        print(f"ConnectionManager node {self.node_id} listening on {self.channel}")
 
-    async def send_personal_message(self, message: str, user_id: int):
-        """Send a message to a specific user."""
-        if user_id in self.active_connections:
-            websocket = self.active_connections[user_id]
-            await websocket.send_text(message)
+    async def stop(self):
+        """Stop the listener and drop this node's sessions from the registry."""
+        for task in (self._listener_task, self._heartbeat_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._listener_task = self._heartbeat_task = None
+        if self._pubsub:
+            await self._pubsub.unsubscribe(self.channel, TENANT_CHANNEL)
+            await self._pubsub.close()
+            self._pubsub = None
+        if self.redis_client:
+            # The endpoints' own disconnects will find nothing left to
+            # unregister, so identities going offline are reported here
+            went_offline = await self._sweep_node(self.node_id)
+            await self.redis_client.delete(_alive_key(self.node_id))
+            await self.redis_client.srem(NODES_KEY, self.node_id)
+            await self._report_offline(went_offline)
+
+    async def connect(self, connection_id: str, websocket: WebSocket,
+                      tenant_id: Optional[int] = None) -> Tuple[str, bool]:
+        """
+        Accept a new WebSocket connection and register it cluster-wide.
+        tenant_id is kept with the registration so the session can be marked
+        offline in its tenant if this node dies.
+        The wire protocol (JSON or msgpack) is negotiated from the subprotocols
+        the client offered. Returns the new session_id and whether this is the
+        identity's first live session (i.e. it just came online).
+        """
+        protocol = negotiate_protocol(websocket)
+        await websocket.accept(subprotocol=MSGPACK_SUBPROTOCOL if protocol == MSGPACK_SUBPROTOCOL else None)
+        session_id = uuid.uuid4().hex
+        connection = Connection(connection_id, websocket, self.max_queue_size, self.slow_consumer_policy,
+                                protocol, tenant_id)
+        connection.start()
+        local_sessions = self.active_connections.setdefault(connection_id, {})
+        local_sessions[session_id] = connection
+        if tenant_id is not None:
+            self.tenant_connections.setdefault(tenant_id, set()).add(connection_id)
+
+        if self.redis_client:
+            is_first = await self.redis_client.eval(
+                _REGISTER_SCRIPT, 3, _sessions_key(connection_id), ONLINE_KEY, _node_sessions_key(self.node_id),
+                session_id, self.node_id, connection_id, "" if tenant_id is None else tenant_id
+            )
+            return session_id, bool(is_first)
+        return session_id, len(local_sessions) == 1
 
-    async def broadcast_to_users(self, message: str, user_ids: List[int]):
-        """Send a message to a list of specific users."""
+    async def disconnect(self, connection_id: str, session_id: str) -> bool:
+        """
+        Disconnect one session held by this node.
+        Returns True if it was the identity's last live session (i.e. it just went offline).
+        """
+        local_sessions = self.active_connections.get(connection_id, {})
+        connection = local_sessions.pop(session_id, None)
+        if not local_sessions:
+            self.active_connections.pop(connection_id, None)
+        if connection:
+            await connection.stop()
+            if not local_sessions and connection.tenant_id is not None:
+                tenant_members = self.tenant_connections.get(connection.tenant_id, set())
+                tenant_members.discard(connection_id)
+                if not tenant_members:
+                    self.tenant_connections.pop(connection.tenant_id, None)
+
+        if self.redis_client:
+            return await self._unregister(connection_id, session_id)
+        return connection is not None and not local_sessions
+
+    async def _unregister(self, connection_id: str, session_id: str, node_id: Optional[str] = None) -> bool:
+        node_id = node_id or self.node_id
+        was_last = await self.redis_client.eval(
+            _UNREGISTER_SCRIPT, 3, _sessions_key(connection_id), ONLINE_KEY, _node_sessions_key(node_id),
+            session_id, node_id, connection_id
+        )
+        return bool(was_last)
+
+    # --- Node liveness ---
+
+    async def _heartbeat(self):
+        """Keeps this node's alive key fresh and sweeps nodes whose key has expired."""
+        while True:
+            try:
+                await self.redis_client.set(_alive_key(self.node_id), 1, ex=settings.WS_NODE_TTL_SECONDS)
+                await self._report_offline(await self.reap_dead_nodes())
+            except Exception as e:
+                print(f"Error in heartbeat of node {self.node_id}: {e}")
+            await asyncio.sleep(settings.WS_NODE_HEARTBEAT_SECONDS)
+
+    async def reap_dead_nodes(self) -> List[Tuple[int, str]]:
+        """
+        Unregisters every session held by nodes that stopped heartbeating.
+        Returns (tenant_id, connection_id) for each identity that went offline
+        as a result. Safe to run on every node at once: each session is
+        unregistered atomically, so exactly one sweeper sees it go last.
+        """
+        went_offline = []
+        for node_id in await self.redis_client.smembers(NODES_KEY):
+            if node_id == self.node_id or await self.redis_client.exists(_alive_key(node_id)):
+                continue
+            went_offline.extend(await self._sweep_node(node_id))
+            await self.redis_client.srem(NODES_KEY, node_id)
+            print(f"Swept sessions of dead node {node_id}")
+        return went_offline
+
+    async def _sweep_node(self, node_id: str) -> List[Tuple[int, str]]:
+        went_offline = []
+        for member, tenant_id in (await self.redis_client.hgetall(_node_sessions_key(node_id))).items():
+            connection_id, session_id = member.split("|", 1)
+            if await self._unregister(connection_id, session_id, node_id) and tenant_id:
+                went_offline.append((int(tenant_id), connection_id))
+        return went_offline
+
+    async def _report_offline(self, went_offline: List[Tuple[int, str]]):
+        if not self.on_offline:
+            return
+        for tenant_id, connection_id in went_offline:
+            try:
+                await self.on_offline(tenant_id, connection_id)
+            except Exception as e:
+                print(f"Error marking {connection_id} offline: {e}")
+
+    async def send_personal_message(self, message: Message, user_id: str, exclude_session: Optional[str] = None,
+                                    replay: bool = True):
+        """Send a message to every session of a specific user, wherever they are connected."""
+        await self.broadcast_to_users(message, [user_id], exclude_session=exclude_session, replay=replay)
+
+    async def send_to_session(self, message: Message, user_id: str, session_id: str, replay: bool = False):
+        """
+        Send a message to one specific session (e.g. an ack for the tab that sent it).
+        With replay, the frame is also buffered so the session gets it if it resumes.
+        """
+        frame = as_frame(message)
+        if replay:
+            frame = await replay_buffer.record(frame, [user_id], only_session=session_id)
+        connection = self.active_connections.get(user_id, {}).get(session_id)
+        if connection:
+            connection.enqueue(frame)
+
+    async def broadcast_to_users(self, message: Message, user_ids: List[str], exclude_session: Optional[str] = None,
+                                 replay: bool = True):
+        """
+        Send a message to every session of a list of users across all nodes.
+        The message is wrapped in one shared Frame, so it is encoded once per
+        wire protocol rather than once per recipient.
+        Local sockets are only enqueued to, so this never waits on a client.
+        exclude_session skips one session, typically the one that originated the event.
+        replay buffers the frame for each recipient so dropped sessions can resume;
+        pass False for events clients catch up on some other way.
+        """
+        frame = as_frame(message)
+        if replay:
+            frame = await replay_buffer.record(frame, user_ids, exclude_session=exclude_session)
         for user_id in user_ids:
-            if user_id in self.active_connections:
-                await self.send_personal_message(message, user_id)
+            self._send_local(frame, user_id, exclude_session)
+        await self._publish_to_owners("send", user_ids, frame=frame)
+
+    async def broadcast_to_tenant(self, message: Message, tenant_id: int):
+        """
+        Send a message to every online member of a tenant across all nodes.
+        Each node delivers to the members it holds locally, so nobody has to
+        look up who is online. Not replayed.
+        """
+        frame = as_frame(message)
+        for user_id in self.tenant_connections.get(tenant_id, ()):
+            self._send_local(frame, user_id)
+        if self.redis_client:
+            header = json.dumps({"op": "tenant", "tenant_id": tenant_id, "origin": self.node_id})
+            await self.redis_client.publish(TENANT_CHANNEL, f"{header}\n{frame.as_json()}")
+
+    async def close_connection(self, user_id: str, code: int = 1008):
+        """
+        Close every session of a user, even those held by other nodes.
+        Sessions stay registered until their endpoint's disconnect, which is
+        what marks the identity offline.
+        """
+        self._close_local(user_id, code)
+        await self._publish_to_owners("close", [user_id], code=code)
 
-    def get_all_connection_ids(self) -> Set[str]:
-        """Returns a set of all active connection IDs."""
+    async def is_connected(self, user_id: str) -> bool:
+        """Checks whether a connection id has a live session on any node."""
+        if user_id in self.active_connections:
+            return True
+        if self.redis_client:
+            return bool(await self.redis_client.sismember(ONLINE_KEY, user_id))
+        return False
+
+    async def get_all_connection_ids(self) -> Set[str]:
+        """Returns a set of all online connection IDs across every node."""
+        if self.redis_client:
+            return set(await self.redis_client.smembers(ONLINE_KEY))
         return set(self.active_connections.keys())
 
+    def queue_metrics(self) -> Dict[str, int]:
+        """Queue depth gauges for the metrics endpoint."""
+        depths = [
+            c.queue.qsize()
+            for sessions in self.active_connections.values()
+            for c in sessions.values()
+        ]
+        return {
+            "ws.identities": len(self.active_connections),
+            "ws.connections": len(depths),
+            "ws.queue_depth_total": sum(depths),
+            "ws.queue_depth_max": max(depths, default=0),
+        }
+
+    # --- Local delivery ---
+
+    def _send_local(self, message: Frame, user_id: str, exclude_session: Optional[str] = None):
+        for session_id, connection in self.active_connections.get(user_id, {}).items():
+            if session_id != exclude_session:
+                connection.enqueue(message)
+
+    def _close_local(self, user_id: str, code: int):
+        for connection in self.active_connections.get(user_id, {}).values():
+            connection.close(code)
+
+    # --- Cross-node routing ---
+
+    async def _publish_to_owners(self, op: str, user_ids: List[str], frame: Optional[Frame] = None, **fields):
+        """
+        Looks up which other nodes hold sessions for each user and publishes the op there.
+        Envelopes are a JSON header line followed by the frame's JSON, so the
+        frame is reused as-is instead of being escaped into the header.
+        """
+        if not self.redis_client or not user_ids:
+            return
+        pipeline = self.redis_client.pipeline()
+        for user_id in user_ids:
+            pipeline.hvals(_sessions_key(user_id))
+        owners = await pipeline.execute()
+
+        targets_by_node = defaultdict(list)
+        for user_id, node_ids in zip(user_ids, owners):
+            for node_id in set(node_ids):
+                if node_id != self.node_id:
+                    targets_by_node[node_id].append(user_id)
+        if not targets_by_node:
+            return
+
+        body = frame.as_json() if frame else ""
+        pipeline = self.redis_client.pipeline()
+        for node_id, targets in targets_by_node.items():
+            header = json.dumps({"op": op, "targets": targets, **fields})
+            pipeline.publish(f"{NODE_CHANNEL_PREFIX}{node_id}", f"{header}\n{body}")
+        await pipeline.execute()
+
+    async def _listen(self):
+        """Routes envelopes published by other nodes to local sockets."""
+        async for raw in self._pubsub.listen():
+            if raw.get("type") != "message":
+                continue
+            try:
+                header, _, body = raw["data"].partition("\n")
+                envelope = json.loads(header)
+                targets = envelope.get("targets", [])
+                if envelope.get("op") == "send":
+                    frame = Frame.from_json(body)
+                    for user_id in targets:
+                        self._send_local(frame, user_id)
+                elif envelope.get("op") == "tenant":
+                    if envelope.get("origin") == self.node_id:
+                        continue
+                    frame = Frame.from_json(body)
+                    for user_id in self.tenant_connections.get(envelope["tenant_id"], ()):
+                        self._send_local(frame, user_id)
+                elif envelope.get("op") == "close":
+                    for user_id in targets:
+                        self._close_local(user_id, envelope.get("code", 1008))
+            except Exception as e:
+                print(f"Error routing pub/sub envelope on {self.channel}: {e}")
+
 manager = ConnectionManager()
@@ -0,0 +1,124 @@
+# app/websocket/presence.py
+import asyncio
+from datetime import datetime
+from typing import Dict, Optional
+
+import redis.asyncio as redis
+
+from app.core.config import settings
+from app.cache.last_seen import last_seen_buffer
+from app.cache.presence import set_presence
+from app.websocket.connection_manager import manager
+from app.websocket.protocol import Frame
+
+def _parse_window_overrides(raw: str) -> Dict[int, int]:
+    """Parses "tenant_id:ms,tenant_id:ms" into a dict."""
+    overrides = {}
+    for item in filter(None, (part.strip() for part in raw.split(","))):
+        tenant_id, window_ms = item.split(":")
+        overrides[int(tenant_id)] = int(window_ms)
+    return overrides
+
+class PresenceAggregator:
+    """
+    Buffers presence changes per tenant for a short window and then sends a
+    single 'presence_delta' frame to each online tenant member listing every
+    change, instead of one 'presence_update' frame per connect/disconnect.
+    Recipients come from the sockets each node holds, not from a read of the
+    tenant's presence hash.
+    A window of 0 flushes every change immediately.
+    """
+    def __init__(self, default_window_ms: int, window_overrides: Optional[Dict[int, int]] = None):
+        self.default_window_ms = default_window_ms
+        self.window_overrides: Dict[int, int] = dict(window_overrides or {})
+        # tenant_id -> connection_id -> latest change (later changes win)
+        self._pending: Dict[int, Dict[str, dict]] = {}
+        self._flush_tasks: Dict[int, asyncio.Task] = {}
+
+    def window_ms(self, tenant_id: int) -> int:
+        return self.window_overrides.get(tenant_id, self.default_window_ms)
+
+    def set_window(self, tenant_id: int, window_ms: int):
+        """Tunes the coalescing window for one tenant."""
+        self.window_overrides[tenant_id] = window_ms
+
+    async def record(
+        self,
+        tenant_id: int,
+        user_id: int,
+        role: str,
+        status: str,
+        version: Optional[int] = None,
+        timestamp: Optional[str] = None
+    ):
+        """
+        Records a user's online/offline change for the next delta of their tenant.
+        version is the presence store version the change was written at.
+        """
+        if status == "offline" and timestamp is None:
+            timestamp = datetime.utcnow().isoformat() + "Z"
+        elif status != "offline":
+            timestamp = None
+        self._pending.setdefault(tenant_id, {})[f"{role}-{user_id}"] = {
+            "user": {"id": user_id, "role": role},
+            "status": status,
+            "timestamp": timestamp,
+            "version": version,
+        }
+
+        window_ms = self.window_ms(tenant_id)
+        if window_ms <= 0:
+            await self.flush(tenant_id)
+        elif tenant_id not in self._flush_tasks:
+            self._flush_tasks[tenant_id] = asyncio.create_task(self._flush_later(tenant_id, window_ms))
+
+    async def _flush_later(self, tenant_id: int, window_ms: int):
+        try:
+            await asyncio.sleep(window_ms / 1000)
+        finally:
+            self._flush_tasks.pop(tenant_id, None)
+        await self.flush(tenant_id)
+
+    async def flush(self, tenant_id: int):
+        """Sends every buffered change for a tenant as one frame per recipient."""
+        changes = self._pending.pop(tenant_id, None)
+        if not changes:
+            return
+        try:
+            versions = [c["version"] for c in changes.values() if c["version"] is not None]
+            frame = Frame({
+                "event": "presence_delta",
+                "version": max(versions, default=None),
+                "changes": list(changes.values()),
+            })
+            # Not replayed: reconnecting clients catch up from their presence version
+            await manager.broadcast_to_tenant(frame, tenant_id)
+        except Exception as e:
+            print(f"Error flushing presence delta for tenant {tenant_id}: {e}")
+
+    async def flush_all(self):
+        """Flushes every tenant immediately (used on shutdown)."""
+        for task in list(self._flush_tasks.values()):
+            task.cancel()
+        self._flush_tasks.clear()
+        for tenant_id in list(self._pending):
+            await self.flush(tenant_id)
+
+presence_aggregator = PresenceAggregator(
+    settings.PRESENCE_COALESCE_WINDOW_MS,
+    _parse_window_overrides(settings.PRESENCE_COALESCE_WINDOW_OVERRIDES),
+)
+
+async def mark_offline(tenant_id: int, connection_id: str, redis_client: redis.Redis):
+    """
+    An identity's last session is gone: buffer its last_seen, record it
+    offline in the presence store and announce it to the tenant.
+    """
+    role, entity_id = connection_id.split("-")
+    disconnected_at = datetime.utcnow()
+    # Only users track last_seen; it is written behind in bulk
+    if role == "user":
+        last_seen_buffer.record(int(entity_id), disconnected_at)
+    last_seen = disconnected_at.isoformat() + "Z"
+    presence_version = await set_presence(tenant_id, connection_id, "offline", last_seen, redis_client)
+    await presence_aggregator.record(tenant_id, int(entity_id), role, "offline", presence_version, last_seen)
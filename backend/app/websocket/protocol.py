@@ -0,0 +1,77 @@
+# app/websocket/protocol.py
+import json
+from typing import Any, Dict, Optional, Union
+import msgpack
+from fastapi import WebSocket, WebSocketDisconnect
+
+# Wire protocols a socket can speak. JSON text frames are the default;
+# clients opt into compact binary frames by offering the msgpack subprotocol
+# in Sec-WebSocket-Protocol during the handshake.
+JSON_PROTOCOL = "json"
+MSGPACK_SUBPROTOCOL = "chat.msgpack.v1"
+
+class Frame:
+    """
+    An outbound event, encoded at most once per wire protocol.
+    The same Frame is shared by every recipient of a broadcast, so a group
+    message is serialized once no matter how many members it reaches.
+    """
+    __slots__ = ("_event", "_json", "_msgpack")
+
+    def __init__(self, event: Optional[Dict[str, Any]] = None, json_text: Optional[str] = None):
+        self._event = event
+        self._json = json_text
+        self._msgpack = None
+
+    @classmethod
+    def from_json(cls, json_text: str) -> "Frame":
+        """Wraps an already encoded JSON frame (e.g. one received over pub/sub)."""
+        return cls(json_text=json_text)
+
+    @property
+    def event(self) -> Dict[str, Any]:
+        if self._event is None:
+            self._event = json.loads(self._json)
+        return self._event
+
+    def as_json(self) -> str:
+        if self._json is None:
+            self._json = json.dumps(self._event, separators=(",", ":"))
+        return self._json
+
+    def as_msgpack(self) -> bytes:
+        if self._msgpack is None:
+            self._msgpack = msgpack.packb(self.event, use_bin_type=True)
+        return self._msgpack
+
+    def with_event_id(self, eid: int) -> "Frame":
+        """A copy of this frame with "eid" appended, spliced into the encoded JSON."""
+        return Frame.from_json(f'{self.as_json()[:-1]},"eid":{eid}}}')
+
+    def encode(self, protocol: str) -> Union[str, bytes]:
+        if protocol == MSGPACK_SUBPROTOCOL:
+            return self.as_msgpack()
+        return self.as_json()
+
+def as_frame(message: Union[Frame, Dict[str, Any], str]) -> Frame:
+    """Accepts an event dict, a pre-encoded JSON string or a Frame."""
+    if isinstance(message, Frame):
+        return message
+    if isinstance(message, str):
+        return Frame.from_json(message)
+    return Frame(message)
+
+def negotiate_protocol(websocket: WebSocket) -> str:
+    """Picks the wire protocol from the subprotocols the client offered."""
+    if MSGPACK_SUBPROTOCOL in websocket.scope.get("subprotocols", []):
+        return MSGPACK_SUBPROTOCOL
+    return JSON_PROTOCOL
+
+async def receive_event(websocket: WebSocket) -> Dict[str, Any]:
+    """Reads the next inbound event, whether it arrived as JSON text or msgpack bytes."""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    if message.get("bytes") is not None:
+        return msgpack.unpackb(message["bytes"], raw=False)
+    return json.loads(message["text"])
@@ -0,0 +1,187 @@
+# app/websocket/replay.py
+import json
+import secrets
+from typing import Dict, List, Optional
+import redis.asyncio as redis
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.websocket.protocol import Frame
+
+# Recent outbound events are kept per identity so a client that drops briefly
+# can reconnect and have what it missed replayed instead of resyncing:
+#   ws:replay:eid              int   global event id, stamped on every frame as "eid"
+#   ws:replay:{identity}       zset  recent frames scored by eid, capped at the buffer size
+#   ws:replay:{identity}:floor int   highest eid trimmed off the buffer
+#   ws:resume:{token}          json  {identity, session_id} of a session that just
+#                                    disconnected; lives for the retention window
+REPLAY_KEY_PREFIX = "ws:replay:"
+EVENT_ID_KEY = "ws:replay:eid"
+RESUME_KEY_PREFIX = "ws:resume:"
+# Keys sampled per metrics scrape to estimate replay buffer count and memory
+METRICS_SAMPLE_SIZE = 200
+
+def _buffer_key(connection_id: str) -> str:
+    return f"{REPLAY_KEY_PREFIX}{connection_id}"
+
+def _floor_key(connection_id: str) -> str:
+    return f"{REPLAY_KEY_PREFIX}{connection_id}:floor"
+
+def _resume_key(token: str) -> str:
+    return f"{RESUME_KEY_PREFIX}{token}"
+
+# Allocates the event id, stamps it into the payload and appends the frame to
+# every recipient's buffer, trimming each to capacity. Entries are
+# "eid\nsession_filter\npayload", where the filter is "-sid" (everyone but
+# that session), "+sid" (only that session) or empty. Returns the event id.
+_RECORD_SCRIPT = """
+local eid = redis.call('INCR', KEYS[1])
+local entry = eid .. '\\n' .. ARGV[2] .. '\\n' .. string.sub(ARGV[1], 1, -2) .. ',"eid":' .. eid .. '}'
+local capacity = tonumber(ARGV[3])
+local n = (#KEYS - 1) / 2
+for i = 2, n + 1 do
+    redis.call('ZADD', KEYS[i], eid, entry)
+    local overflow = redis.call('ZCARD', KEYS[i]) - capacity
+    if overflow > 0 then
+        local trimmed = redis.call('ZPOPMIN', KEYS[i], overflow)
+        redis.call('SET', KEYS[i + n], trimmed[#trimmed])
+    end
+    redis.call('EXPIRE', KEYS[i], ARGV[4])
+    redis.call('EXPIRE', KEYS[i + n], ARGV[4])
+end
+return eid
+"""
+
+class ReplayBuffer:
+    """
+    Per-identity ring buffers of recent outbound frames in Redis.
+
+    Every replayable frame gets a global, increasing event id ("eid"). On
+    disconnect the session's resume token is parked for the retention window;
+    a client reconnecting with that token and the last eid it saw gets every
+    later frame replayed, or is told to resync if the buffer no longer
+    reaches back that far.
+    """
+    def __init__(self, capacity: int, retention_seconds: int):
+        self.capacity = capacity
+        self.retention_seconds = retention_seconds
+        self.redis_client: Optional[redis.Redis] = None
+        self._hits = 0
+        self._misses = 0
+        metrics.register_collector(self.memory_metrics)
+
+    @property
+    def enabled(self) -> bool:
+        return self.redis_client is not None and self.capacity > 0
+
+    def start(self, redis_client: redis.Redis):
+        self.redis_client = redis_client
+
+    async def record(
+        self,
+        frame: Frame,
+        connection_ids: List[str],
+        exclude_session: Optional[str] = None,
+        only_session: Optional[str] = None
+    ) -> Frame:
+        """Buffers a frame for each recipient and returns it stamped with its eid."""
+        if not self.enabled or not connection_ids:
+            return frame
+        connection_ids = list(dict.fromkeys(connection_ids))
+        session_filter = f"+{only_session}" if only_session else f"-{exclude_session}" if exclude_session else ""
+        eid = await self.redis_client.eval(
+            _RECORD_SCRIPT, 1 + 2 * len(connection_ids),
+            EVENT_ID_KEY,
+            *[_buffer_key(cid) for cid in connection_ids],
+            *[_floor_key(cid) for cid in connection_ids],
+            frame.as_json(), session_filter, self.capacity, self.retention_seconds
+        )
+        metrics.incr("ws.replay.frames_recorded")
+        return frame.with_event_id(int(eid))
+
+    def new_resume_token(self) -> str:
+        return secrets.token_urlsafe(24)
+
+    async def suspend(self, token: str, connection_id: str, session_id: str):
+        """Parks a disconnected session's resume token for the retention window."""
+        if not self.enabled:
+            return
+        await self.redis_client.set(
+            _resume_key(token),
+            json.dumps({"identity": connection_id, "session_id": session_id}),
+            ex=self.retention_seconds,
+        )
+
+    async def resume(self, token: str, connection_id: str, last_event_id: int) -> Optional[List[Frame]]:
+        """
+        Returns the frames a resumed session missed after last_event_id, in
+        order, or None if it can't be resumed and needs a full resync.
+        """
+        if not self.enabled:
+            return None
+        parked = await self.redis_client.getdel(_resume_key(token))
+        parked = json.loads(parked) if parked else None
+        if not parked or parked["identity"] != connection_id:
+            self._record_miss()
+            return None
+
+        pipeline = self.redis_client.pipeline(transaction=True)
+        pipeline.get(_floor_key(connection_id))
+        pipeline.zrangebyscore(_buffer_key(connection_id), f"({last_event_id}", "+inf")
+        floor, entries = await pipeline.execute()
+        if floor and int(floor) > last_event_id:
+            # Some of what the client missed has already been trimmed away
+            self._record_miss()
+            return None
+
+        frames = []
+        old_session = parked["session_id"]
+        for entry in entries:
+            _, session_filter, payload = entry.split("\n", 2)
+            if session_filter == f"-{old_session}":
+                continue
+            if session_filter.startswith("+") and session_filter != f"+{old_session}":
+                continue
+            frames.append(Frame.from_json(payload))
+        self._hits += 1
+        metrics.incr("ws.resume.hits")
+        metrics.incr("ws.resume.frames_replayed", len(frames))
+        return frames
+
+    def _record_miss(self):
+        self._misses += 1
+        metrics.incr("ws.resume.misses")
+
+    async def memory_metrics(self) -> Dict[str, float]:
+        """
+        Resume hit rate, and estimates of the number of replay buffers and the
+        Redis memory they use. Estimated from METRICS_SAMPLE_SIZE random keys,
+        so a scrape costs the same however many identities are buffered.
+        """
+        if not self.enabled:
+            return {}
+        pipeline = self.redis_client.pipeline(transaction=False)
+        pipeline.dbsize()
+        for _ in range(METRICS_SAMPLE_SIZE):
+            pipeline.randomkey()
+        total_keys, *sampled = await pipeline.execute()
+        sampled = [key for key in sampled if key is not None]
+        buffers = [
+            key for key in set(sampled)
+            if key.startswith(REPLAY_KEY_PREFIX) and key != EVENT_ID_KEY and not key.endswith(":floor")
+        ]
+        pipeline = self.redis_client.pipeline(transaction=False)
+        for key in buffers:
+            pipeline.memory_usage(key)
+        usage = [u or 0 for u in await pipeline.execute()] if buffers else []
+
+        buffer_share = sum(1 for key in sampled if key in buffers) / len(sampled) if sampled else 0.0
+        estimated_buffers = total_keys * buffer_share
+        attempts = self._hits + self._misses
+        return {
+            "ws.resume.hit_rate": self._hits / attempts if attempts else 0.0,
+            "ws.replay.buffers_estimate": round(estimated_buffers),
+            "ws.replay.memory_bytes_estimate": round(estimated_buffers * (sum(usage) / len(usage))) if usage else 0,
+        }
+
+replay_buffer = ReplayBuffer(settings.WS_REPLAY_BUFFER_SIZE, settings.WS_REPLAY_RETENTION_SECONDS)
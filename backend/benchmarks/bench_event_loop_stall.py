@@ -0,0 +1,103 @@
+# benchmarks/bench_event_loop_stall.py
+"""
+Measures how long the event loop stalls while async handlers run database
+queries through the sync SessionLocal vs the async AsyncSessionLocal.
+
+A ticker coroutine wakes every TICK_MS; any lateness beyond that is time the
+loop spent blocked (and every socket on it frozen).
+
+Uses a throwaway SQLite file so it runs without Postgres. Run from the
+`backend` directory:
+    python -m benchmarks.bench_event_loop_stall
+"""
+import asyncio
+import os
+import tempfile
+import time
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.db.session import get_async_database_url
+from app.models import Admin, Base, User
+
+USERS = 50_000
+CONCURRENT_REQUESTS = 50
+TICK_MS = 1
+
+def seed(database_url: str):
+    engine = create_engine(database_url)
+    Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        admin = Admin(username="bench_admin", password_hash="x", admin_key="bench")
+        db.add(admin)
+        db.flush()
+        db.add_all(
+            User(username=f"user_{i}", full_name=f"User {i}", password_hash="x", admin_id=admin.id)
+            for i in range(USERS)
+        )
+        db.commit()
+    return engine
+
+def heavy_query():
+    # A tenant-wide scan, similar in cost to the presence/conversation lookups
+    return select(User.id, User.last_seen).filter(User.full_name.like("%9%"))
+
+async def ticker(stop: asyncio.Event, stalls: list):
+    interval = TICK_MS / 1000
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        late = time.perf_counter() - started - interval
+        if late > 0:
+            stalls.append(late)
+
+async def run(handler):
+    stop = asyncio.Event()
+    stalls = []
+    tick_task = asyncio.create_task(ticker(stop, stalls))
+    started = time.perf_counter()
+    await asyncio.gather(*(handler() for _ in range(CONCURRENT_REQUESTS)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await tick_task
+    return elapsed, stalls
+
+def report(name, elapsed, stalls):
+    stalls_ms = sorted(s * 1000 for s in stalls)
+    worst = stalls_ms[-1] if stalls_ms else 0.0
+    p99 = stalls_ms[int(len(stalls_ms) * 0.99) - 1] if stalls_ms else 0.0
+    print(f"{name}")
+    print(f"  wall time:        {elapsed * 1000:>9.1f} ms")
+    print(f"  total loop stall: {sum(stalls_ms):>9.1f} ms")
+    print(f"  worst stall:      {worst:>9.1f} ms   p99 stall: {p99:.1f} ms")
+
+async def main():
+    workdir = tempfile.mkdtemp()
+    database_url = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    sync_engine = seed(database_url)
+    SyncSession = sessionmaker(bind=sync_engine)
+
+    async_engine = create_async_engine(get_async_database_url(database_url))
+    AsyncSessionLocal = async_sessionmaker(bind=async_engine, class_=AsyncSession)
+
+    async def sync_handler():
+        # What the handlers did before: blocking db.query() inside async def
+        db = SyncSession()
+        try:
+            db.execute(heavy_query()).all()
+        finally:
+            db.close()
+        await asyncio.sleep(0)
+
+    async def async_handler():
+        async with AsyncSessionLocal() as db:
+            (await db.execute(heavy_query())).all()
+
+    report("sync Session in async handler", *await run(sync_handler))
+    report("AsyncSession", *await run(async_handler))
+    await async_engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
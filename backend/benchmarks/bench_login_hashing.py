@@ -0,0 +1,88 @@
+# benchmarks/bench_login_hashing.py
+"""
+Login latency under a burst of concurrent logins, with bcrypt run inline in
+sync endpoints (on the threadpool every sync endpoint shares) vs on the
+dedicated HashingPool.
+
+While LOGINS logins are in flight, a steady stream of cheap sync requests
+runs through the shared threadpool too; their latency shows how much a login
+storm starves the rest of the API.
+
+Run from the `backend` directory:
+    python -m benchmarks.bench_login_hashing
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.security.hashing import HashingPool, pwd_context
+
+LOGINS = 200
+# Starlette's default threadpool size for sync endpoints
+SHARED_THREADPOOL_SIZE = 40
+CHEAP_REQUESTS = 400
+CHEAP_REQUEST_INTERVAL_MS = 5
+
+PASSWORD = "correct horse battery staple"
+PASSWORD_HASH = pwd_context.hash(PASSWORD)
+
+def cheap_sync_request():
+    # Stands in for a small sync endpoint (a quick query, some serialization)
+    time.sleep(0.001)
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))] * 1000
+
+async def timed(coro, samples):
+    started = time.perf_counter()
+    await coro
+    samples.append(time.perf_counter() - started)
+
+async def run(login):
+    shared = ThreadPoolExecutor(max_workers=SHARED_THREADPOOL_SIZE)
+    loop = asyncio.get_running_loop()
+    login_latency, cheap_latency = [], []
+
+    async def cheap_stream():
+        tasks = []
+        for _ in range(CHEAP_REQUESTS):
+            tasks.append(asyncio.create_task(
+                timed(loop.run_in_executor(shared, cheap_sync_request), cheap_latency)
+            ))
+            await asyncio.sleep(CHEAP_REQUEST_INTERVAL_MS / 1000)
+        await asyncio.gather(*tasks)
+
+    started = time.perf_counter()
+    await asyncio.gather(
+        cheap_stream(),
+        *(timed(login(shared), login_latency) for _ in range(LOGINS)),
+    )
+    elapsed = time.perf_counter() - started
+    shared.shutdown()
+    return elapsed, login_latency, cheap_latency
+
+def report(name, elapsed, login_latency, cheap_latency):
+    print(name)
+    print(f"  wall time:             {elapsed * 1000:>8.0f} ms")
+    print(f"  login p50 / p99:       {percentile(login_latency, 0.5):>8.0f} / {percentile(login_latency, 0.99):.0f} ms")
+    print(f"  other sync p50 / p99:  {percentile(cheap_latency, 0.5):>8.1f} / {percentile(cheap_latency, 0.99):.1f} ms")
+
+async def main():
+    workers = os.cpu_count() or 2
+    pool = HashingPool(workers=workers, max_queue=LOGINS)
+
+    async def inline_login(shared):
+        # What sync login did: bcrypt on the shared threadpool
+        await asyncio.get_running_loop().run_in_executor(shared, pwd_context.verify, PASSWORD, PASSWORD_HASH)
+
+    async def pooled_login(shared):
+        await pool.run(pwd_context.verify, PASSWORD, PASSWORD_HASH)
+
+    print(f"{LOGINS} concurrent logins, {CHEAP_REQUESTS} other sync requests, {workers} hashing workers")
+    report("bcrypt inline on the shared threadpool", *await run(inline_login))
+    report("bcrypt on the dedicated hashing pool", *await run(pooled_login))
+
+if __name__ == "__main__":
+    asyncio.run(main())
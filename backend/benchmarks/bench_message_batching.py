@@ -0,0 +1,117 @@
+# benchmarks/bench_message_batching.py
+"""
+Compares new_message persistence throughput: one awaited insert_one per
+message (the old path) vs the MessageBatcher's windowed insert_many.
+
+SOCKETS clients each send a burst of MESSAGES_PER_SOCKET messages. By default
+Mongo is simulated with a fixed round-trip time, a small per-document cost and
+a bounded connection pool; set BENCH_MONGO_URL to run against a real server
+(a throwaway "bench_message_batching" database is created and dropped).
+
+Run from the `backend` directory:
+    python -m benchmarks.bench_message_batching
+"""
+import asyncio
+import os
+import time
+from datetime import datetime
+
+from bson import ObjectId
+
+from app.db.message_batcher import MessageBatcher
+
+SOCKETS = 200
+MESSAGES_PER_SOCKET = 50
+WINDOWS_MS = [0, 2, 5, 20]
+
+# Simulated Mongo
+ROUND_TRIP_MS = 1.0
+PER_DOCUMENT_MS = 0.01
+POOL_SIZE = 100
+
+class SimulatedCollection:
+    def __init__(self):
+        self._pool = asyncio.Semaphore(POOL_SIZE)
+        self.round_trips = 0
+
+    async def _round_trip(self, documents):
+        async with self._pool:
+            self.round_trips += 1
+            for document in documents:
+                document.setdefault("_id", ObjectId())
+            await asyncio.sleep((ROUND_TRIP_MS + PER_DOCUMENT_MS * len(documents)) / 1000)
+
+    async def insert_one(self, document):
+        await self._round_trip([document])
+
+    async def insert_many(self, documents, ordered=True):
+        await self._round_trip(documents)
+
+    async def drop(self):
+        pass
+
+def make_message(socket_id, n):
+    return {
+        "type": "group",
+        "sender": {"id": socket_id, "role": "user", "username": f"user_{socket_id}"},
+        "group": {"id": socket_id % 10, "name": "bench"},
+        "content": {"text": f"message {n}"},
+        "timestamp": datetime.utcnow(),
+        "is_deleted": False,
+    }
+
+async def insert_one_path(collection):
+    async def socket(socket_id):
+        for n in range(MESSAGES_PER_SOCKET):
+            await collection.insert_one(make_message(socket_id, n))
+    await asyncio.gather(*(socket(i) for i in range(SOCKETS)))
+
+async def batched_path(collection, window_ms):
+    batcher = MessageBatcher(window_ms, max_batch_size=500)
+    await batcher.start(collection)
+
+    async def socket(socket_id):
+        # Like the websocket loop: submit and move on to the next frame
+        return [batcher.submit(make_message(socket_id, n)) for n in range(MESSAGES_PER_SOCKET)]
+
+    futures = await asyncio.gather(*(socket(i) for i in range(SOCKETS)))
+    await asyncio.gather(*(f for per_socket in futures for f in per_socket))
+    await batcher.stop()
+
+def report(name, elapsed, round_trips):
+    total = SOCKETS * MESSAGES_PER_SOCKET
+    print(f"{name:<28} {elapsed * 1000:>9.1f} ms  {total / elapsed:>10.0f} msg/s  {round_trips:>6} round trips")
+
+async def main():
+    mongo_url = os.getenv("BENCH_MONGO_URL")
+    client = None
+    if mongo_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(mongo_url)
+        database = client["bench_message_batching"]
+
+    def fresh_collection():
+        return database["messages"] if client else SimulatedCollection()
+
+    print(f"{SOCKETS} sockets x {MESSAGES_PER_SOCKET} messages "
+          f"({'real Mongo' if client else f'simulated Mongo, {ROUND_TRIP_MS} ms RTT'})")
+
+    collection = fresh_collection()
+    started = time.perf_counter()
+    await insert_one_path(collection)
+    report("insert_one per message", time.perf_counter() - started, getattr(collection, "round_trips", "-"))
+    await collection.drop()
+
+    for window_ms in WINDOWS_MS:
+        collection = fresh_collection()
+        started = time.perf_counter()
+        await batched_path(collection, window_ms)
+        report(f"batched, {window_ms} ms window", time.perf_counter() - started, getattr(collection, "round_trips", "-"))
+        await collection.drop()
+
+    if client:
+        await client.drop_database("bench_message_batching")
+        client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
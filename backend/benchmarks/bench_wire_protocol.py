@@ -0,0 +1,78 @@
+# benchmarks/bench_wire_protocol.py
+"""
+Compares JSON and msgpack encoding cost and frame size for typical WebSocket
+events, and per-recipient vs encode-once fan-out for a group message.
+
+Run from the `backend` directory:
+    python -m benchmarks.bench_wire_protocol
+"""
+import json
+import timeit
+from datetime import datetime
+
+import msgpack
+
+from app.websocket.protocol import Frame
+
+GROUP_SIZE = 500
+TENANT_SIZE = 5000
+ROUNDS = 2000
+
+def new_message_event():
+    return {
+        "event": "new_message",
+        "_id": "66a1f0c2e4b0a1b2c3d4e5f6",
+        "type": "group",
+        "sender": {"id": 42, "role": "user", "username": "alice_acme"},
+        "group": {"id": 7, "name": "Support Team"},
+        "content": {"text": "Can someone take a look at ticket #4821? The customer is waiting.", "image": None, "file": None},
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "read_by": [{"id": 42, "role": "user"}],
+        "is_deleted": False,
+    }
+
+def initial_presence_state_event(size: int):
+    users = {}
+    for i in range(size):
+        if i % 3 == 0:
+            users[f"user-{i}"] = {"status": "online", "lastSeen": None}
+        else:
+            users[f"user-{i}"] = {"status": "offline", "lastSeen": "2024-07-25T09:14:03.123456Z"}
+    return {"event": "initial_presence_state", "users": users}
+
+def encode_json(event):
+    return json.dumps(event, separators=(",", ":"))
+
+def encode_msgpack(event):
+    return msgpack.packb(event, use_bin_type=True)
+
+def report(name, event, rounds):
+    json_size = len(encode_json(event).encode())
+    msgpack_size = len(encode_msgpack(event))
+    json_us = timeit.timeit(lambda: encode_json(event), number=rounds) / rounds * 1e6
+    msgpack_us = timeit.timeit(lambda: encode_msgpack(event), number=rounds) / rounds * 1e6
+    print(f"{name}")
+    print(f"  json:    {json_size:>9} bytes  {json_us:>10.2f} us/encode")
+    print(f"  msgpack: {msgpack_size:>9} bytes  {msgpack_us:>10.2f} us/encode "
+          f"({msgpack_size / json_size:.0%} of json size)")
+
+def report_fan_out(event, recipients, rounds):
+    def per_recipient():
+        for _ in range(recipients):
+            encode_json(event)
+
+    def encode_once():
+        frame = Frame(event)
+        for _ in range(recipients):
+            frame.as_json()
+
+    per_recipient_ms = timeit.timeit(per_recipient, number=rounds) / rounds * 1e3
+    encode_once_ms = timeit.timeit(encode_once, number=rounds) / rounds * 1e3
+    print(f"group fan-out to {recipients} recipients")
+    print(f"  json.dumps per recipient: {per_recipient_ms:>8.3f} ms")
+    print(f"  shared Frame:             {encode_once_ms:>8.3f} ms")
+
+if __name__ == "__main__":
+    report("new_message", new_message_event(), ROUNDS)
+    report(f"initial_presence_state ({TENANT_SIZE} members)", initial_presence_state_event(TENANT_SIZE), 50)
+    report_fan_out(new_message_event(), GROUP_SIZE, 200)
@@ -0,0 +1,32 @@
+import asyncio
+import sys
+
+from app.db.session import connect_to_mongo, close_mongo_connection, get_mongo_db
+from app.db.indexes import ensure_indexes, find_collection_scans, CANONICAL_QUERIES
+
+# IMPORTANT: Run this script from the `backend` directory
+# so it picks up the same settings as the app.
+# Example: python check_query_plans.py
+# Exits non-zero if any canonical query in app/db/indexes.py would scan a
+# whole collection, or an index differs from its definition; run it in CI
+# against a scratch database whenever queries or indexes change.
+
+async def check_query_plans() -> int:
+    await connect_to_mongo()
+    mongo_db = await get_mongo_db()
+    try:
+        # Same reconciliation the app runs at startup
+        mismatched = await ensure_indexes(mongo_db)
+        offenders = await find_collection_scans(mongo_db)
+    finally:
+        await close_mongo_connection()
+
+    for name in offenders:
+        print(f"COLLSCAN: {name}")
+    print(f"\nChecked {len(CANONICAL_QUERIES)} queries: "
+          f"{len(offenders)} collection scans, {len(mismatched)} mismatched indexes.")
+    return 1 if offenders or mismatched else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(check_query_plans()))
@@ -1,9 +1,20 @@
 # main.py
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.core.config import settings
 from app.api.v1.api_router import api_router
-from app.db.session import close_mongo_connection, connect_to_mongo
+from app.db.session import close_mongo_connection, connect_to_mongo, async_engine, get_mongo_db
+from app.db.message_batcher import message_batcher
+from app.websocket.connection_manager import manager
+from app.websocket.presence import presence_aggregator, mark_offline
+from app.cache.last_seen import last_seen_buffer
+from app.db.indexes import ensure_indexes
+from app.cache.local_cache import cache_invalidator
+from app.security.revocation import revocation_list
+from app.security.hashing import HashingPoolFull
+from app.security.dependencies import require_metrics_token
+from app.core.metrics import metrics
 from contextlib import asynccontextmanager
 import redis.asyncio as redis
 
@@ -19,21 +30,64 @@ async def lifespan(app: FastAPI):
     app.state.redis_client = redis.Redis(connection_pool=redis_pool)
     print("Redis connection pool created.")
 
+    # Route WebSocket events between workers/hosts over Redis pub/sub, and
+    # mark identities offline when the node holding them dies
+    redis_client = app.state.redis_client
+    await manager.start(
+        redis_client,
+        on_offline=lambda tenant_id, connection_id: mark_offline(tenant_id, connection_id, redis_client),
+    )
+
+    # Keep in-process caches coherent across workers
+    await cache_invalidator.start(app.state.redis_client)
+
+    # Load revoked token ids and follow new revocations
+    await revocation_list.start(app.state.redis_client)
+
     # --- ADD THIS: Connect to MongoDB ---
     await connect_to_mongo()
+
+    # Create any Mongo index the app's queries need that doesn't exist yet
+    await ensure_indexes(await get_mongo_db())
+
+    # Batch new message inserts from every socket into insert_many calls
+    await message_batcher.start((await get_mongo_db())["messages"])
+
+    # Periodically flush buffered last_seen timestamps in bulk
+    await last_seen_buffer.start()
     
     yield # The application runs here
     
     # --- Code to run on shutdown ---
     print("Application shutdown: Closing connections...")
 
+    # Stop routing and drop this node's sockets from the registry
+    # (marking identities whose last session was here offline)
+    await manager.stop()
+
+    # Send any buffered presence changes, including those offlines
+    await presence_aggregator.flush_all()
+
+    # Write out messages still queued for insertion
+    await message_batcher.stop()
+
+    # Stop listening for cache invalidations and revocations
+    await cache_invalidator.stop()
+    await revocation_list.stop()
+
     # Close Redis connection
     await app.state.redis_client.close()
     print("Redis connection pool closed.")
 
+    # Write out last_seen timestamps still buffered (after sockets are gone)
+    await last_seen_buffer.stop()
+
     # --- ADD THIS: Close MongoDB connection ---
     await close_mongo_connection()
 
+    # Release the async PostgreSQL pool
+    await async_engine.dispose()
+
 app = FastAPI(
     title="Multi-Tenant Chat API",
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
@@ -52,6 +106,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(HashingPoolFull)
+async def hashing_pool_full_handler(request: Request, exc: HashingPoolFull):
+    """The bcrypt pool is saturated; ask the client to back off briefly."""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Too many password operations in progress. Please try again shortly."},
+        headers={"Retry-After": "1"},
+    )
+
 # Include the API router
 app.include_router(api_router, prefix=settings.API_V1_STR)
 
@@ -61,11 +124,20 @@ def read_root():
     Root endpoint for basic health check.
     """
     return {"message": "Welcome to the Multi-Tenant Chat API"}
+
     """
     Close MongoDB connection on shutdown.
     """
     # await close_mongo_connection()
 
+@app.get("/metrics", dependencies=[Depends(require_metrics_token)], include_in_schema=False)
+async def read_metrics():
+    """
+    Process-local counters and gauges (queue depth, drops, ...).
+    Internal only: requires the METRICS_TOKEN bearer token.
+    """
+    return await metrics.snapshot()
+
 
 # Include the API router
 # app.include_router(api_router, prefix=settings.API_V1_STR)
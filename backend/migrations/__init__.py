@@ -0,0 +1,14 @@
+# migrations/__init__.py
+"""
+Versioned data migrations for MongoDB.
+
+Each migration walks the documents that still need it in _id order, in
+parallel _id ranges, and writes them back with bulk_write. Progress is
+checkpointed in the `migrations` collection, so an interrupted run resumes
+where it stopped. Run from the `backend` directory:
+    python -m migrations              # apply everything pending
+    python -m migrations --dry-run    # count and time, write nothing
+    python -m migrations --list       # show what has been applied
+"""
+from .base import Migration
+from .runner import MigrationRunner, MIGRATIONS_COLLECTION
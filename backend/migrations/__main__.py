@@ -0,0 +1,48 @@
+# migrations/__main__.py
+import argparse
+import os
+from pymongo import MongoClient
+from dotenv import load_dotenv
+
+from .runner import MigrationRunner
+from .versions import MIGRATIONS
+
+# IMPORTANT: Run this from the `backend` directory
+# so it can find the .env file.
+# Example: python -m migrations --workers 8
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m migrations", description="Apply pending MongoDB migrations.")
+    parser.add_argument("--dry-run", action="store_true", help="Read and transform, but write nothing")
+    parser.add_argument("--workers", type=int, default=4, help="Parallel _id ranges per migration")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Documents per bulk_write")
+    parser.add_argument("--target", type=int, default=None, help="Stop after this version")
+    parser.add_argument("--list", action="store_true", help="Show each migration's status and exit")
+    args = parser.parse_args()
+
+    load_dotenv(dotenv_path='./.env') # Assumes .env is in the current dir
+
+    mongo_url = os.getenv("MONGO_DATABASE_URL")
+    db_name = os.getenv("MONGO_DB_NAME")
+
+    if not mongo_url or not db_name:
+        print("Error: MONGO_DATABASE_URL and MONGO_DB_NAME must be set in .env file.")
+        return
+
+    client = MongoClient(mongo_url)
+    runner = MigrationRunner(
+        client[db_name], workers=args.workers, batch_size=args.batch_size, dry_run=args.dry_run
+    )
+    try:
+        if args.list:
+            for entry in runner.status(MIGRATIONS):
+                processed = f", {entry['processed']} documents" if "processed" in entry else ""
+                print(f"{entry['migration']}: {entry['status']}{processed}")
+        else:
+            runner.run(MIGRATIONS, target=args.target)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+# migrations/base.py
+from typing import Any, Dict, List, Optional
+from pymongo import IndexModel
+from pymongo.operations import UpdateOne
+
+class Migration:
+    """
+    One versioned change to the documents of a collection.
+
+    pending_filter() must match exactly the documents that still need the
+    migration, and stop matching them once they've been migrated; that is
+    what makes re-runs and resumed runs safe. Migrations that write to
+    another collection (target_collection) leave their source documents
+    matching, so their writes must be idempotent instead.
+    """
+    version: int
+    name: str
+    collection: str = "messages"
+    # Where the writes go; None writes back to `collection`
+    target_collection: Optional[str] = None
+    # Indexes on the target the writes rely on, created before the first batch
+    target_indexes: List[IndexModel] = []
+    # Fields migrate() needs; None loads whole documents
+    projection: Optional[Dict[str, Any]] = None
+
+    def pending_filter(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def migrate(self, document: Dict[str, Any]) -> Optional[UpdateOne]:
+        """The write for one document, or None to leave it as it is."""
+        raise NotImplementedError
+
+    def migrate_batch(self, documents: List[Dict[str, Any]]) -> List[UpdateOne]:
+        """
+        The writes for one batch of documents. Override to fold documents
+        that update the same target document into one write.
+        """
+        return [op for op in (self.migrate(document) for document in documents) if op is not None]
+
+    def __str__(self) -> str:
+        return f"{self.version:04d}_{self.name}"
@@ -0,0 +1,195 @@
+# migrations/runner.py
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING
+from pymongo.database import Database
+from pymongo.errors import BulkWriteError
+
+from .base import Migration
+
+# One document per migration version:
+# {
+#   "_id": 1, "name": "read_by",
+#   "status": "running" | "done",
+#   "started_at": datetime, "finished_at": datetime,
+#   "processed": 12345,                      # documents written so far
+#   "partitions": [
+#     {"lower": ObjectId, "upper": ObjectId | None, "last_id": ObjectId | None,
+#      "processed": 1234, "done": bool}, ...
+#   ]
+# }
+# A partition covers _ids in [lower, upper); last_id is its checkpoint.
+MIGRATIONS_COLLECTION = "migrations"
+
+class _Progress:
+    """Thread-safe document counter that prints throughput every few seconds."""
+    def __init__(self, label: str, report_interval: float = 5.0):
+        self.label = label
+        self.report_interval = report_interval
+        self.count = 0
+        self.started = time.perf_counter()
+        self._last_report = self.started
+        self._lock = threading.Lock()
+
+    def add(self, n: int):
+        with self._lock:
+            self.count += n
+            now = time.perf_counter()
+            if now - self._last_report >= self.report_interval:
+                self._last_report = now
+                print(f"  {self.label}: {self.count} documents, {self.rate():.0f} docs/s")
+
+    def rate(self) -> float:
+        elapsed = time.perf_counter() - self.started
+        return self.count / elapsed if elapsed > 0 else 0.0
+
+class MigrationRunner:
+    """
+    Applies pending migrations in version order. Each one is split into
+    `workers` _id ranges processed in parallel, `batch_size` documents per
+    bulk_write. Don't run two runners against the same database at once.
+    """
+    def __init__(self, db: Database, workers: int = 4, batch_size: int = 1000, dry_run: bool = False):
+        self.db = db
+        self.workers = workers
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.state = db[MIGRATIONS_COLLECTION]
+
+    def status(self, migrations: List[Migration]) -> List[Dict[str, Any]]:
+        applied = {doc["_id"]: doc for doc in self.state.find({}, projection={"partitions": 0})}
+        return [
+            {"migration": str(migration), **applied.get(migration.version, {"status": "pending"})}
+            for migration in migrations
+        ]
+
+    def run(self, migrations: List[Migration], target: Optional[int] = None):
+        for migration in sorted(migrations, key=lambda m: m.version):
+            if target is not None and migration.version > target:
+                break
+            state = self.state.find_one({"_id": migration.version})
+            if state and state["status"] == "done":
+                continue
+            self.run_one(migration, state)
+
+    def run_one(self, migration: Migration, state: Optional[Dict[str, Any]] = None):
+        collection = self.db[migration.collection]
+        target = self.db[migration.target_collection or migration.collection]
+        if migration.target_indexes and not self.dry_run:
+            target.create_indexes(migration.target_indexes)
+        if self.dry_run or not state or not state.get("partitions"):
+            partitions = self._plan_partitions(migration)
+            if not self.dry_run:
+                state = {
+                    "_id": migration.version,
+                    "name": migration.name,
+                    "status": "running",
+                    "started_at": datetime.utcnow(),
+                    "processed": 0,
+                    "partitions": partitions,
+                }
+                self.state.replace_one({"_id": migration.version}, state, upsert=True)
+        else:
+            partitions = state["partitions"]
+            print(f"Resuming {migration} from its checkpoints ({state['processed']} documents already written).")
+
+        mode = " (dry run)" if self.dry_run else ""
+        print(f"Applying {migration}{mode} over {len(partitions)} partition(s)...")
+        progress = _Progress(str(migration))
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = [
+                pool.submit(self._run_partition, migration, collection, target, index, partition, progress)
+                for index, partition in enumerate(partitions) if not partition["done"]
+            ]
+        # Re-raise the first failure; finished partitions keep their checkpoints
+        for future in futures:
+            future.result()
+
+        elapsed = time.perf_counter() - progress.started
+        verb = "would be written" if self.dry_run else "written"
+        print(f"Finished {migration}{mode}: {progress.count} documents {verb} "
+              f"in {elapsed:.1f}s ({progress.rate():.0f} docs/s).")
+        if not self.dry_run:
+            self.state.update_one(
+                {"_id": migration.version},
+                {"$set": {"status": "done", "finished_at": datetime.utcnow()}},
+            )
+
+    def _plan_partitions(self, migration: Migration) -> List[Dict[str, Any]]:
+        """
+        Splits the pending documents' _id span into `workers` ranges. ObjectIds
+        start with their creation time, so the span is cut into equal time slices.
+        The last range is open-ended, so documents that start matching mid-run
+        are picked up too.
+        """
+        collection = self.db[migration.collection]
+        pending = migration.pending_filter()
+        first = collection.find_one(pending, projection={"_id": 1}, sort=[("_id", ASCENDING)])
+        last = collection.find_one(pending, projection={"_id": 1}, sort=[("_id", DESCENDING)])
+        if not first:
+            return []
+
+        lower_bounds = [first["_id"]]
+        if isinstance(first["_id"], ObjectId) and isinstance(last["_id"], ObjectId) and self.workers > 1:
+            start, end = first["_id"].generation_time, last["_id"].generation_time
+            step = (end - start) / self.workers
+            for i in range(1, self.workers):
+                bound = ObjectId.from_datetime(start + step * i)
+                if bound > lower_bounds[-1]:
+                    lower_bounds.append(bound)
+
+        uppers = lower_bounds[1:] + [None]
+        return [
+            {"lower": lower, "upper": upper, "last_id": None, "processed": 0, "done": False}
+            for lower, upper in zip(lower_bounds, uppers)
+        ]
+
+    def _run_partition(self, migration: Migration, collection, target, index: int,
+                       partition: Dict[str, Any], progress: _Progress):
+        pending = migration.pending_filter()
+        last_id = partition["last_id"]
+        while True:
+            id_range = {"$gt": last_id} if last_id is not None else {"$gte": partition["lower"]}
+            if partition["upper"] is not None:
+                id_range["$lt"] = partition["upper"]
+            batch = list(
+                collection.find({"$and": [pending, {"_id": id_range}]}, projection=migration.projection)
+                .sort("_id", ASCENDING)
+                .limit(self.batch_size)
+            )
+            if not batch:
+                break
+
+            operations = migration.migrate_batch(batch)
+            last_id = batch[-1]["_id"]
+            if not self.dry_run:
+                if operations:
+                    self._write(target, operations)
+                self.state.update_one(
+                    {"_id": migration.version},
+                    {
+                        "$set": {f"partitions.{index}.last_id": last_id},
+                        "$inc": {f"partitions.{index}.processed": len(operations), "processed": len(operations)},
+                    },
+                )
+            progress.add(len(operations))
+
+        if not self.dry_run:
+            self.state.update_one({"_id": migration.version}, {"$set": {f"partitions.{index}.done": True}})
+
+    @staticmethod
+    def _write(target, operations: List[Any]):
+        try:
+            target.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # Two partitions upserting the same target document can race on its
+            # unique index; the loser's write applies cleanly to the winner's
+            write_errors = e.details.get("writeErrors", [])
+            if not write_errors or any(error["code"] != 11000 for error in write_errors):
+                raise
+            target.bulk_write([operations[error["index"]] for error in write_errors], ordered=False)
@@ -0,0 +1,14 @@
+# migrations/versions/__init__.py
+# Every migration, in the order they were written. Add new ones at the end
+# with the next version number; never renumber or edit one that has shipped.
+from .m0001_read_by import ReadByMigration
+from .m0002_conversation_key import ConversationKeyMigration
+from .m0003_read_cursors import ReadCursorsMigration
+from .m0004_conversation_summaries import ConversationSummariesMigration
+
+MIGRATIONS = [
+    ReadByMigration(),
+    ConversationKeyMigration(),
+    ReadCursorsMigration(),
+    ConversationSummariesMigration(),
+]
@@ -0,0 +1,42 @@
+# migrations/versions/m0001_read_by.py
+from pymongo.operations import UpdateOne
+
+from ..base import Migration
+
+class ReadByMigration(Migration):
+    """
+    Moves messages from the old 'status' field to the 'read_by' array
+    (formerly migrate_messages.py). Entries are {"id", "role"} identities,
+    the shape 0003_read_cursors folds into read watermarks.
+    """
+    version = 1
+    name = "read_by"
+    projection = {"type": 1, "sender": 1, "receiver": 1, "status": 1}
+
+    def pending_filter(self):
+        return {"status": {"$exists": True}}
+
+    def migrate(self, message):
+        read_by_list = []
+
+        # Sender has always read the message
+        sender = message.get("sender")
+        if sender and sender.get("id"):
+            read_by_list.append({"id": sender["id"], "role": sender.get("role")})
+
+        # For private messages, the receiver has read it once it was received.
+        # For group messages, we can only assume the sender read it.
+        if message.get("type") == "private" and message["status"] in ["received", "read"]:
+            receiver = message.get("receiver")
+            if receiver and receiver.get("id"):
+                identity = {"id": receiver["id"], "role": receiver.get("role")}
+                if identity not in read_by_list:
+                    read_by_list.append(identity)
+
+        return UpdateOne(
+            {"_id": message["_id"]},
+            {
+                "$set": {"read_by": read_by_list},
+                "$unset": {"status": ""} # Remove the old 'status' field
+            }
+        )
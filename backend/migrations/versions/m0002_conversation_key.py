@@ -0,0 +1,27 @@
+# migrations/versions/m0002_conversation_key.py
+from pymongo.operations import UpdateOne
+
+from app.db.conversations import conversation_key_for_message
+from ..base import Migration
+
+class ConversationKeyMigration(Migration):
+    """
+    Stamps 'conversation_key' on messages stored before it existed, so
+    history reads are single (conversation_key, timestamp) range scans.
+    """
+    version = 2
+    name = "conversation_key"
+    projection = {"type": 1, "sender": 1, "receiver": 1, "group": 1}
+
+    def pending_filter(self):
+        return {
+            "conversation_key": {"$exists": False},
+            # Malformed legacy messages have no conversation to belong to
+            "$or": [{"group.id": {"$exists": True}}, {"receiver.id": {"$exists": True}}],
+        }
+
+    def migrate(self, message):
+        return UpdateOne(
+            {"_id": message["_id"]},
+            {"$set": {"conversation_key": conversation_key_for_message(message)}},
+        )
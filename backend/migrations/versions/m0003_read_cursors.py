@@ -0,0 +1,79 @@
+# migrations/versions/m0003_read_cursors.py
+from pymongo import ASCENDING, IndexModel
+from pymongo.operations import UpdateOne
+
+from app.db.read_cursors import READS_COLLECTION, cursor_filter, group_conversation, private_conversation
+from ..base import Migration
+
+class ReadCursorsMigration(Migration):
+    """
+    Folds the per-message 'read_by' arrays into one read watermark per
+    (reader, conversation) in 'conversation_reads' (formerly
+    migrate_read_cursors.py). The watermark is the newest message the reader
+    had marked as read; writes are $max upserts, so re-reading a message
+    never moves one backwards.
+    """
+    version = 3
+    name = "read_cursors"
+    target_collection = READS_COLLECTION
+    target_indexes = [
+        # Same spec as app/db/indexes.py; concurrent upserts rely on it
+        IndexModel(
+            [("reader.id", ASCENDING), ("reader.role", ASCENDING),
+             ("conversation.type", ASCENDING), ("conversation.id", ASCENDING),
+             ("conversation.role", ASCENDING)],
+            unique=True,
+        ),
+    ]
+    projection = {"type": 1, "sender": 1, "receiver": 1, "group": 1, "read_by": 1, "timestamp": 1}
+
+    def pending_filter(self):
+        return {"read_by.0": {"$exists": True}}
+
+    @staticmethod
+    def _reader(entry, message):
+        """
+        The identity behind a read_by entry. Databases migrated before
+        0001_read_by wrote identities hold bare ids; those can only be the
+        sender's or the receiver's.
+        """
+        if isinstance(entry, dict):
+            return entry if entry.get("id") is not None and entry.get("role") else None
+        for side in ("sender", "receiver"):
+            participant = message.get(side) or {}
+            if participant.get("id") == entry and participant.get("role"):
+                return {"id": participant["id"], "role": participant["role"]}
+        return None
+
+    def migrate_batch(self, messages):
+        watermarks = {}
+        for message in messages:
+            sender = message.get("sender") or {}
+            if message.get("timestamp") is None:
+                continue
+            if message.get("type") == "private":
+                if sender.get("id") is None:
+                    continue
+                conversation = private_conversation(sender["id"], sender.get("role"))
+            elif (message.get("group") or {}).get("id") is not None:
+                conversation = group_conversation(message["group"]["id"])
+            else:
+                continue
+
+            for entry in message["read_by"]:
+                reader = self._reader(entry, message)
+                # The sender's own entry carries no read information
+                if reader is None or (reader["id"], reader["role"]) == (sender.get("id"), sender.get("role")):
+                    continue
+                key = (reader["id"], reader["role"], conversation["type"], conversation["id"], conversation["role"])
+                if key not in watermarks or message["timestamp"] > watermarks[key][2]:
+                    watermarks[key] = (reader, conversation, message["timestamp"])
+
+        return [
+            UpdateOne(
+                cursor_filter({"id": reader["id"], "role": reader["role"]}, conversation),
+                {"$max": {"last_read_at": read_at}},
+                upsert=True,
+            )
+            for reader, conversation, read_at in watermarks.values()
+        ]
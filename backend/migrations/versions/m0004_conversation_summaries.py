@@ -0,0 +1,51 @@
+# migrations/versions/m0004_conversation_summaries.py
+from pymongo import ASCENDING, IndexModel
+
+from app.db.conversation_summaries import SUMMARIES_COLLECTION, summary_updates
+from ..base import Migration
+
+class ConversationSummariesMigration(Migration):
+    """
+    Backfills 'conversation_summaries' from the latest message of every
+    conversation (formerly rebuild_conversation_summaries.py). Each batch
+    writes only its newest message per conversation, and summary updates
+    only ever move a summary forward, so batches can land in any order and
+    the app can keep writing new messages meanwhile.
+    """
+    version = 4
+    name = "conversation_summaries"
+    target_collection = SUMMARIES_COLLECTION
+    target_indexes = [
+        # Same spec as app/db/indexes.py; concurrent upserts rely on it
+        IndexModel(
+            [("conversation_key", ASCENDING), ("owner.role", ASCENDING), ("owner.id", ASCENDING)],
+            unique=True,
+            name="conversation_key_owner",
+        ),
+    ]
+    projection = {
+        "conversation_key": 1, "type": 1, "sender": 1, "receiver": 1, "group": 1,
+        "content": 1, "is_deleted": 1, "timestamp": 1,
+    }
+
+    def pending_filter(self):
+        # Stamped by 0002_conversation_key; messages without one are malformed
+        return {"conversation_key": {"$exists": True}}
+
+    def migrate_batch(self, messages):
+        latest = {}
+        for message in messages:
+            if message.get("timestamp") is None:
+                continue
+            current = latest.get(message["conversation_key"])
+            if current is None or (message["timestamp"], message["_id"]) > (current["timestamp"], current["_id"]):
+                latest[message["conversation_key"]] = message
+
+        operations = []
+        for message in latest.values():
+            try:
+                operations.extend(summary_updates(message))
+            except (KeyError, TypeError):
+                # Malformed legacy message without a sender, receiver or group
+                continue
+        return operations
@@ -0,0 +1,55 @@
+import asyncio
+import redis.asyncio as redis
+from sqlalchemy import select
+
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal, async_engine, connect_to_mongo, close_mongo_connection, get_mongo_db
+from app.models import User, Admin, Group, GroupMember
+from app.cache.unread import reconcile_unread
+
+# IMPORTANT: Run this script from the `backend` directory
+# so it picks up the same settings as the app.
+# Example: python reconcile_unread_counters.py
+# Can run while the app is live, e.g. nightly from cron: counters that change
+# mid-recount are retried, not overwritten.
+
+async def reconcile_counters():
+    """
+    Recounts every user's and admin's unread messages from Mongo and their
+    read watermarks, and rewrites the Redis counters of anyone who drifted
+    (missed increments during an outage, flushed keys, ...).
+    """
+    await connect_to_mongo()
+    mongo_db = await get_mongo_db()
+    redis_client = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+
+    async with AsyncSessionLocal() as db:
+        # Only active memberships: removed members don't count a group's messages
+        memberships = {}
+        for group_id, user_id in await db.execute(
+            select(GroupMember.group_id, GroupMember.user_id).filter(GroupMember.is_member_active == True)
+        ):
+            memberships.setdefault(("user", user_id), []).append(group_id)
+        # Admins are considered active members of all groups in their tenant
+        for group_id, admin_id in await db.execute(select(Group.id, Group.admin_id)):
+            memberships.setdefault(("admin", admin_id), []).append(group_id)
+
+        readers = [("user", user_id) for user_id in await db.scalars(select(User.id))]
+        readers += [("admin", admin_id) for admin_id in await db.scalars(select(Admin.id))]
+
+    drifted = 0
+    for checked, (role, reader_id) in enumerate(readers, start=1):
+        reader = {"id": reader_id, "role": role}
+        if await reconcile_unread(reader, memberships.get((role, reader_id), []), mongo_db, redis_client):
+            drifted += 1
+        if checked % 500 == 0:
+            print(f"Checked {checked} readers, {drifted} repaired...")
+
+    print(f"\nReconciliation complete. Readers checked: {len(readers)}, repaired: {drifted}")
+    await redis_client.close()
+    await close_mongo_connection()
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(reconcile_counters())
@@ -0,0 +1,58 @@
+# tests/conftest.py
+import asyncio
+import json
+import os
+import tempfile
+from typing import Any, Callable, Dict, List, Optional
+
+# app.db.session builds its engines at import time; point them at a throwaway
+# SQLite file before any app module is imported.
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}")
+
+import fakeredis
+import msgpack
+import pytest
+
+from app.websocket.protocol import MSGPACK_SUBPROTOCOL
+
+class FakeWebSocket:
+    """Stands in for a Starlette WebSocket and records every frame sent to it."""
+    def __init__(self, subprotocols: List[str] = ()):
+        self.scope = {"subprotocols": list(subprotocols)}
+        self.sent: List[Dict[str, Any]] = []
+        self.closed_with: Optional[int] = None
+
+    async def accept(self, subprotocol: Optional[str] = None):
+        self.subprotocol = subprotocol
+
+    async def send_text(self, text: str):
+        self.sent.append(json.loads(text))
+
+    async def send_bytes(self, data: bytes):
+        assert self.subprotocol == MSGPACK_SUBPROTOCOL
+        self.sent.append(msgpack.unpackb(data, raw=False))
+
+    async def close(self, code: int = 1000):
+        self.closed_with = code
+
+    def events(self, name: str) -> List[Dict[str, Any]]:
+        return [frame for frame in self.sent if frame.get("event") == name]
+
+async def eventually(predicate: Callable[[], bool], timeout: float = 2.0):
+    """Waits for background writers and pub/sub listeners to catch up."""
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("condition not met in time")
+        await asyncio.sleep(0.01)
+
+@pytest.fixture
+def redis_server():
+    """One in-memory Redis shared by every client (i.e. every app instance) in a test."""
+    return fakeredis.FakeServer()
+
+@pytest.fixture
+def make_redis(redis_server):
+    def make():
+        return fakeredis.aioredis.FakeRedis(server=redis_server, decode_responses=True)
+    return make
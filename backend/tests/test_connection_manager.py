@@ -0,0 +1,93 @@
+# tests/test_connection_manager.py
+import pytest
+
+from app.websocket.connection_manager import ConnectionManager
+from tests.conftest import FakeWebSocket, eventually
+
+@pytest.fixture
+async def nodes(make_redis):
+    """Two app instances routing through the same Redis."""
+    managers = [ConnectionManager(node_id="node-a"), ConnectionManager(node_id="node-b")]
+    for manager in managers:
+        await manager.start(make_redis())
+    yield managers
+    for manager in managers:
+        await manager.stop()
+
+async def test_delivers_to_session_held_by_other_node(nodes):
+    node_a, node_b = nodes
+    websocket = FakeWebSocket()
+    await node_b.connect("user-1", websocket, tenant_id=7)
+
+    await node_a.send_personal_message({"event": "ping"}, "user-1")
+
+    await eventually(lambda: websocket.events("ping"))
+    assert len(websocket.events("ping")) == 1
+
+async def test_only_last_session_goes_offline(nodes):
+    node_a, node_b = nodes
+    first_session, first_is_first = await node_a.connect("user-1", FakeWebSocket(), tenant_id=7)
+    second_session, second_is_first = await node_b.connect("user-1", FakeWebSocket(), tenant_id=7)
+    assert first_is_first and not second_is_first
+
+    assert await node_a.disconnect("user-1", first_session) is False
+    assert await node_b.is_connected("user-1")
+    assert await node_b.disconnect("user-1", second_session) is True
+    assert not await node_a.is_connected("user-1")
+
+async def test_forced_close_leaves_offline_to_endpoint_disconnect(nodes):
+    node_a, node_b = nodes
+    websocket = FakeWebSocket()
+    session_id, _ = await node_b.connect("user-1", websocket, tenant_id=7)
+
+    await node_a.close_connection("user-1")
+
+    await eventually(lambda: websocket.closed_with == 1008)
+    # Still registered until the endpoint's disconnect, which reports it offline
+    assert await node_a.is_connected("user-1")
+    assert await node_b.disconnect("user-1", session_id) is True
+    assert not await node_a.is_connected("user-1")
+
+async def test_sessions_of_dead_node_are_swept(nodes):
+    node_a, node_b = nodes
+    await node_b.connect("user-2", FakeWebSocket(), tenant_id=7)
+    await node_a.connect("user-3", FakeWebSocket(), tenant_id=7)
+
+    # node-b dies: its heartbeat stops and its alive key expires
+    node_b._heartbeat_task.cancel()
+    await node_b.redis_client.delete(f"ws:node:{node_b.node_id}:alive")
+
+    assert await node_a.reap_dead_nodes() == [(7, "user-2")]
+    assert not await node_a.is_connected("user-2")
+    assert await node_a.is_connected("user-3")
+    # A second sweep has nothing left to do
+    assert await node_a.reap_dead_nodes() == []
+
+async def test_stop_reports_identities_whose_last_session_was_here(make_redis):
+    went_offline = []
+
+    async def on_offline(tenant_id, connection_id):
+        went_offline.append((tenant_id, connection_id))
+
+    manager = ConnectionManager(node_id="node-c")
+    await manager.start(make_redis(), on_offline=on_offline)
+    session_id, _ = await manager.connect("admin-4", FakeWebSocket(), tenant_id=4)
+    await manager.stop()
+
+    assert went_offline == [(4, "admin-4")]
+    # The endpoint's own disconnect afterwards doesn't report it a second time
+    assert await manager.disconnect("admin-4", session_id) is False
+
+async def test_tenant_broadcast_reaches_every_node_once(nodes):
+    node_a, node_b = nodes
+    local, remote, other_tenant = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+    await node_a.connect("user-1", local, tenant_id=7)
+    await node_b.connect("user-2", remote, tenant_id=7)
+    await node_b.connect("user-3", other_tenant, tenant_id=8)
+
+    await node_a.broadcast_to_tenant({"event": "presence_delta"}, 7)
+
+    await eventually(lambda: remote.events("presence_delta"))
+    assert len(local.events("presence_delta")) == 1
+    assert len(remote.events("presence_delta")) == 1
+    assert other_tenant.events("presence_delta") == []
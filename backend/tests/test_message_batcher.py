@@ -0,0 +1,85 @@
+# tests/test_message_batcher.py
+import asyncio
+
+import pytest
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from app.db.message_batcher import MessageBatcher
+
+class FakeMessages:
+    """insert_many that rejects documents whose seq was already stored, like the unique index."""
+    def __init__(self):
+        self.stored = []
+
+    async def insert_many(self, documents, ordered=True):
+        assert ordered is False
+        write_errors = []
+        for index, document in enumerate(documents):
+            document.setdefault("_id", ObjectId())
+            key = (document["conversation_key"], document["seq"])
+            if key in {(d["conversation_key"], d["seq"]) for d in self.stored}:
+                write_errors.append({"index": index, "code": 11000, "errmsg": "duplicate key"})
+            else:
+                self.stored.append(document)
+        if write_errors:
+            raise BulkWriteError({"writeErrors": write_errors, "nInserted": len(documents) - len(write_errors)})
+
+@pytest.fixture
+async def batcher():
+    batcher = MessageBatcher(window_ms=10, max_batch_size=100)
+    batcher.collection = FakeMessages()
+    await batcher.start(batcher.collection)
+    yield batcher
+    await batcher.stop()
+
+async def test_one_bad_document_fails_only_its_own_message(batcher):
+    futures = [
+        batcher.submit({"conversation_key": "g:1", "seq": 1}),
+        batcher.submit({"conversation_key": "g:1", "seq": 1}),
+        batcher.submit({"conversation_key": "g:2", "seq": 1}),
+        batcher.submit({"conversation_key": "g:1", "seq": 2}),
+    ]
+
+    first, duplicate, other_conversation, later = [await _outcome(f) for f in futures]
+
+    assert isinstance(first, ObjectId)
+    assert isinstance(duplicate, BulkWriteError)
+    assert duplicate.details["writeErrors"][0]["index"] == 1
+    assert isinstance(other_conversation, ObjectId)
+    assert isinstance(later, ObjectId)
+    assert len(batcher.collection.stored) == 3
+
+async def _outcome(future):
+    try:
+        return await future
+    except Exception as e:
+        return e
+
+async def test_stop_lets_an_in_flight_batch_finish():
+    collection = FakeMessages()
+    inserting, release = asyncio.Event(), asyncio.Event()
+    insert_many = collection.insert_many
+
+    async def blocked_insert_many(documents, ordered=True):
+        inserting.set()
+        await release.wait()
+        await insert_many(documents, ordered=ordered)
+    collection.insert_many = blocked_insert_many
+
+    batcher = MessageBatcher(window_ms=0, max_batch_size=100)
+    await batcher.start(collection)
+    in_flight = batcher.submit({"conversation_key": "g:1", "seq": 1})
+    await inserting.wait()
+
+    stopping = asyncio.create_task(batcher.stop())
+    queued = batcher.submit({"conversation_key": "g:1", "seq": 2})
+    await asyncio.sleep(0.01)
+    assert not stopping.done()
+
+    release.set()
+    await stopping
+
+    assert isinstance(await in_flight, ObjectId)
+    assert isinstance(await queued, ObjectId)
+    assert len(collection.stored) == 2
@@ -0,0 +1,49 @@
+# tests/test_message_out.py
+import datetime
+import json
+
+import pytest
+from bson import ObjectId
+
+from app.core.responses import encode_json
+from app.schemas.message import PaginatedMessageResponse, message_out
+
+ADMIN = {"id": 2, "username": "boss", "role": "admin"}
+USER = {"id": 1, "username": "ann", "role": "user"}
+
+MESSAGES = {
+    "private": {
+        "_id": ObjectId(), "type": "private", "conversation_key": "p:admin-2|user-1",
+        "sender": ADMIN, "receiver": USER, "content": {"text": "hi"},
+        "timestamp": datetime.datetime(2024, 1, 2, 3, 4, 5, 678901), "seq": 12,
+        "read_by": [{"id": 1, "role": "user"}],
+    },
+    "group": {
+        "_id": ObjectId(), "type": "group", "conversation_key": "g:7",
+        "sender": USER, "group": {"id": 7, "name": "team"},
+        "content": {"image": "/uploads/a.png"},
+        "timestamp": datetime.datetime(2024, 1, 2, 3, 4, 5),
+    },
+    "deleted": {
+        "_id": ObjectId(), "type": "private", "conversation_key": "p:admin-2|user-1",
+        "sender": USER, "receiver": ADMIN, "content": {"text": None},
+        "timestamp": datetime.datetime(2024, 1, 3), "is_deleted": True,
+    },
+    # A `fields` projection that leaves the content out
+    "without_content": {
+        "_id": ObjectId(), "type": "group", "conversation_key": "g:7",
+        "sender": ADMIN, "group": {"id": 7, "name": "team"},
+        "timestamp": datetime.datetime(2024, 1, 4, 0, 0, 0, 1),
+    },
+}
+
+@pytest.mark.parametrize("name", MESSAGES)
+def test_message_out_matches_the_response_model(name):
+    message = MESSAGES[name]
+    page = {"next_cursor": "abc", "prev_cursor": None, "next_after_seq": None}
+
+    fast = encode_json({"messages": [message_out(message, "read")], **page})
+    validated = PaginatedMessageResponse(messages=[{**message, "status": "read"}], **page)
+
+    # What FastAPI sends for a response_model: JSON mode, by alias
+    assert json.loads(fast) == json.loads(validated.model_dump_json(by_alias=True))
@@ -0,0 +1,77 @@
+# tests/test_migrations.py
+from datetime import datetime
+
+from bson import ObjectId
+
+from migrations.versions import MIGRATIONS
+from migrations.versions.m0001_read_by import ReadByMigration
+from migrations.versions.m0003_read_cursors import ReadCursorsMigration
+from migrations.versions.m0004_conversation_summaries import ConversationSummariesMigration
+
+def _private_message(status, timestamp, **fields):
+    return {
+        "_id": ObjectId(),
+        "type": "private",
+        "conversation_key": "p:admin-2|user-1",
+        "sender": {"id": 2, "role": "admin"},
+        "receiver": {"id": 1, "role": "user"},
+        "content": {"text": "hi"},
+        "status": status,
+        "timestamp": timestamp,
+        **fields,
+    }
+
+def _apply_read_by(message):
+    """What 0001's write leaves in the document."""
+    update = ReadByMigration().migrate(message)._doc
+    migrated = {**message, **update["$set"]}
+    del migrated["status"]
+    return migrated
+
+def _watermarks(operations):
+    return {
+        (op._filter["reader.id"], op._filter["reader.role"], op._filter["conversation.type"],
+         op._filter["conversation.id"], op._filter["conversation.role"]): op._doc["$max"]["last_read_at"]
+        for op in operations
+    }
+
+def test_versions_are_unique_and_ordered():
+    versions = [migration.version for migration in MIGRATIONS]
+    assert versions == sorted(set(versions))
+
+def test_read_by_output_becomes_read_cursors():
+    read = _apply_read_by(_private_message("read", datetime(2024, 1, 2)))
+    unread = _apply_read_by(_private_message("sent", datetime(2024, 1, 3)))
+    migration = ReadCursorsMigration()
+
+    assert read["read_by"] == [{"id": 2, "role": "admin"}, {"id": 1, "role": "user"}]
+    watermarks = _watermarks(migration.migrate_batch([read, unread]))
+
+    # The receiver read up to the older message; the sender's own entries are ignored
+    assert watermarks == {(1, "user", "private", 2, "admin"): datetime(2024, 1, 2)}
+
+def test_read_cursors_resolve_legacy_bare_ids():
+    legacy = _private_message("read", datetime(2024, 1, 2), read_by=[2, 1])
+    del legacy["status"]
+
+    watermarks = _watermarks(ReadCursorsMigration().migrate_batch([legacy]))
+
+    assert watermarks == {(1, "user", "private", 2, "admin"): datetime(2024, 1, 2)}
+
+def test_summaries_write_only_each_conversations_latest_message():
+    older = _private_message("read", datetime(2024, 1, 2))
+    newer = _private_message("read", datetime(2024, 1, 3), content={"text": "latest"})
+    group = {
+        "_id": ObjectId(), "type": "group", "conversation_key": "g:7",
+        "sender": {"id": 1, "role": "user"}, "group": {"id": 7, "name": "team"},
+        "timestamp": datetime(2024, 1, 1),
+    }
+    malformed = {"_id": ObjectId(), "type": "private", "conversation_key": "p:x", "timestamp": datetime(2024, 1, 1)}
+
+    operations = ConversationSummariesMigration().migrate_batch([newer, older, group, malformed])
+
+    # Both sides of the private conversation, plus the group's shared summary
+    assert len(operations) == 3
+    written = {op._filter["conversation_key"]: op._doc[1]["$set"]["last_message_id"] for op in operations}
+    assert written["p:admin-2|user-1"]["$cond"][1] == {"$literal": newer["_id"]}
+    assert written["g:7"]["$cond"][1] == {"$literal": group["_id"]}
@@ -0,0 +1,96 @@
+# tests/test_presence_aggregator.py
+import asyncio
+
+import pytest
+
+import app.websocket.presence as presence
+from app.websocket.connection_manager import ConnectionManager
+from app.websocket.presence import PresenceAggregator
+from tests.conftest import FakeWebSocket
+
+TENANT = 7
+
+@pytest.fixture
+async def tenant_sockets(monkeypatch):
+    """Three online members of TENANT and one of another tenant, on a local-only manager."""
+    manager = ConnectionManager(node_id="node-a")
+    monkeypatch.setattr(presence, "manager", manager)
+    sockets = {}
+    for connection_id, tenant_id in (("admin-7", TENANT), ("user-1", TENANT), ("user-2", TENANT), ("user-9", 8)):
+        sockets[connection_id] = FakeWebSocket()
+        await manager.connect(connection_id, sockets[connection_id], tenant_id)
+    yield sockets
+    for connection_id in list(manager.active_connections):
+        for session_id in list(manager.active_connections.get(connection_id, {})):
+            await manager.disconnect(connection_id, session_id)
+
+async def drain():
+    # Let the per-connection writer tasks send what was queued
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+async def test_changes_in_one_window_are_one_frame_per_recipient(tenant_sockets):
+    aggregator = PresenceAggregator(default_window_ms=50)
+    for version in range(1, 21):
+        user_id = 100 + version % 5
+        status = "online" if version % 2 else "offline"
+        await aggregator.record(TENANT, user_id, "user", status, version)
+
+    await asyncio.sleep(0.1)
+    await drain()
+
+    for connection_id in ("admin-7", "user-1", "user-2"):
+        deltas = tenant_sockets[connection_id].events("presence_delta")
+        assert len(deltas) == 1
+        # Later changes for the same user replace earlier ones
+        assert len(deltas[0]["changes"]) == 5
+        assert deltas[0]["version"] == 20
+    assert tenant_sockets["user-9"].events("presence_delta") == []
+
+async def test_latest_change_per_user_wins(tenant_sockets):
+    aggregator = PresenceAggregator(default_window_ms=50)
+    await aggregator.record(TENANT, 100, "user", "online", 1)
+    await aggregator.record(TENANT, 100, "user", "offline", 2, "2024-01-01T00:00:00Z")
+
+    await asyncio.sleep(0.1)
+    await drain()
+
+    [delta] = tenant_sockets["user-1"].events("presence_delta")
+    assert delta["changes"] == [{
+        "user": {"id": 100, "role": "user"},
+        "status": "offline",
+        "timestamp": "2024-01-01T00:00:00Z",
+        "version": 2,
+    }]
+
+async def test_zero_window_sends_every_change(tenant_sockets):
+    aggregator = PresenceAggregator(default_window_ms=0)
+    for version in range(1, 4):
+        await aggregator.record(TENANT, 100 + version, "user", "online", version)
+    await drain()
+
+    assert len(tenant_sockets["user-1"].events("presence_delta")) == 3
+
+async def test_windows_are_per_tenant(tenant_sockets):
+    aggregator = PresenceAggregator(default_window_ms=50, window_overrides={8: 0})
+    await aggregator.record(8, 101, "user", "online", 1)
+    await aggregator.record(TENANT, 102, "user", "online", 1)
+    await drain()
+
+    assert len(tenant_sockets["user-9"].events("presence_delta")) == 1
+    assert tenant_sockets["user-1"].events("presence_delta") == []
+    await aggregator.flush_all()
+    await drain()
+    assert len(tenant_sockets["user-1"].events("presence_delta")) == 1
+
+async def test_members_leaving_stop_receiving(tenant_sockets):
+    aggregator = PresenceAggregator(default_window_ms=0)
+    manager = presence.manager
+    [session_id] = manager.active_connections["user-2"]
+    await manager.disconnect("user-2", session_id)
+
+    await aggregator.record(TENANT, 101, "user", "online", 1)
+    await drain()
+
+    assert tenant_sockets["user-2"].events("presence_delta") == []
+    assert len(tenant_sockets["user-1"].events("presence_delta")) == 1
@@ -0,0 +1,53 @@
+# tests/test_revocation.py
+import time
+
+import pytest
+
+from app.security.jwt import create_access_token, create_refresh_token, get_token_id
+from app.security.revocation import RevocationList
+
+@pytest.fixture
+async def revocations(make_redis):
+    revocation_list = RevocationList(capacity=1000, error_rate=0.01, rebuild_interval_seconds=0)
+    await revocation_list.start(make_redis())
+    yield revocation_list
+    await revocation_list.stop()
+
+async def test_revoked_token_is_confirmed_in_redis(revocations):
+    await revocations.revoke("jti-1", time.time() + 60, revocations.redis_client)
+
+    assert await revocations.is_revoked("jti-1")
+    assert not await revocations.is_revoked("jti-2")
+
+async def test_filter_hit_not_in_redis_is_not_revoked(revocations):
+    # A false positive (or an expired revocation) is settled by Redis
+    revocations._filter.add("jti-3")
+
+    assert not await revocations.is_revoked("jti-3")
+
+async def test_rebuild_drops_expired_revocations(revocations):
+    await revocations.revoke("jti-4", time.time() + 60, revocations.redis_client)
+    await revocations.revoke("jti-5", time.time() + 60, revocations.redis_client)
+    await revocations.redis_client.delete("auth:revoked:jti-5")  # as if its token expired
+
+    await revocations.rebuild()
+
+    assert "jti-4" in revocations._filter
+    assert "jti-5" not in revocations._filter
+
+async def test_refresh_keeps_the_refresh_token_revocable(revocations):
+    claims = {"sub": "ann", "role": "user", "tenant_id": 1}
+    redis_client = revocations.redis_client
+    # Login issues both tokens, a refresh only a new access token
+    login_tokens = [create_access_token(claims), create_refresh_token(claims)]
+    for token in login_tokens + [create_access_token(claims)]:
+        jti, exp = get_token_id(token)
+        await revocations.track("user", "ann", jti, exp, redis_client)
+
+    refresh_jti, refresh_exp = get_token_id(login_tokens[1])
+    # The subject's zset lives as long as the refresh token, not the newest access token
+    assert await redis_client.ttl("auth:tokens:user:ann") > refresh_exp - time.time() - 5
+
+    await revocations.revoke_subject("user", "ann", redis_client)
+
+    assert await revocations.is_revoked(refresh_jti)
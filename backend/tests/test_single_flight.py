@@ -0,0 +1,96 @@
+# tests/test_single_flight.py
+import asyncio
+
+import pytest
+from sqlalchemy import event
+
+from app.cache.single_flight import SingleFlight
+from app.cache.tenant_members import get_tenant_connection_ids
+from app.db.session import AsyncSessionLocal, async_engine
+from app.models import Admin, Base, User
+
+CONNECTS = 1000
+
+@pytest.fixture
+async def tenant():
+    """An admin with 50 users in the SQLite test database."""
+    async with async_engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+    async with AsyncSessionLocal() as db:
+        admin = Admin(username="tenant-admin", password_hash="x", admin_key="key")
+        db.add(admin)
+        await db.flush()
+        db.add_all(User(username=f"user-{i}", password_hash="x", admin_id=admin.id) for i in range(50))
+        await db.commit()
+        admin_id = admin.id
+    yield admin_id
+    async with async_engine.begin() as connection:
+        await connection.run_sync(Base.metadata.drop_all)
+
+@pytest.fixture
+def user_queries():
+    """Counts SELECTs against the users table."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT") and "FROM users" in statement:
+            statements.append(statement)
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", record)
+    yield statements
+    event.remove(async_engine.sync_engine, "before_cursor_execute", record)
+
+async def test_concurrent_cold_connects_load_the_tenant_once(tenant, user_queries, make_redis):
+    redis_client = make_redis()
+
+    results = await asyncio.gather(*[
+        get_tenant_connection_ids(tenant, redis_client) for _ in range(CONNECTS)
+    ])
+
+    assert len(user_queries) == 1
+    expected = {f"user-{i}" for i in range(1, 51)} | {f"admin-{tenant}"}
+    assert all(result == expected for result in results)
+    assert await redis_client.smembers(f"tenant:{tenant}:members") == expected
+
+async def test_joiners_survive_the_leader_being_cancelled():
+    single_flight = SingleFlight()
+    leader_started = asyncio.Event()
+    loads = []
+
+    async def slow_load():
+        loads.append("leader")
+        leader_started.set()
+        await asyncio.sleep(10)
+
+    async def load():
+        loads.append("retry")
+        await asyncio.sleep(0.01)
+        return {"admin-1"}
+
+    leader = asyncio.create_task(single_flight.run("k", slow_load))
+    await leader_started.wait()
+    joiners = [asyncio.create_task(single_flight.run("k", load)) for _ in range(10)]
+    await asyncio.sleep(0)
+
+    leader.cancel()
+    results = await asyncio.gather(*joiners)
+
+    assert results == [{"admin-1"}] * 10
+    assert loads == ["leader", "retry"]
+    with pytest.raises(asyncio.CancelledError):
+        await leader
+
+async def test_joiners_share_the_leaders_error():
+    single_flight = SingleFlight()
+    release = asyncio.Event()
+
+    async def failing_load():
+        await release.wait()
+        raise RuntimeError("database down")
+
+    callers = [asyncio.create_task(single_flight.run("k", failing_load)) for _ in range(5)]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*callers, return_exceptions=True)
+
+    assert all(isinstance(result, RuntimeError) for result in results)
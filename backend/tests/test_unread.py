@@ -0,0 +1,45 @@
+# tests/test_unread.py
+from datetime import datetime, timedelta
+
+import pytest
+
+import app.cache.unread as unread
+from app.cache.unread import record_unread, settle_unread, get_unread
+
+READER = {"id": 1, "role": "user"}
+PARTNER = {"id": 2, "role": "admin", "username": "boss"}
+CONVERSATION = {"type": "private", "id": 2, "role": "admin"}
+
+def _message(timestamp):
+    return {"type": "private", "sender": PARTNER, "receiver": {**READER, "username": "ann"},
+            "content": {"text": "hi"}, "timestamp": timestamp}
+
+@pytest.fixture
+def redis_client(make_redis):
+    return make_redis()
+
+async def test_read_covering_the_latest_counted_message_clears(redis_client):
+    sent_at = datetime(2024, 1, 2, 3, 4, 5, 678901)
+    await record_unread(_message(sent_at), ["user-1"], redis_client)
+
+    # Mongo hands the timestamp back at millisecond precision
+    remaining = await settle_unread(READER, CONVERSATION, sent_at.replace(microsecond=678000), None, redis_client)
+
+    assert remaining == 0
+    assert await get_unread("user-1", redis_client) == []
+
+async def test_read_behind_the_latest_counted_message_recounts(redis_client, monkeypatch):
+    first, second = datetime(2024, 1, 2), datetime(2024, 1, 2) + timedelta(seconds=5)
+    await record_unread(_message(first), ["user-1"], redis_client)
+    await record_unread(_message(second), ["user-1"], redis_client)
+
+    async def recount(reader, conversation, mongo_db):
+        return {"count": 1, "latest": _message(second)}
+    monkeypatch.setattr(unread, "count_conversation_unread", recount)
+
+    # The client had only displayed the first message
+    remaining = await settle_unread(READER, CONVERSATION, first, None, redis_client)
+
+    assert remaining == 1
+    [notification] = await get_unread("user-1", redis_client)
+    assert notification["unread_count"] == 1
@@ -295,6 +295,28 @@ export default function ChatPage() {
       });
     }
 
+    // The server couldn't store a message we sent; drop its optimistic copy
+    if (lastEvent.event === "message_failed") {
+      const { temp_id, conversation, detail } = lastEvent;
+      const conversationKey = `${conversation.role || conversation.type}-${
+        conversation.id
+      }`;
+      console.error(`Message ${temp_id} failed:`, detail);
+
+      setConversationsCache((prevCache) => {
+        const conversationData = prevCache.get(conversationKey);
+        if (!conversationData) return prevCache;
+        const newCache = new Map(prevCache);
+        newCache.set(conversationKey, {
+          ...conversationData,
+          messages: conversationData.messages.filter(
+            (msg) => msg._id !== temp_id
+          ),
+        });
+        return newCache;
+      });
+    }
+
     // --- HANDLE MESSAGE DELETION ---
     if (lastEvent.event === "message_deleted") {
       const { message_id, conversation } = lastEvent;
@@ -537,17 +559,31 @@ export default function ChatPage() {
 
       setSelectedConversation(conversation);
       setActiveChatId(compositeKey);
-      if (unreadCounts.get(compositeKey)) {
-        clearUnreadCount(compositeKey);
-
+      const hasUnread = Boolean(unreadCounts.get(compositeKey));
+      // Reads up to the newest stored message on screen (optimistic ones have temp ids)
+      const markRead = (messages: Message[]) => {
+        const lastDisplayed = [...messages]
+          .reverse()
+          .find((msg) => !msg._id.startsWith("temp-"));
+        if (!lastDisplayed) return;
         if (conversation.type === "group") {
-          sendMessage({ event: "messages_read", group_id: conversation.id });
+          sendMessage({
+            event: "messages_read",
+            group_id: conversation.id,
+            last_message_id: lastDisplayed._id,
+          });
         } else {
           sendMessage({
             event: "messages_read",
             partner: { id: conversation.id, role: conversation.type },
+            last_message_id: lastDisplayed._id,
           });
         }
+      };
+      if (hasUnread) {
+        clearUnreadCount(compositeKey);
+        const cached = conversationsCache.get(compositeKey);
+        if (cached) markRead(cached.messages);
       }
       // --- END NOTIFICATION LOGIC ---
 
@@ -574,6 +610,7 @@ export default function ChatPage() {
             });
             return newMap;
           });
+          if (hasUnread) markRead(data);
         } finally {
           setIsLoadingMessages((prev) =>
             new Map(prev).set(compositeKey, false)
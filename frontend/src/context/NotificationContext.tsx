@@ -127,15 +127,18 @@ export const NotificationProvider = ({ children }: { children: ReactNode }) => {
 
         // Mark as read if it's the active chat AND user is viewing the page
         if (incomingChatId === currentActiveChatId && isPageVisible) {
+          // Read up to this message, not whatever the server has by now
           if (msg.type === "private") {
             sendMessage({
               event: "messages_read",
               partner: { id: msg.sender.id, role: msg.sender.role },
+              last_message_id: msg._id,
             });
           } else {
             sendMessage({
               event: "messages_read",
               group_id: msg.group!.id,
+              last_message_id: msg._id,
             });
           }
         } else {
@@ -81,6 +81,26 @@ export const PresenceProvider = ({ children }: { children: ReactNode }) => {
         },
       }));
     }
+
+    // Case 3: The backend coalesces presence changes and sends them in batches.
+    if (lastEvent.event === "presence_delta") {
+      const changes: {
+        user: { id: number; role: string };
+        status: "online" | "offline";
+        timestamp: string | null;
+      }[] = lastEvent.changes;
+
+      setPresence((prevPresence) => {
+        const nextPresence = { ...prevPresence };
+        for (const { user, status, timestamp } of changes) {
+          nextPresence[`${user.role}-${user.id}`] = {
+            status: status,
+            lastSeen: status === "offline" ? timestamp : null,
+          };
+        }
+        return nextPresence;
+      });
+    }
   }, [lastEvent]); // Dependency: Runs only when a new lastEvent arrives
 
   return (